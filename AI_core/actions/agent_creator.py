@@ -1,6 +1,7 @@
 import json
 import re
 import json_repair
+from ..llm_provider.governor import Priority
 from ..utils.llm import create_chat_completion
 from ..prompts import auto_agent_instructions
 
@@ -33,7 +34,9 @@ async def choose_agent(
             temperature=0.15,
             llm_provider=cfg.smart_llm_provider,
             llm_kwargs=cfg.llm_kwargs,
+            cfg=cfg,
             cost_callback=cost_callback,
+            priority=Priority.BACKGROUND,
         )
 
         agent_dict = json.loads(response)
@@ -1,4 +1,5 @@
 import json_repair
+from ..llm_provider.governor import Priority
 from ..utils.llm import create_chat_completion
 from ..prompts import generate_search_queries_prompt
 from typing import Any, List, Dict
@@ -60,7 +61,9 @@ async def generate_sub_queries(
             llm_provider=cfg.strategic_llm_provider,
             max_tokens=None,
             llm_kwargs=cfg.llm_kwargs,
+            cfg=cfg,
             cost_callback=cost_callback,
+            priority=Priority.BACKGROUND,
         )
     except Exception as e:
         logger.warning(f"Error with strategic LLM: {e}. Falling back to smart LLM.")
@@ -71,7 +74,9 @@ async def generate_sub_queries(
             max_tokens=cfg.smart_token_limit,
             llm_provider=cfg.smart_llm_provider,
             llm_kwargs=cfg.llm_kwargs,
+            cfg=cfg,
             cost_callback=cost_callback,
+            priority=Priority.BACKGROUND,
         )
 
     return json_repair.loads(response)
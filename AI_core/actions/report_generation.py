@@ -1,6 +1,7 @@
 import asyncio
 from typing import List, Dict, Any
 from ..config.config import Config
+from ..llm_provider.governor import Priority
 from ..utils.llm import create_chat_completion
 from ..utils.logger import get_formatted_logger
 from ..prompts import (
@@ -50,7 +51,9 @@ async def write_report_introduction(
             websocket=websocket,
             max_tokens=config.smart_token_limit,
             llm_kwargs=config.llm_kwargs,
+            cfg=config,
             cost_callback=cost_callback,
+            priority=Priority.INTERACTIVE,
         )
         return introduction
     except Exception as e:
@@ -93,7 +96,9 @@ async def write_conclusion(
             websocket=websocket,
             max_tokens=config.smart_token_limit,
             llm_kwargs=config.llm_kwargs,
+            cfg=config,
             cost_callback=cost_callback,
+            priority=Priority.INTERACTIVE,
         )
         return conclusion
     except Exception as e:
@@ -136,7 +141,9 @@ async def summarize_url(
             websocket=websocket,
             max_tokens=config.smart_token_limit,
             llm_kwargs=config.llm_kwargs,
+            cfg=config,
             cost_callback=cost_callback,
+            priority=Priority.INTERACTIVE,
         )
         return summary
     except Exception as e:
@@ -181,7 +188,9 @@ async def generate_draft_section_titles(
             websocket=None,
             max_tokens=config.smart_token_limit,
             llm_kwargs=config.llm_kwargs,
+            cfg=config,
             cost_callback=cost_callback,
+            priority=Priority.INTERACTIVE,
         )
         return section_titles.split("\n")
     except Exception as e:
@@ -243,7 +252,9 @@ async def generate_report(
             websocket=websocket,
             max_tokens=cfg.smart_token_limit,
             llm_kwargs=cfg.llm_kwargs,
+            cfg=cfg,
             cost_callback=cost_callback,
+            priority=Priority.INTERACTIVE,
         )
     except Exception as e:
         print(f"Error in generate_report: {e}")
@@ -1,11 +1,14 @@
-from typing import Optional, List, Dict, Any, Set
+from typing import Optional, List, Dict, Any, Set, Union
 import json
 
 from .config import Config
 from .memory import Memory
+from .memory.pages import PageStore
 from .utils.enum import ReportSource, ReportType, Tone
-from .llm_provider import GenericLLMProvider
 from .vector_store import VectorStoreWrapper
+from .context.splitter import ChunkSplitter
+from .context.sections import WrittenSectionIndex
+from .utils.usage import TokenCount, TokenUsage, usage_stage
 
 # Research skills
 from .skills.researcher import ResearchConductor
@@ -50,17 +53,20 @@ class RepintelAI:
         self.query = query
         self.report_type = report_type
         self.cfg = Config(config_path)
-        self.llm = GenericLLMProvider(self.cfg)
         self.report_source = getattr(
             self.cfg, 'report_source', None) or report_source
         self.report_format = report_format
         self.max_subtopics = max_subtopics
         self.tone = tone if isinstance(tone, Tone) else Tone.Objective
         self.source_urls = source_urls
+        # Page bodies of scraped sources and of indexed chunks, spilled to disk beyond a memory budget
+        self.page_store = PageStore.from_config(self.cfg)
         self.research_sources = []  # The list of scraped sources including title, content and images
         self.research_images = []  # The list of selected research images
         self.documents = documents
-        self.vector_store = VectorStoreWrapper(vector_store) if vector_store else None
+        self.vector_store = VectorStoreWrapper(
+            vector_store, splitter=ChunkSplitter.from_config(self.cfg)
+        ) if vector_store else None
         self.vector_store_filter = vector_store_filter
         self.websocket = websocket
         self.agent = agent
@@ -72,9 +78,18 @@ class RepintelAI:
         self.context = context
         self.headers = headers or {}
         self.research_costs = 0.0
+        self.token_usage = TokenUsage()
         self.retrievers = get_retrievers(self.headers, self.cfg)
         self.memory = Memory(
-            self.cfg.embedding_provider, self.cfg.embedding_model, **self.cfg.embedding_kwargs
+            self.cfg.embedding_provider,
+            self.cfg.embedding_model,
+            cache_dir=self.cfg.embedding_cache_dir,
+            cache_max_entries=self.cfg.embedding_cache_max_entries,
+            cache_dtype=self.cfg.embedding_cache_dtype,
+            batch_tokens=self.cfg.embedding_batch_tokens,
+            concurrency=self.cfg.embedding_concurrency,
+            max_retries=self.cfg.embedding_max_retries,
+            **self.cfg.embedding_kwargs,
         )
 
         # Initialize components
@@ -85,41 +100,48 @@ class RepintelAI:
 
     async def conduct_research(self):
         if not (self.agent and self.role):
-            self.agent, self.role = await choose_agent(
-                query=self.query,
-                cfg=self.cfg,
-                parent_query=self.parent_query,
-                cost_callback=self.add_costs,
-                headers=self.headers,
-            )
-
-        self.context = await self.research_conductor.conduct_research()
+            with usage_stage("agent_selection"):
+                self.agent, self.role = await choose_agent(
+                    query=self.query,
+                    cfg=self.cfg,
+                    parent_query=self.parent_query,
+                    cost_callback=self.add_costs,
+                    headers=self.headers,
+                )
+
+        with usage_stage("research"):
+            self.context = await self.research_conductor.conduct_research()
         return self.context
 
     async def write_report(self, existing_headers: list = [], relevant_written_contents: list = [], ext_context=None) -> str:
-        return await self.report_generator.write_report(
-            existing_headers,
-            relevant_written_contents,
-            ext_context or self.context
-        )
+        with usage_stage("report"):
+            return await self.report_generator.write_report(
+                existing_headers,
+                relevant_written_contents,
+                ext_context or self.context
+            )
 
     async def write_report_conclusion(self, report_body: str) -> str:
-        return await self.report_generator.write_report_conclusion(report_body)
+        with usage_stage("report"):
+            return await self.report_generator.write_report_conclusion(report_body)
 
     async def write_introduction(self):
-        return await self.report_generator.write_introduction()
+        with usage_stage("report"):
+            return await self.report_generator.write_introduction()
 
     async def get_subtopics(self):
-        return await self.report_generator.get_subtopics()
+        with usage_stage("report"):
+            return await self.report_generator.get_subtopics()
 
     async def get_draft_section_titles(self, current_subtopic: str):
-        return await self.report_generator.get_draft_section_titles(current_subtopic)
+        with usage_stage("report"):
+            return await self.report_generator.get_draft_section_titles(current_subtopic)
 
     async def get_similar_written_contents_by_draft_section_titles(
         self,
         current_subtopic: str,
         draft_section_titles: List[str],
-        written_contents: List[Dict],
+        written_contents: Union[List[Dict], WrittenSectionIndex],
         max_results: int = 10
     ) -> List[str]:
         return await self.context_manager.get_similar_written_contents_by_draft_section_titles(
@@ -129,6 +151,9 @@ class RepintelAI:
             max_results
         )
 
+    def create_written_section_index(self) -> WrittenSectionIndex:
+        return self.context_manager.create_written_section_index()
+
     # Utility methods
     def get_research_images(self, top_k=10) -> List[Dict[str, Any]]:
         return self.research_images[:top_k]
@@ -137,10 +162,21 @@ class RepintelAI:
         self.research_images.extend(images)
 
     def get_research_sources(self) -> List[Dict[str, Any]]:
-        return self.research_sources
+        sources = []
+        for source in self.research_sources:
+            source = dict(source)
+            if "raw_content" in source:
+                source["raw_content"] = self.page_store.get(source["raw_content"])
+            sources.append(source)
+        return sources
 
     def add_research_sources(self, sources: List[Dict[str, Any]]) -> None:
-        self.research_sources.extend(sources)
+        # raw_content is kept as a page store id and loaded back by get_research_sources
+        for source in sources:
+            source = dict(source)
+            if isinstance(source.get("raw_content"), str):
+                source["raw_content"] = self.page_store.add(source["raw_content"])
+            self.research_sources.append(source)
 
     def add_references(self, report_markdown: str, visited_urls: set) -> str:
         return add_references(report_markdown, visited_urls)
@@ -163,10 +199,16 @@ class RepintelAI:
     def get_costs(self) -> float:
         return self.research_costs
 
+    def get_token_usage(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """Tokens and costs so far, by stage and by model"""
+        return self.token_usage.totals()
+
     def set_verbose(self, verbose: bool):
         self.verbose = verbose
 
-    def add_costs(self, cost: float) -> None:
+    def add_costs(self, cost: float, usage: Optional[TokenCount] = None) -> None:
         if not isinstance(cost, (float, int)):
             raise ValueError("Cost must be an integer or float")
         self.research_costs += cost
+        if usage is not None:
+            self.token_usage.add(usage)
@@ -70,7 +70,7 @@ class Config:
                     self.embedding_model = "text-embedding-3-small"
                 case "azure_openai":
                     self.embedding_model = os.environ["AZURE_EMBEDDING_MODEL"]
-                case "huggingface":
+                case "huggingface" | "local":
                     self.embedding_model = "sentence-transformers/all-MiniLM-L6-v2"
                 case _:
                     raise Exception("Embedding provider not found.")
@@ -6,6 +6,10 @@ class BaseConfig(TypedDict):
     RETRIEVER: str
     EMBEDDING: str
     SIMILARITY_THRESHOLD: float
+    SIMILARITY_THRESHOLD_MODE: str
+    SIMILARITY_PERCENTILE: float
+    SIMILARITY_FLOOR: float
+    SIMILARITY_CEILING: float
     FAST_LLM: str
     SMART_LLM: str
     STRATEGIC_LLM: str
@@ -26,3 +30,35 @@ class BaseConfig(TypedDict):
     MAX_SUBTOPICS: int
     REPORT_SOURCE: Union[str, None]
     DOC_PATH: str
+    WARC_PATH: str
+    EMBEDDING_CACHE_DIR: Union[str, None]
+    EMBEDDING_CACHE_MAX_ENTRIES: int
+    EMBEDDING_CACHE_DTYPE: str
+    EMBEDDING_BATCH_TOKENS: int
+    EMBEDDING_CONCURRENCY: int
+    EMBEDDING_MAX_RETRIES: int
+    CHUNK_SIZE: int
+    CHUNK_OVERLAP: int
+    LEXICAL_PREFILTER: bool
+    LEXICAL_RECALL_MARGIN: int
+    LEXICAL_WEIGHT: float
+    CONTEXT_TOKENS_PER_QUERY: int
+    CONTEXT_WINDOW_SHARE: float
+    CONTEXT_MAX_CHUNKS_PER_SOURCE: int
+    MMR_LAMBDA: float
+    PAGE_MEMORY_BUDGET_MB: int
+    PAGE_SPILL_DIR: str
+    DOC_LOADER_WORKERS: int
+    LOCAL_INDEX_DIR: str
+    LOCAL_INDEX_CANDIDATES: int
+    LLM_CACHE_DIR: Union[str, None]
+    LLM_CACHE_TTL: int
+    LLM_CACHE_MAX_MB: int
+    LLM_CACHE_MAX_TEMPERATURE: float
+    LLM_RATE_LIMITS: str
+    LLM_TIMEOUT: float
+    LLM_DEADLINE: float
+    LLM_STREAM_IDLE_TIMEOUT: float
+    LLM_MAX_RETRIES: int
+    LLM_HEDGE: bool
+    LLM_FALLBACK: str
@@ -4,6 +4,10 @@ DEFAULT_CONFIG: BaseConfig = {
     "RETRIEVER": "tavily",
     "EMBEDDING": "openai:text-embedding-3-small",
     "SIMILARITY_THRESHOLD": 0.42,
+    "SIMILARITY_THRESHOLD_MODE": "fixed",
+    "SIMILARITY_PERCENTILE": 90.0,
+    "SIMILARITY_FLOOR": 0.2,
+    "SIMILARITY_CEILING": 0.6,
     "FAST_LLM": "openai:gpt-4o-mini",
     "SMART_LLM": "openai:gpt-4o-2024-08-06",
     "STRATEGIC_LLM": "openai:o1-preview",
@@ -23,5 +27,39 @@ DEFAULT_CONFIG: BaseConfig = {
     "SCRAPER": "bs",
     "MAX_SUBTOPICS": 3,
     "REPORT_SOURCE": None,
-    "DOC_PATH": "./my-docs"
+    "DOC_PATH": "./my-docs",
+    "WARC_PATH": "./my-warcs",
+    "EMBEDDING_CACHE_DIR": "./.cache/embeddings",
+    "EMBEDDING_CACHE_MAX_ENTRIES": 200000,
+    "EMBEDDING_CACHE_DTYPE": "float16",
+    "EMBEDDING_BATCH_TOKENS": 50000,
+    "EMBEDDING_CONCURRENCY": 4,
+    "EMBEDDING_MAX_RETRIES": 3,
+    "CHUNK_SIZE": 250,
+    "CHUNK_OVERLAP": 25,
+    "LEXICAL_PREFILTER": True,
+    "LEXICAL_RECALL_MARGIN": 10,
+    "LEXICAL_WEIGHT": 0.3,
+    "CONTEXT_TOKENS_PER_QUERY": 3000,
+    "CONTEXT_WINDOW_SHARE": 0.5,
+    "CONTEXT_MAX_CHUNKS_PER_SOURCE": 3,
+    "MMR_LAMBDA": 0.7,
+    "PAGE_MEMORY_BUDGET_MB": 128,
+    "PAGE_SPILL_DIR": "",
+    "DOC_LOADER_WORKERS": 4,
+    "LOCAL_INDEX_DIR": "./.cache/local_docs",
+    "LOCAL_INDEX_CANDIDATES": 20,
+    # Only completions at or below LLM_CACHE_MAX_TEMPERATURE (deterministic ones by default) are
+    # cached; an empty LLM_CACHE_DIR turns the cache off
+    "LLM_CACHE_DIR": "./.cache/llm",
+    "LLM_CACHE_TTL": 86400,
+    "LLM_CACHE_MAX_MB": 256,
+    "LLM_CACHE_MAX_TEMPERATURE": 0.0,
+    "LLM_RATE_LIMITS": "",
+    "LLM_TIMEOUT": 120.0,
+    "LLM_DEADLINE": 600.0,
+    "LLM_STREAM_IDLE_TIMEOUT": 30.0,
+    "LLM_MAX_RETRIES": 3,
+    "LLM_HEDGE": False,
+    "LLM_FALLBACK": "",
 }
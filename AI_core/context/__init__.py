@@ -1,4 +1,8 @@
 from .compression import ContextCompressor
+from .index import ChunkIndex
 from .retriever import SearchAPIRetriever
+from .sections import WrittenSectionIndex
+from .splitter import ChunkSplitter
+from .threshold import SimilarityThreshold
 
-__all__ = ['ContextCompressor', 'SearchAPIRetriever']
+__all__ = ['ContextCompressor', 'ChunkIndex', 'SearchAPIRetriever', 'WrittenSectionIndex', 'ChunkSplitter', 'SimilarityThreshold']
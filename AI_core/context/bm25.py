@@ -0,0 +1,68 @@
+"""
+In-memory BM25 index over chunk texts
+"""
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+_TOKEN = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i in is it its of on or that the their "
+    "this to was were what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if len(token) > 1 and token not in _STOPWORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over an append-only list of documents, scored with NumPy over postings.
+    Row ids are the positions in which documents were added.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, List[int]] = {}
+        self._frequencies: Dict[str, List[int]] = {}
+        self._lengths: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, texts: List[str]) -> None:
+        self.add_tokenized([tokenize(text) for text in texts])
+
+    def add_tokenized(self, documents: List[List[str]]) -> None:
+        """Add documents that were already tokenized (e.g. on a worker thread)"""
+        for tokens in documents:
+            row = len(self._lengths)
+            self._lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self._postings.setdefault(term, []).append(row)
+                self._frequencies.setdefault(term, []).append(frequency)
+
+    def score(self, query: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """BM25 score of every row (or of the given rows) for the query"""
+        lengths = np.asarray(self._lengths, dtype=np.float32)
+        scores = np.zeros(len(lengths), dtype=np.float32)
+        if not len(lengths):
+            return scores if rows is None else scores[rows]
+        average_length = max(float(lengths.mean()), 1.0)
+
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            doc_rows = np.asarray(postings)
+            frequencies = np.asarray(self._frequencies[term], dtype=np.float32)
+            idf = math.log(1 + (len(lengths) - len(postings) + 0.5) / (len(postings) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[doc_rows] / average_length)
+            scores[doc_rows] += idf * frequencies * (self.k1 + 1) / (frequencies + norm)
+
+        return scores if rows is None else scores[rows]
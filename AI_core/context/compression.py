@@ -1,18 +1,10 @@
 import os
-import asyncio
 from typing import Optional
-from .retriever import SearchAPIRetriever, SectionRetriever
-from langchain.retrievers import (
-    ContextualCompressionRetriever,
-)
-from langchain.retrievers.document_compressors import (
-    DocumentCompressorPipeline,
-    EmbeddingsFilter,
-)
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from .index import ChunkIndex
+from .splitter import ChunkSplitter
+from .threshold import SimilarityThreshold
+from .sections import WrittenSectionIndex
 from ..vector_store import VectorStoreWrapper
-from ..utils.costs import estimate_embedding_cost
-from ..memory.embeddings import OPENAI_EMBEDDING_MODEL
 
 
 class VectorstoreCompressor:
@@ -34,72 +26,90 @@ class VectorstoreCompressor:
         results = await self.vector_store.asimilarity_search(query=query, k=max_results, filter=self.filter)
         return self.__pretty_print_docs(results)
 
+    async def async_get_contexts(self, queries, max_results=5):
+        """Get the context of each query, without repeating chunks across queries"""
+        results = await self.vector_store.amulti_similarity_search(queries, k=max_results, filter=self.filter)
+        return [self.__pretty_print_docs(docs) for docs in results]
+
 
 class ContextCompressor:
-    def __init__(self, documents, embeddings, max_results=5, **kwargs):
+    def __init__(
+        self,
+        documents,
+        embeddings,
+        max_results=5,
+        index: Optional[ChunkIndex] = None,
+        token_budget: Optional[int] = None,
+        max_per_source: Optional[int] = None,
+        mmr_lambda: Optional[float] = None,
+        similarity_threshold: Optional[SimilarityThreshold] = None,
+        **kwargs,
+    ):
         self.max_results = max_results
         self.documents = documents
         self.kwargs = kwargs
         self.embeddings = embeddings
-        self.similarity_threshold = os.environ.get("SIMILARITY_THRESHOLD", 0.38)
+        self.index = index or ChunkIndex(embeddings)
+        self.token_budget = token_budget
+        self.max_per_source = max_per_source
+        self.mmr_lambda = mmr_lambda
+        self.similarity_threshold = similarity_threshold or float(os.environ.get("SIMILARITY_THRESHOLD", 0.38))
 
-    def __get_contextual_retriever(self):
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        relevance_filter = EmbeddingsFilter(embeddings=self.embeddings,
-                                            similarity_threshold=self.similarity_threshold)
-        pipeline_compressor = DocumentCompressorPipeline(
-            transformers=[splitter, relevance_filter]
-        )
-        base_retriever = SearchAPIRetriever(
-            pages=self.documents
-        )
-        contextual_retriever = ContextualCompressionRetriever(
-            base_compressor=pipeline_compressor, base_retriever=base_retriever
+    async def async_get_chunk_ids(self, query, max_results=5, cost_callback=None):
+        """
+        Get the ids (in self.index.documents) of the chunks most relevant to the query.
+        max_results caps the number of chunks; with a token budget it may be None so
+        that only the budget limits the context.
+        """
+        rows = await self.index.add_pages(self.documents)
+        return await self.index.search_ids(
+            query,
+            rows=rows,
+            k=max(20, 2 * (max_results or 0)),
+            similarity_threshold=self.similarity_threshold,
+            cost_callback=cost_callback,
+            max_results=max_results,
+            token_budget=self.token_budget,
+            max_per_source=self.max_per_source,
+            mmr_lambda=self.mmr_lambda,
         )
-        return contextual_retriever
-
-    def __pretty_print_docs(self, docs, top_n):
-        return f"\n".join(f"Source: {d.metadata.get('source')}\n"
-                          f"Title: {d.metadata.get('title')}\n"
-                          f"Content: {d.page_content}\n"
-                          for i, d in enumerate(docs) if i < top_n)
 
     async def async_get_context(self, query, max_results=5, cost_callback=None):
-        compressed_docs = self.__get_contextual_retriever()
-        if cost_callback:
-            cost_callback(estimate_embedding_cost(model=OPENAI_EMBEDDING_MODEL, docs=self.documents))
-        relevant_docs = await asyncio.to_thread(compressed_docs.invoke, query)
-        return self.__pretty_print_docs(relevant_docs, max_results)
+        chunk_ids = await self.async_get_chunk_ids(query, max_results=max_results, cost_callback=cost_callback)
+        return self.index.documents.render(chunk_ids)
 
 
 class WrittenContentCompressor:
-    def __init__(self, documents, embeddings, similarity_threshold, **kwargs):
+    def __init__(
+        self,
+        documents,
+        embeddings,
+        similarity_threshold,
+        splitter: Optional[ChunkSplitter] = None,
+        index: Optional[WrittenSectionIndex] = None,
+        **kwargs,
+    ):
         self.documents = documents
         self.kwargs = kwargs
         self.embeddings = embeddings
         self.similarity_threshold = similarity_threshold
+        self.splitter = splitter or ChunkSplitter()
+        self.index = index
 
-    def __get_contextual_retriever(self):
-        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        relevance_filter = EmbeddingsFilter(embeddings=self.embeddings,
-                                            similarity_threshold=self.similarity_threshold)
-        pipeline_compressor = DocumentCompressorPipeline(
-            transformers=[splitter, relevance_filter]
-        )
-        base_retriever = SectionRetriever(
-            sections=self.documents
-        )
-        contextual_retriever = ContextualCompressionRetriever(
-            base_compressor=pipeline_compressor, base_retriever=base_retriever
-        )
-        return contextual_retriever
-
-    def __pretty_docs_list(self, docs, top_n):
-        return [f"Title: {d.metadata.get('section_title')}\nContent: {d.page_content}\n" for i, d in enumerate(docs) if i < top_n]
+    def __pretty_docs_list(self, docs):
+        return [f"Title: {d.metadata.get('section_title')}\nContent: {d.page_content}\n" for d in docs]
 
     async def async_get_context(self, query, max_results=5, cost_callback=None):
-        compressed_docs = self.__get_contextual_retriever()
-        if cost_callback:
-            cost_callback(estimate_embedding_cost(model=OPENAI_EMBEDDING_MODEL, docs=self.documents))
-        relevant_docs = await asyncio.to_thread(compressed_docs.invoke, query)
-        return self.__pretty_docs_list(relevant_docs, max_results)
+        """
+        Get the written chunks most relevant to the query, or to any of a list of queries.
+        Without an index, one is built from the documents for this call.
+        """
+        index = self.index
+        if index is None:
+            index = WrittenSectionIndex(self.embeddings, splitter=self.splitter, cost_callback=cost_callback)
+            await index.add_sections(self.documents)
+        queries = [query] if isinstance(query, str) else list(query)
+        relevant_docs = await index.search(
+            queries, similarity_threshold=self.similarity_threshold, max_results=max_results
+        )
+        return self.__pretty_docs_list(relevant_docs)
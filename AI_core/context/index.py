@@ -0,0 +1,335 @@
+"""
+Run-scoped chunk index shared by every sub-query of a research task
+"""
+import asyncio
+import hashlib
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+from langchain.schema import Document
+
+from .bm25 import BM25Index, tokenize
+from .splitter import ChunkSplitter
+from .store import ChunkStore
+from ..utils.tokens import cached_count_tokens
+from ..utils.usage import embedding_costs_to
+from ..memory.pages import PageStore
+from ..utils.logger import get_formatted_logger
+
+logger = get_formatted_logger()
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", errors="ignore")).hexdigest()
+
+
+def normalise_rows(vectors: np.ndarray) -> np.ndarray:
+    """Rows scaled to unit length, so that dot products are cosine similarities"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class ChunkIndex:
+    """
+    Splits pages into chunks and embeds every unique chunk at most once per run.
+
+    Sub-queries that are handed the same pages (local, hybrid and langchain documents
+    research) only pay for embedding their query; scoring is a single matrix product.
+    With the lexical prefilter on, chunks are embedded lazily: a BM25 pass picks the
+    candidates worth embedding for each query and its score is fused into the ranking.
+    Chunks live in a ChunkStore and are identified by their row id in it.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        splitter: Optional[ChunkSplitter] = None,
+        lexical_prefilter: bool = True,
+        recall_margin: int = 10,
+        lexical_weight: float = 0.3,
+        pages: Optional[PageStore] = None,
+    ):
+        self.embeddings = embeddings
+        self.splitter = splitter or ChunkSplitter()
+        self.lexical_prefilter = lexical_prefilter
+        self.recall_margin = recall_margin
+        self.lexical_weight = lexical_weight
+        self.documents: ChunkStore = ChunkStore(pages)
+        self.lexical = BM25Index()
+        self._page_rows: Dict[str, range] = {}
+        self._pending_pages: Dict[str, asyncio.Future] = {}
+        self._doc_vector_rows: List[int] = []
+        self._vector_rows: Dict[str, int] = {}
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._vector_blocks: List[np.ndarray] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_config(
+        cls, embeddings, cfg, splitter: Optional[ChunkSplitter] = None, pages: Optional[PageStore] = None
+    ) -> "ChunkIndex":
+        return cls(
+            embeddings,
+            splitter=splitter or ChunkSplitter.from_config(cfg),
+            lexical_prefilter=cfg.lexical_prefilter,
+            recall_margin=cfg.lexical_recall_margin,
+            lexical_weight=cfg.lexical_weight,
+            pages=pages if pages is not None else PageStore.from_config(cfg),
+        )
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Row-normalised embedding matrix of every unique chunk embedded so far"""
+        if self._matrix is None or len(self._matrix) != len(self._vector_rows):
+            blocks = [block for block in self._vector_blocks if len(block)]
+            self._matrix = np.concatenate(blocks) if blocks else np.empty((0, 0), dtype=np.float32)
+            self._vector_blocks = [self._matrix]
+        return self._matrix
+
+    async def add_pages(self, pages: List[Dict]) -> np.ndarray:
+        """
+        Index pages ({"raw_content", "url", "title"}) and return the row ids of their chunks.
+        Pages seen before are not split again.
+        """
+        keys = [self._page_key(page) for page in pages]
+        new_pages = {}
+        for key, page in zip(keys, pages):
+            if key not in self._page_rows and key not in self._pending_pages and key not in new_pages:
+                new_pages[key] = page
+
+        if new_pages:
+            splitting = asyncio.get_running_loop().create_future()
+            for key in new_pages:
+                self._pending_pages[key] = splitting
+            try:
+                split_pages = await asyncio.to_thread(self._split_pages, list(new_pages.values()))
+            finally:
+                for key in new_pages:
+                    self._pending_pages.pop(key)
+                splitting.set_result(None)
+            for key, page, (offsets, tokens) in zip(new_pages, new_pages.values(), split_pages):
+                rows = self.documents.add_page(
+                    page.get("url", ""), page.get("title", ""), page.get("raw_content") or "", offsets
+                )
+                self._page_rows[key] = rows
+                self._doc_vector_rows.extend([-1] * len(rows))
+                self.lexical.add_tokenized(tokens)
+
+        for key in keys:
+            if key in self._pending_pages:
+                await asyncio.shield(self._pending_pages[key])
+
+        rows = [row for key in keys for row in self._page_rows.get(key, [])]
+        return np.unique(np.asarray(rows, dtype=np.int64))
+
+    async def search(
+        self,
+        query: str,
+        rows: Optional[np.ndarray] = None,
+        k: int = 20,
+        similarity_threshold: Optional[Union[float, Callable[[np.ndarray], float]]] = None,
+        cost_callback=None,
+        max_results: Optional[int] = None,
+        token_budget: Optional[int] = None,
+        max_per_source: Optional[int] = None,
+        mmr_lambda: Optional[float] = None,
+    ) -> List[Document]:
+        """Return the chunks selected by search_ids as documents"""
+        chunk_ids = await self.search_ids(
+            query,
+            rows=rows,
+            k=k,
+            similarity_threshold=similarity_threshold,
+            cost_callback=cost_callback,
+            max_results=max_results,
+            token_budget=token_budget,
+            max_per_source=max_per_source,
+            mmr_lambda=mmr_lambda,
+        )
+        return [self.documents[chunk_id] for chunk_id in chunk_ids]
+
+    async def search_ids(
+        self,
+        query: str,
+        rows: Optional[np.ndarray] = None,
+        k: int = 20,
+        similarity_threshold: Optional[Union[float, Callable[[np.ndarray], float]]] = None,
+        cost_callback=None,
+        max_results: Optional[int] = None,
+        token_budget: Optional[int] = None,
+        max_per_source: Optional[int] = None,
+        mmr_lambda: Optional[float] = None,
+    ) -> List[int]:
+        """
+        Return the ids of the chunks relevant to the query.
+
+        The k best chunks whose cosine similarity exceeds the threshold form the pool.
+        The threshold may be a callable (see SimilarityThreshold) that computes it from
+        the similarities of the candidate chunks.
+        Without selection limits they are returned in relevance order. Otherwise chunks
+        are picked from the pool by Maximal Marginal Relevance (when mmr_lambda is set),
+        skipping sources that already have max_per_source chunks. Picking stops after
+        max_results chunks, or when no more chunks fit in token_budget.
+        """
+        if rows is None:
+            rows = np.arange(len(self.documents))
+        if not len(rows):
+            return []
+
+        candidates, lexical_scores = self._lexical_candidates(query, rows, k)
+        with embedding_costs_to(cost_callback):
+            query_embedding, _ = await asyncio.gather(
+                self.embeddings.aembed_query(query),
+                self._embed_rows(candidates.tolist(), cost_callback),
+            )
+        query_vector = normalise_rows(np.asarray([query_embedding], dtype=np.float32))[0]
+        vector_rows = np.asarray(self._doc_vector_rows, dtype=np.int64)[candidates]
+        similarities = self.matrix[vector_rows] @ query_vector
+
+        scores = similarities
+        if lexical_scores is not None and lexical_scores.max() > 0:
+            scores = (1 - self.lexical_weight) * similarities + self.lexical_weight * lexical_scores / lexical_scores.max()
+
+        if k < len(scores):
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        if callable(similarity_threshold):
+            similarity_threshold = similarity_threshold(similarities)
+        if similarity_threshold is not None:
+            top = top[similarities[top] > similarity_threshold]
+            logger.info(
+                f"Kept {len(top)} of {len(candidates)} candidate chunks for '{query}' "
+                f"(similarity > {similarity_threshold:.3f})"
+            )
+
+        if max_results is None and token_budget is None and max_per_source is None and mmr_lambda is None:
+            return candidates[top].tolist()
+
+        return self._select(
+            candidates[top],
+            scores[top],
+            self.matrix[vector_rows[top]],
+            max_results=max_results,
+            token_budget=token_budget,
+            max_per_source=max_per_source,
+            mmr_lambda=mmr_lambda,
+        )
+
+    def _select(
+        self,
+        rows: np.ndarray,
+        relevance: np.ndarray,
+        vectors: np.ndarray,
+        max_results: Optional[int],
+        token_budget: Optional[int],
+        max_per_source: Optional[int],
+        mmr_lambda: Optional[float],
+    ) -> List[int]:
+        """Greedy MMR selection over a relevance-ordered pool under source and token limits"""
+        tokens = cached_count_tokens([self.documents.text(row) for row in rows])
+        pairwise = vectors @ vectors.T if mmr_lambda is not None else None
+        max_similarity = np.full(len(rows), -np.inf, dtype=np.float32)
+        remaining = np.ones(len(rows), dtype=bool)
+        per_source: Dict[str, int] = {}
+        budget = token_budget if token_budget is not None else float("inf")
+        selected: List[int] = []
+
+        while remaining.any() and (max_results is None or len(selected) < max_results):
+            if pairwise is None:
+                best = int(np.flatnonzero(remaining)[0])
+            else:
+                redundancy = np.where(np.isfinite(max_similarity), max_similarity, 0.0)
+                mmr = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+                best = int(np.argmax(np.where(remaining, mmr, -np.inf)))
+            remaining[best] = False
+
+            source = self.documents.source(rows[best])
+            if max_per_source is not None and per_source.get(source, 0) >= max_per_source:
+                continue
+            if tokens[best] > budget:
+                continue
+
+            selected.append(int(rows[best]))
+            per_source[source] = per_source.get(source, 0) + 1
+            budget -= tokens[best]
+            if pairwise is not None:
+                max_similarity = np.maximum(max_similarity, pairwise[best])
+
+        return selected
+
+    def _lexical_candidates(self, query: str, rows: np.ndarray, k: int):
+        """
+        Narrow rows down to the best k * recall_margin BM25 matches. Queries with too few
+        lexical matches to fill k results are scored against every row instead.
+        """
+        if not self.lexical_prefilter:
+            return rows, None
+        lexical_scores = self.lexical.score(query, rows)
+        matching = np.flatnonzero(lexical_scores > 0)
+        if len(matching) < k:
+            return rows, lexical_scores
+        limit = k * self.recall_margin
+        if len(matching) > limit:
+            matching = matching[np.argpartition(-lexical_scores[matching], limit)[:limit]]
+        return rows[matching], lexical_scores[matching]
+
+    def _split_pages(self, pages: List[Dict]):
+        split_pages = []
+        for page in pages:
+            text = page.get("raw_content") or ""
+            offsets = self.splitter.split_offsets(text)
+            split_pages.append((offsets, [tokenize(text[start:end]) for start, end in offsets]))
+        return split_pages
+
+    async def _embed_rows(self, rows: List[int], cost_callback=None) -> None:
+        """Embed chunks that are neither embedded nor being embedded by a concurrent sub-query"""
+        owned: Dict[str, List[int]] = {}
+        waiting: Dict[str, List[int]] = {}
+        for row in rows:
+            if self._doc_vector_rows[row] >= 0:
+                continue
+            text_hash = hash_text(self.documents.text(row))
+            if text_hash in self._vector_rows:
+                self._doc_vector_rows[row] = self._vector_rows[text_hash]
+            elif text_hash in self._pending and text_hash not in owned:
+                waiting.setdefault(text_hash, []).append(row)
+            else:
+                owned.setdefault(text_hash, []).append(row)
+
+        if owned:
+            loop = asyncio.get_running_loop()
+            for text_hash in owned:
+                self._pending[text_hash] = loop.create_future()
+            texts = [self.documents.text(owned_rows[0]) for owned_rows in owned.values()]
+            try:
+                with embedding_costs_to(cost_callback):
+                    vectors = await self.embeddings.aembed_documents(texts)
+                self._add_vectors(owned, vectors)
+            except BaseException as e:
+                for text_hash in owned:
+                    self._pending.pop(text_hash).set_exception(e)
+                raise
+            for text_hash in owned:
+                self._pending.pop(text_hash).set_result(self._vector_rows[text_hash])
+
+        for text_hash, waiting_rows in waiting.items():
+            vector_row = await asyncio.shield(self._pending[text_hash]) if text_hash in self._pending \
+                else self._vector_rows[text_hash]
+            for row in waiting_rows:
+                self._doc_vector_rows[row] = vector_row
+
+    def _add_vectors(self, owned: Dict[str, List[int]], vectors: List[List[float]]) -> None:
+        block = normalise_rows(np.asarray(vectors, dtype=np.float32))
+        start = len(self._vector_rows)
+        for offset, (text_hash, owned_rows) in enumerate(owned.items()):
+            self._vector_rows[text_hash] = start + offset
+            for row in owned_rows:
+                self._doc_vector_rows[row] = start + offset
+        self._vector_blocks.append(block)
+
+    @staticmethod
+    def _page_key(page: Dict) -> str:
+        return hash_text(f"{page.get('url', '')}\n{page.get('raw_content') or ''}")
@@ -0,0 +1,85 @@
+"""
+Report-scoped index of the sections written so far
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.schema import Document
+
+from .index import hash_text, normalise_rows
+from .splitter import ChunkSplitter
+from ..utils.usage import embedding_costs_to
+
+
+class WrittenSectionIndex:
+    """
+    Holds the chunks of every section written for a report, embedded once when the
+    section is added. Looking up the sections related to a batch of draft titles costs
+    one embedding call for the titles and one matrix product.
+    """
+
+    def __init__(self, embeddings, splitter: Optional[ChunkSplitter] = None, cost_callback=None):
+        self.embeddings = embeddings
+        self.splitter = splitter or ChunkSplitter()
+        self.cost_callback = cost_callback
+        self.documents: List[Document] = []
+        self._hashes = set()
+        self._vector_blocks: List[np.ndarray] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Row-normalised embeddings of every chunk, in the order of self.documents"""
+        if self._matrix is None or len(self._matrix) != len(self.documents):
+            blocks = [block for block in self._vector_blocks if len(block)]
+            self._matrix = np.concatenate(blocks) if blocks else np.empty((0, 0), dtype=np.float32)
+            self._vector_blocks = [self._matrix]
+        return self._matrix
+
+    async def add_sections(self, sections: List[Dict]) -> None:
+        """
+        Split and embed sections ({"section_title", "written_content"}).
+        Chunks that are already in the index are skipped.
+        """
+        documents = []
+        for section in sections:
+            for chunk in self.splitter.split_text(section.get("written_content", "")):
+                text_hash = hash_text(chunk)
+                if text_hash in self._hashes:
+                    continue
+                self._hashes.add(text_hash)
+                documents.append(
+                    Document(page_content=chunk, metadata={"section_title": section.get("section_title", "")})
+                )
+        if not documents:
+            return
+
+        texts = [doc.page_content for doc in documents]
+        try:
+            with embedding_costs_to(self.cost_callback):
+                vectors = await self.embeddings.aembed_documents(texts)
+        except BaseException:
+            self._hashes.difference_update(hash_text(text) for text in texts)
+            raise
+        self._vector_blocks.append(normalise_rows(np.asarray(vectors, dtype=np.float32)))
+        self.documents.extend(documents)
+
+    async def search(
+        self, queries: List[str], similarity_threshold: float = 0.5, max_results: int = 10
+    ) -> List[Document]:
+        """
+        Return up to max_results chunks whose similarity to any of the queries exceeds
+        the threshold, ranked by their best similarity
+        """
+        if not queries or not self.documents:
+            return []
+        with embedding_costs_to(self.cost_callback):
+            query_vectors = await self.embeddings.aembed_documents(queries)
+        query_vectors = normalise_rows(np.asarray(query_vectors, dtype=np.float32))
+        best = (query_vectors @ self.matrix.T).max(axis=0)
+        rows = np.flatnonzero(best > similarity_threshold)
+        rows = rows[np.argsort(-best[rows], kind="stable")][:max_results]
+        return [self.documents[row] for row in rows]
@@ -0,0 +1,138 @@
+"""
+Token-aware text splitter shared by context compression and vector store ingestion
+"""
+import re
+from typing import Any, List, Optional, Tuple
+
+from langchain.schema import Document
+from langchain.text_splitter import TextSplitter
+
+from ..utils.tokens import count_tokens
+
+# Boundaries between units: blank lines, line breaks and sentence ends. Matching the
+# punctuation instead of looking behind for it lets the regex engine skip ahead quickly
+_UNIT_BOUNDARY = re.compile(r"\n\s*|[.!?]\s+")
+_HEADING = re.compile(r"#{1,6}\s")
+_HEADING_MAX_CHARS = 80
+_WHITESPACE = re.compile(r"\s")
+
+
+class ChunkSplitter(TextSplitter):
+    """
+    Splits text into chunks of at most chunk_size tokens, breaking only between sentences,
+    lines or headings unless a single sentence is longer than a chunk.
+
+    split_offsets returns (start, end) character offsets into the source text, so callers
+    can keep one copy of each page and slice chunks out of it on demand.
+    """
+
+    def __init__(self, chunk_size: int = 250, chunk_overlap: int = 25, **kwargs: Any):
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs)
+
+    @classmethod
+    def from_config(cls, cfg) -> "ChunkSplitter":
+        return cls(chunk_size=cfg.chunk_size, chunk_overlap=cfg.chunk_overlap)
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.split_offsets(text)]
+
+    def create_documents(self, texts: List[str], metadatas: Optional[List[dict]] = None) -> List[Document]:
+        documents = []
+        for i, text in enumerate(texts):
+            metadata = metadatas[i] if metadatas else {}
+            for start, end in self.split_offsets(text):
+                chunk_metadata = dict(metadata)
+                if self._add_start_index:
+                    chunk_metadata["start_index"] = start
+                documents.append(Document(page_content=text[start:end], metadata=chunk_metadata))
+        return documents
+
+    def split_offsets(self, text: str) -> List[Tuple[int, int]]:
+        """Return the (start, end) offsets of every chunk of the text"""
+        if not text or not text.strip():
+            return []
+        units = self._units(text)
+        tokens = count_tokens([text[start:end] for start, end in units])
+        units, tokens = self._split_long_units(text, units, tokens)
+
+        chunks = []
+        first = 0
+        while first < len(units):
+            last, size = first, tokens[first]
+            while last + 1 < len(units) and size + tokens[last + 1] <= self._chunk_size:
+                # Start a new chunk at a heading rather than leaving it at the end of this one
+                if size >= self._chunk_size // 4 and self._is_heading(text, units[last + 1]):
+                    break
+                last += 1
+                size += tokens[last]
+            chunks.append(self._strip(text, units[first][0], units[last][1]))
+            if last + 1 >= len(units):
+                break
+
+            next_first, overlap = last + 1, 0
+            if self._is_heading(text, units[next_first]):
+                # A new section starts here; do not carry the previous one over
+                first = next_first
+                continue
+            while next_first - 1 > first and overlap + tokens[next_first - 1] <= self._chunk_overlap:
+                next_first -= 1
+                overlap += tokens[next_first]
+            first = next_first
+
+        return [chunk for chunk in chunks if chunk[1] > chunk[0]]
+
+    @staticmethod
+    def _units(text: str) -> List[Tuple[int, int]]:
+        # Every match is at least one character long, so consecutive ends never repeat
+        ends = [match.end() for match in _UNIT_BOUNDARY.finditer(text)]
+        if not ends or ends[-1] < len(text):
+            ends.append(len(text))
+        return list(zip([0] + ends[:-1], ends))
+
+    def _split_long_units(
+        self, text: str, units: List[Tuple[int, int]], tokens: List[int]
+    ) -> Tuple[List[Tuple[int, int]], List[int]]:
+        if max(tokens) <= self._chunk_size:
+            return units, tokens
+        split_units, split_tokens = [], []
+        for (start, end), count in zip(units, tokens):
+            if count <= self._chunk_size:
+                split_units.append((start, end))
+                split_tokens.append(count)
+                continue
+            # Cut at whitespace close to evenly spaced positions
+            parts = -(-count // self._chunk_size)
+            step = (end - start) / parts
+            cut = start
+            for part in range(1, parts + 1):
+                target = end if part == parts else int(start + step * part)
+                match = _WHITESPACE.search(text, target, end) if part < parts else None
+                next_cut = match.end() if match else target
+                if next_cut > cut:
+                    split_units.append((cut, next_cut))
+                    cut = next_cut
+            split_tokens.extend(count_tokens([text[s:e] for s, e in split_units[len(split_tokens):]]))
+        if len(split_units) > len(units):
+            # Uneven token density can leave a piece slightly over the limit
+            return self._split_long_units(text, split_units, split_tokens)
+        return split_units, split_tokens
+
+    @staticmethod
+    def _is_heading(text: str, unit: Tuple[int, int]) -> bool:
+        """Markdown headings, or short lines without closing punctuation (scraped h1-h5 text)"""
+        line = text[unit[0]:unit[1]]
+        if "\n" not in line:
+            return _HEADING.match(line.lstrip()) is not None
+        stripped = line.strip()
+        if _HEADING.match(stripped):
+            return True
+        return 0 < len(stripped) <= _HEADING_MAX_CHARS and stripped[-1] not in ".!?:;,"
+
+    @staticmethod
+    def _strip(text: str, start: int, end: int) -> Tuple[int, int]:
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return start, end
+
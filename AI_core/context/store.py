@@ -0,0 +1,97 @@
+"""
+Run-scoped store of page texts and the chunks cut from them
+"""
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain.schema import Document
+
+from ..memory.pages import PageStore
+
+
+class ChunkStore:
+    """
+    Keeps each page's text once, in a PageStore, and every chunk as a (page_id, start, end)
+    record in flat arrays, so chunks cost a few bytes each instead of a copy of their text.
+    Chunk ids are positions in the store; indexing the store yields a Document built
+    on demand, so it can be used wherever a list of chunk documents is expected.
+    """
+
+    __slots__ = ("pages", "_text_ids", "_sources", "_titles", "_page_ids", "_starts", "_ends")
+
+    def __init__(self, pages: Optional[PageStore] = None):
+        self.pages = pages if pages is not None else PageStore()
+        self._text_ids = array("q")
+        self._sources: List[str] = []
+        self._titles: List[str] = []
+        self._page_ids = array("q")
+        self._starts = array("q")
+        self._ends = array("q")
+
+    def __len__(self) -> int:
+        return len(self._page_ids)
+
+    def __getitem__(self, chunk_id: int) -> Document:
+        if not 0 <= chunk_id < len(self._page_ids):
+            raise IndexError(chunk_id)
+        return Document(
+            page_content=self.text(chunk_id),
+            metadata={"title": self.title(chunk_id), "source": self.source(chunk_id)},
+        )
+
+    def add_page(self, source: str, title: str, text: str, offsets: Sequence[Tuple[int, int]]) -> range:
+        """Store a page and its chunk offsets, and return the ids of its chunks"""
+        page_id = len(self._text_ids)
+        self._text_ids.append(self.pages.add(text))
+        self._sources.append(source)
+        self._titles.append(title)
+        first = len(self._page_ids)
+        for start, end in offsets:
+            self._page_ids.append(page_id)
+            self._starts.append(start)
+            self._ends.append(end)
+        return range(first, len(self._page_ids))
+
+    def text(self, chunk_id: int) -> str:
+        return self.page_text(self._page_ids[chunk_id])[self._starts[chunk_id]:self._ends[chunk_id]]
+
+    def page_text(self, page_id: int) -> str:
+        return self.pages.get(self._text_ids[page_id])
+
+    def source(self, chunk_id: int) -> str:
+        return self._sources[self._page_ids[chunk_id]]
+
+    def title(self, chunk_id: int) -> str:
+        return self._titles[self._page_ids[chunk_id]]
+
+    def spans(self, chunk_ids: Iterable[int]) -> List[Tuple[int, int, int]]:
+        """
+        Return (page_id, start, end) spans covering the chunks, with overlapping or
+        adjacent chunks of a page merged. Pages keep the order of their first chunk.
+        """
+        by_page: Dict[int, List[Tuple[int, int]]] = {}
+        for chunk_id in chunk_ids:
+            by_page.setdefault(self._page_ids[chunk_id], []).append(
+                (self._starts[chunk_id], self._ends[chunk_id])
+            )
+        spans = []
+        for page_id, ranges in by_page.items():
+            ranges.sort()
+            start, end = ranges[0]
+            for next_start, next_end in ranges[1:]:
+                if next_start <= end:
+                    end = max(end, next_end)
+                else:
+                    spans.append((page_id, start, end))
+                    start, end = next_start, next_end
+            spans.append((page_id, start, end))
+        return spans
+
+    def render(self, chunk_ids: Iterable[int]) -> str:
+        """Format chunks for a prompt, one Source/Title/Content block per merged span"""
+        return "\n".join(
+            f"Source: {self._sources[page_id]}\n"
+            f"Title: {self._titles[page_id]}\n"
+            f"Content: {self.page_text(page_id)[start:end]}\n"
+            for page_id, start, end in self.spans(chunk_ids)
+        )
@@ -0,0 +1,74 @@
+"""
+Per-query similarity thresholds calibrated from the score distribution
+"""
+from typing import Optional
+
+import numpy as np
+
+THRESHOLD_MODES = ("fixed", "percentile", "knee")
+
+
+class SimilarityThreshold:
+    """
+    Computes the cosine similarity cut-off for one query from the similarities of its
+    candidate chunks, so the number of chunks kept does not depend on how an embedding
+    model spreads its scores.
+
+    percentile keeps the chunks above the given percentile of the candidate scores.
+    knee cuts where the sorted scores stop dropping steeply (the point furthest from
+    the chord between the best and the worst score).
+    Either way the cut-off is clamped to [floor, ceiling].
+    """
+
+    def __init__(
+        self,
+        mode: str = "percentile",
+        percentile: float = 90.0,
+        floor: float = 0.2,
+        ceiling: float = 0.6,
+    ):
+        if mode not in THRESHOLD_MODES:
+            raise ValueError(f"Unknown similarity threshold mode: {mode}. Expected one of {THRESHOLD_MODES}")
+        self.mode = mode
+        self.percentile = percentile
+        self.floor = floor
+        self.ceiling = ceiling
+
+    @classmethod
+    def from_config(cls, cfg) -> Optional["SimilarityThreshold"]:
+        """Return the configured adaptive threshold, or None when the fixed threshold is used"""
+        if cfg.similarity_threshold_mode == "fixed":
+            return None
+        return cls(
+            mode=cfg.similarity_threshold_mode,
+            percentile=cfg.similarity_percentile,
+            floor=cfg.similarity_floor,
+            ceiling=cfg.similarity_ceiling,
+        )
+
+    def __call__(self, similarities: np.ndarray) -> float:
+        if not len(similarities):
+            return self.floor
+        if self.mode == "percentile":
+            threshold = float(np.percentile(similarities, self.percentile))
+        else:
+            threshold = self._knee(similarities)
+        return min(max(threshold, self.floor), self.ceiling)
+
+    @staticmethod
+    def _knee(similarities: np.ndarray) -> float:
+        scores = np.sort(similarities)[::-1]
+        if len(scores) < 3 or scores[0] == scores[-1]:
+            return float(scores[-1])
+        x = np.linspace(0.0, 1.0, len(scores))
+        y = (scores - scores[-1]) / (scores[0] - scores[-1])
+        # Distance below the chord from (0, 1) to (1, 0)
+        distance = (1.0 - x) - y
+        # The knee is the first score of the flat tail; only the chunks above it are kept
+        return float(scores[int(np.argmax(distance))])
+
+    def __repr__(self) -> str:
+        return (
+            f"SimilarityThreshold(mode={self.mode!r}, percentile={self.percentile}, "
+            f"floor={self.floor}, ceiling={self.ceiling})"
+        )
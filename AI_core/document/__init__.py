@@ -1,4 +1,5 @@
 from .document import DocumentLoader
+from .index import LocalDocumentIndex
 from .langchain_document import LangChainDocumentLoader
 
-__all__ = ['DocumentLoader', 'LangChainDocumentLoader']
+__all__ = ['DocumentLoader', 'LocalDocumentIndex', 'LangChainDocumentLoader']
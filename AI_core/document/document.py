@@ -1,66 +1,130 @@
 import asyncio
+import multiprocessing
 import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
 
-from langchain_community.document_loaders import (
-    PyMuPDFLoader, 
-    TextLoader, 
-    UnstructuredCSVLoader, 
-    UnstructuredExcelLoader,
-    UnstructuredMarkdownLoader, 
-    UnstructuredPowerPointLoader,
-    UnstructuredWordDocumentLoader
-)
+from .tabular import TABLE_READERS, load_table
+from .warc import WARC_EXTENSIONS, iter_warc_pages
+
+# Loader class and keyword arguments for each supported extension.
+# Loaders are imported and constructed only for the files that need them.
+# Spreadsheets are read by the streaming readers in tabular.py instead.
+LOADERS: Dict[str, Tuple[str, Dict]] = {
+    "pdf": ("PyMuPDFLoader", {}),
+    "txt": ("TextLoader", {}),
+    "doc": ("UnstructuredWordDocumentLoader", {}),
+    "docx": ("UnstructuredWordDocumentLoader", {}),
+    "pptx": ("UnstructuredPowerPointLoader", {}),
+    "md": ("UnstructuredMarkdownLoader", {}),
+}
+
+
+def _warc_pages(file_path: str, chunk_tokens: int = 250) -> Iterator[Dict[str, str]]:
+    return iter_warc_pages(file_path)
+
+
+# Readers yielding the pages of large files one by one, to be indexed as they are read,
+# called as reader(file_path, chunk_tokens=...)
+STREAM_READERS: Dict[str, Callable[..., Iterator[Dict[str, str]]]] = {
+    **{extension: _warc_pages for extension in WARC_EXTENSIONS},
+    **{extension: partial(load_table, file_extension=extension) for extension in TABLE_READERS},
+}
+
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+
+def get_loader_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Return the process-wide pool of document parsing workers, starting it on first use"""
+    with _pools_lock:
+        if max_workers not in _pools:
+            # Spawned workers do not inherit the server's threads and event loop
+            _pools[max_workers] = ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pools[max_workers]
+
+
+def load_file(
+    file_path: str, file_extension: str, chunk_tokens: int = 250, raise_errors: bool = False
+) -> List[Dict[str, str]]:
+    """
+    Parse one file into pages ({"raw_content", "url"}); runs in a worker process.
+    Spreadsheets are split into pages of at most chunk_tokens tokens. A file that fails
+    to parse has no pages, unless raise_errors.
+    """
+    try:
+        if file_extension in STREAM_READERS:
+            return list(STREAM_READERS[file_extension](file_path, chunk_tokens=chunk_tokens))
+        loader_name, loader_kwargs = LOADERS[file_extension]
+        import langchain_community.document_loaders as document_loaders
+
+        loader = getattr(document_loaders, loader_name)(file_path, **loader_kwargs)
+        return [
+            {"raw_content": page.page_content, "url": os.path.basename(page.metadata["source"])}
+            for page in loader.load()
+            if page.page_content
+        ]
+    except Exception as e:
+        if raise_errors:
+            raise
+        print(f"Failed to load document : {file_path}")
+        print(e)
+        return []
+
+
+def file_type(file_name: str) -> str:
+    """Lowercase extension of a file, with compressed web archives as "warc.gz" """
+    file_name = file_name.lower()
+    if file_name.endswith(".warc.gz"):
+        return "warc.gz"
+    return os.path.splitext(file_name)[1].strip(".")
 
 
 class DocumentLoader:
+    """
+    Loads every supported file under path. Files are parsed in a pool of max_workers
+    processes (or in a worker thread when max_workers <= 1) and their pages are
+    streamed back as each file finishes.
+    """
 
-    def __init__(self, path):
+    def __init__(self, path, max_workers: Optional[int] = None, chunk_tokens: int = 250):
         self.path = path
+        self.chunk_tokens = chunk_tokens
+        self.max_workers = max_workers if max_workers is not None else max(1, (os.cpu_count() or 2) // 2)
 
     async def load(self) -> list:
-        tasks = []
-        for root, dirs, files in os.walk(self.path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_name, file_extension_with_dot = os.path.splitext(file_path)
-                file_extension = file_extension_with_dot.strip(".")
-                tasks.append(self._load_document(file_path, file_extension))
-
-        docs = []
-        for pages in await asyncio.gather(*tasks):
-            for page in pages:
-                if page.page_content:
-                    docs.append({
-                        "raw_content": page.page_content,
-                        "url": os.path.basename(page.metadata['source'])
-                    })
-                    
+        docs = [page async for page in self.stream()]
         if not docs:
             raise ValueError("🤷 Failed to load any documents!")
-
         return docs
 
-    async def _load_document(self, file_path: str, file_extension: str) -> list:
-        ret_data = []
+    async def stream(self) -> AsyncIterator[Dict[str, str]]:
+        """Yield pages as soon as the file they come from is parsed"""
+        loop = asyncio.get_running_loop()
+        executor: Optional[Executor] = get_loader_pool(self.max_workers) if self.max_workers > 1 else None
+        tasks = [
+            loop.run_in_executor(executor, load_file, file_path, file_extension, self.chunk_tokens)
+            for file_path, file_extension in self.files()
+        ]
         try:
-            loader_dict = {
-                "pdf": PyMuPDFLoader(file_path),
-                "txt": TextLoader(file_path),
-                "doc": UnstructuredWordDocumentLoader(file_path),
-                "docx": UnstructuredWordDocumentLoader(file_path),
-                "pptx": UnstructuredPowerPointLoader(file_path),
-                "csv": UnstructuredCSVLoader(file_path, mode="elements"),
-                "xls": UnstructuredExcelLoader(file_path, mode="elements"),
-                "xlsx": UnstructuredExcelLoader(file_path, mode="elements"),
-                "md": UnstructuredMarkdownLoader(file_path)
-            }
-
-            loader = loader_dict.get(file_extension, None)
-            if loader:
-                ret_data = loader.load()
-
-        except Exception as e:
-            print(f"Failed to load document : {file_path}")
-            print(e)
-
-        return ret_data
+            for task in asyncio.as_completed(tasks):
+                for page in await task:
+                    yield page
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def files(self) -> List[Tuple[str, str]]:
+        """(path, extension) of every file under path that a loader supports"""
+        files = []
+        for root, dirs, file_names in os.walk(self.path):
+            for file_name in file_names:
+                file_path = os.path.join(root, file_name)
+                file_extension = file_type(file_name)
+                if file_extension in LOADERS or file_extension in STREAM_READERS:
+                    files.append((file_path, file_extension))
+        return files
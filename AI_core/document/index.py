@@ -0,0 +1,407 @@
+"""
+Persistent index of the documents under DOC_PATH, updated incrementally
+"""
+import asyncio
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import weakref
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .document import STREAM_READERS, DocumentLoader, get_loader_pool, load_file
+from ..utils.logger import get_formatted_logger
+
+logger = get_formatted_logger()
+
+# Per event loop, so that a folder is never scanned or embedded twice at once
+_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Lock]]" = weakref.WeakKeyDictionary()
+_WORD = re.compile(r"\w+")
+# Chunks embedded per call when bringing the vector index up to date
+_EMBED_BATCH_SIZE = 512
+# Pages of a streamed file written per batch
+_STREAM_BATCH_SIZE = 256
+
+
+@dataclass
+class IndexUpdate:
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.removed)
+
+
+class LocalDocumentIndex:
+    """
+    Keeps a manifest (path, size, mtime, content hash) of the files under doc_path, the
+    text parsed from each of them and its chunks in SQLite. refresh() only parses files
+    that were added or whose content changed, and forgets deleted ones, so keeping the
+    index current costs O(changed files). Web archives are read a record at a time and
+    written as they are read, so they are never held in memory whole.
+
+    Chunks are searchable by BM25 (SQLite FTS5) and, once embeddings are given to
+    search(), by vector similarity in a LocalVectorStore next to the manifest, which only
+    embeds chunks it has not seen yet. search() returns at most a few candidate chunks
+    per query whatever the size of the corpus.
+    """
+
+    def __init__(
+        self,
+        doc_path: str,
+        cache_dir: str = "./.cache/local_docs",
+        max_workers: Optional[int] = None,
+        chunk_tokens: int = 250,
+        splitter=None,
+    ):
+        from ..context.splitter import ChunkSplitter
+
+        self.doc_path = os.path.abspath(doc_path)
+        self.loader = DocumentLoader(self.doc_path, max_workers=max_workers, chunk_tokens=chunk_tokens)
+        self.splitter = splitter or ChunkSplitter(chunk_size=chunk_tokens)
+        # One index per folder
+        self.cache_dir = os.path.join(cache_dir, hashlib.sha1(self.doc_path.encode()).hexdigest()[:16])
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.db_path = os.path.join(self.cache_dir, "manifest.sqlite")
+        self._vector_store = None
+        with self._connect() as db:
+            db.executescript(
+                """
+                PRAGMA journal_mode=WAL;
+                CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    hash TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS pages (
+                    path TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    url TEXT NOT NULL,
+                    title TEXT NOT NULL DEFAULT '',
+                    raw_content TEXT NOT NULL,
+                    PRIMARY KEY (path, position)
+                );
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    title TEXT NOT NULL DEFAULT '',
+                    content TEXT NOT NULL,
+                    embedded INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS chunks_path ON chunks (path);
+                CREATE INDEX IF NOT EXISTS chunks_pending ON chunks (id) WHERE embedded = 0;
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                    content, content='chunks', content_rowid='id', tokenize='porter unicode61'
+                );
+                -- Vectors of deleted chunks, removed from the vector store on its next sync
+                CREATE TABLE IF NOT EXISTS stale_vectors (id INTEGER PRIMARY KEY);
+                CREATE TRIGGER IF NOT EXISTS chunks_insert AFTER INSERT ON chunks BEGIN
+                    INSERT INTO chunks_fts (rowid, content) VALUES (new.id, new.content);
+                END;
+                CREATE TRIGGER IF NOT EXISTS chunks_delete AFTER DELETE ON chunks BEGIN
+                    INSERT INTO chunks_fts (chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                    INSERT OR IGNORE INTO stale_vectors SELECT old.id WHERE old.embedded = 1;
+                END;
+                """
+            )
+
+    @classmethod
+    def from_config(cls, cfg, doc_path: Optional[str] = None) -> "LocalDocumentIndex":
+        from ..context.splitter import ChunkSplitter
+
+        return cls(
+            doc_path or cfg.doc_path,
+            cache_dir=cfg.local_index_dir,
+            max_workers=cfg.doc_loader_workers,
+            chunk_tokens=cfg.chunk_size,
+            splitter=ChunkSplitter.from_config(cfg),
+        )
+
+    async def load(self) -> List[Dict[str, str]]:
+        """Bring the index up to date and return the pages of every document"""
+        await self.refresh()
+        pages = await asyncio.to_thread(self._pages)
+        if not pages:
+            raise ValueError("🤷 Failed to load any documents!")
+        return pages
+
+    async def refresh(self) -> IndexUpdate:
+        """Parse new and changed files and drop deleted ones"""
+        async with self._lock():
+            update, to_parse = await asyncio.to_thread(self._scan)
+            to_stream = [file for file in to_parse if file[1] in STREAM_READERS]
+            to_load = [file for file in to_parse if file[1] not in STREAM_READERS]
+            if to_load:
+                await self._load_files(to_load)
+            for file in to_stream:
+                await asyncio.to_thread(self._store_stream, file)
+            return update
+
+    async def _load_files(self, files) -> None:
+        """
+        Parse files in the loader pool and store each one as soon as it is parsed. Files that
+        fail are left out of the manifest, so they are read again on the next refresh.
+        """
+        loop = asyncio.get_running_loop()
+        executor = get_loader_pool(self.loader.max_workers) if self.loader.max_workers > 1 else None
+
+        async def parse(file):
+            path, extension, _ = file
+            try:
+                pages = await loop.run_in_executor(
+                    executor, load_file, path, extension, self.loader.chunk_tokens, True
+                )
+            except Exception as e:
+                logger.error(f"Failed to load document {path}: {e!r}")
+                pages = None
+            return file, pages
+
+        tasks = [asyncio.create_task(parse(file)) for file in files]
+        try:
+            for task in asyncio.as_completed(tasks):
+                file, pages = await task
+                if pages is not None:
+                    await asyncio.to_thread(self._store, file, pages)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def search(
+        self,
+        queries: List[str],
+        k: int = 20,
+        embeddings=None,
+        embedding_name: str = "",
+    ) -> List[List[Dict[str, str]]]:
+        """
+        Candidate chunks ({"raw_content", "url", "title"}) for each query: the k best by BM25 and,
+        with embeddings, the k most similar, without duplicates.
+        """
+        if not queries:
+            return []
+        candidates = await asyncio.to_thread(self._lexical_search, queries, k)
+        if embeddings is not None:
+            async with self._lock():
+                store = await self._sync_vectors(embeddings, embedding_name or type(embeddings).__name__)
+            vectors = await embeddings.aembed_documents(queries)
+            results = await asyncio.to_thread(store.similarity_search_by_vectors_with_score, vectors, k)
+            for chunk_ids, scored in zip(candidates, results):
+                seen = set(chunk_ids)
+                chunk_ids.extend(int(doc.id) for doc, _ in scored if int(doc.id) not in seen)
+        return await asyncio.to_thread(self._chunks, candidates)
+
+    def _lock(self) -> asyncio.Lock:
+        loop_locks = _locks.setdefault(asyncio.get_running_loop(), {})
+        return loop_locks.setdefault(self.doc_path, asyncio.Lock())
+
+    async def _sync_vectors(self, embeddings, embedding_name: str):
+        """Embed the chunks added since the last search and drop the vectors of deleted ones"""
+        from ..vector_store.local import LocalVectorStore
+
+        if self._vector_store is None or self._vector_store.embedding is not embeddings:
+            self._vector_store = await asyncio.to_thread(self._open_vector_store, embeddings, embedding_name)
+        store: LocalVectorStore = self._vector_store
+
+        # Manifest and vector file work runs in threads; only embedding runs on the loop
+        await asyncio.to_thread(self._drop_stale_vectors, store)
+        while True:
+            pending = await asyncio.to_thread(self._pending_chunks)
+            if not pending:
+                return store
+            await store.aadd_texts(
+                [content for _, _, content in pending],
+                [{"source": url} for _, url, _ in pending],
+                ids=[str(chunk_id) for chunk_id, _, _ in pending],
+            )
+            await asyncio.to_thread(self._mark_embedded, [chunk_id for chunk_id, _, _ in pending])
+
+    def _drop_stale_vectors(self, store) -> None:
+        with self._connect() as db:
+            stale = [str(chunk_id) for chunk_id, in db.execute("SELECT id FROM stale_vectors")]
+            if stale:
+                store.delete(stale)
+                db.execute("DELETE FROM stale_vectors")
+
+    def _pending_chunks(self) -> List[Tuple[int, str, str]]:
+        with self._connect() as db:
+            return db.execute(
+                "SELECT id, url, content FROM chunks WHERE embedded = 0 LIMIT ?", (_EMBED_BATCH_SIZE,)
+            ).fetchall()
+
+    def _mark_embedded(self, chunk_ids: List[int]) -> None:
+        with self._connect() as db:
+            db.executemany("UPDATE chunks SET embedded = 1 WHERE id = ?", [(chunk_id,) for chunk_id in chunk_ids])
+
+    def _open_vector_store(self, embeddings, embedding_name: str):
+        from ..vector_store.local import LocalVectorStore
+
+        path = os.path.join(self.cache_dir, "vectors")
+        with self._connect() as db:
+            current = db.execute("SELECT value FROM settings WHERE key = 'embedding'").fetchone()
+            if current is None or current[0] != embedding_name:
+                # Vectors of another embedding model cannot be compared with this one's
+                shutil.rmtree(path, ignore_errors=True)
+                db.execute("UPDATE chunks SET embedded = 0 WHERE embedded = 1")
+                db.execute("DELETE FROM stale_vectors")
+                db.execute("INSERT OR REPLACE INTO settings VALUES ('embedding', ?)", (embedding_name,))
+        return LocalVectorStore(embeddings, path, index_type="ivf")
+
+    def _scan(self) -> Tuple[IndexUpdate, List[Tuple[str, str, Tuple[int, int, str]]]]:
+        update = IndexUpdate()
+        to_parse = []
+        with self._connect() as db:
+            manifest = {
+                path: (size, mtime_ns, content_hash)
+                for path, size, mtime_ns, content_hash in db.execute("SELECT path, size, mtime_ns, hash FROM files")
+            }
+            present = set()
+            for path, extension in self.loader.files():
+                path = os.path.abspath(path)
+                present.add(path)
+                stat = os.stat(path)
+                known = manifest.get(path)
+                if known and known[:2] == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                content_hash = _hash_file(path)
+                if known and known[2] == content_hash:
+                    # Touched but unchanged
+                    db.execute(
+                        "UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?",
+                        (stat.st_size, stat.st_mtime_ns, path),
+                    )
+                    continue
+                (update.changed if known else update.added).append(path)
+                to_parse.append((path, extension, (stat.st_size, stat.st_mtime_ns, content_hash)))
+
+            update.removed = [path for path in manifest if path not in present]
+            for path in update.removed:
+                self._forget(db, path)
+                db.execute("DELETE FROM files WHERE path = ?", (path,))
+        return update, to_parse
+
+    def _store(self, file, pages: List[Dict[str, str]]) -> None:
+        path, _, file_stat = file
+        with self._connect() as db:
+            self._forget(db, path)
+            self._insert_pages(db, path, 0, pages)
+            self._insert_file(db, path, file_stat)
+
+    def _store_stream(self, file) -> None:
+        """
+        Index a file read by a stream reader, committing each batch of pages. The file is
+        only recorded in the manifest at the end, so an interrupted file is read again.
+        """
+        path, extension, file_stat = file
+        with self._connect() as db:
+            self._forget(db, path)
+            position = 0
+            pages = STREAM_READERS[extension](path, chunk_tokens=self.loader.chunk_tokens)
+            try:
+                while True:
+                    batch = list(islice(pages, _STREAM_BATCH_SIZE))
+                    if not batch:
+                        break
+                    self._insert_pages(db, path, position, batch)
+                    db.commit()
+                    position += len(batch)
+            except Exception as e:
+                logger.error(f"Failed to load document {path}: {e!r}")
+                # Drop the pages committed so far and leave the file out of the manifest
+                db.rollback()
+                self._forget(db, path)
+                db.execute("DELETE FROM files WHERE path = ?", (path,))
+                return
+            self._insert_file(db, path, file_stat)
+
+    def _insert_pages(self, db: sqlite3.Connection, path: str, first_position: int, pages) -> None:
+        db.executemany(
+            "INSERT INTO pages (path, position, url, title, raw_content) VALUES (?, ?, ?, ?, ?)",
+            [
+                (path, first_position + i, page["url"], page.get("title", ""), page["raw_content"])
+                for i, page in enumerate(pages)
+            ],
+        )
+        db.executemany(
+            "INSERT INTO chunks (path, url, title, content) VALUES (?, ?, ?, ?)",
+            [
+                (path, page["url"], page.get("title", ""), chunk)
+                for page in pages
+                for chunk in self.splitter.split_text(page["raw_content"])
+            ],
+        )
+
+    @staticmethod
+    def _insert_file(db: sqlite3.Connection, path: str, file_stat: Tuple[int, int, str]) -> None:
+        db.execute("INSERT OR REPLACE INTO files (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)", (path, *file_stat))
+
+    @staticmethod
+    def _forget(db: sqlite3.Connection, path: str) -> None:
+        db.execute("DELETE FROM pages WHERE path = ?", (path,))
+        db.execute("DELETE FROM chunks WHERE path = ?", (path,))
+
+    def _lexical_search(self, queries: List[str], k: int) -> List[List[int]]:
+        results = []
+        with self._connect() as db:
+            for query in queries:
+                terms = " OR ".join(f'"{word}"' for word in dict.fromkeys(_WORD.findall(query.lower())))
+                if not terms:
+                    results.append([])
+                    continue
+                results.append([
+                    chunk_id for chunk_id, in db.execute(
+                        "SELECT rowid FROM chunks_fts WHERE chunks_fts MATCH ? ORDER BY rank LIMIT ?", (terms, k)
+                    )
+                ])
+        return results
+
+    def _chunks(self, candidates: List[List[int]]) -> List[List[Dict[str, str]]]:
+        results = []
+        with self._connect() as db:
+            for chunk_ids in candidates:
+                if not chunk_ids:
+                    results.append([])
+                    continue
+                placeholders = ",".join("?" * len(chunk_ids))
+                found = {
+                    chunk_id: {"raw_content": content, "url": url, "title": title}
+                    for chunk_id, url, title, content in db.execute(
+                        f"SELECT id, url, title, content FROM chunks WHERE id IN ({placeholders})", chunk_ids
+                    )
+                }
+                results.append([found[chunk_id] for chunk_id in chunk_ids if chunk_id in found])
+        return results
+
+    def _pages(self) -> List[Dict[str, str]]:
+        with self._connect() as db:
+            return [
+                {"raw_content": raw_content, "url": url, "title": title}
+                for url, title, raw_content in db.execute(
+                    "SELECT url, title, raw_content FROM pages ORDER BY path, position"
+                )
+            ]
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """A connection that commits on success and is closed afterwards"""
+        db = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
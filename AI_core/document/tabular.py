@@ -0,0 +1,109 @@
+"""
+Streaming readers for spreadsheets (csv, xls, xlsx)
+"""
+import csv
+import os
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from ..llm_provider.generic.base import _check_pkg
+from ..utils.tokens import count_tokens
+
+# Rows read and token-counted together
+ROW_BATCH_SIZE = 1000
+_SNIFF_BYTES = 64 * 1024
+
+
+def load_table(file_path: str, file_extension: str, chunk_tokens: int = 250) -> Iterator[Dict[str, str]]:
+    """
+    Read a spreadsheet row by row and group the rows into pages of at most chunk_tokens
+    tokens, each starting with the sheet's header row. A row longer than a page gets a
+    page of its own. Pages are yielded as they fill up, so the sheet is never held whole.
+    """
+    url = os.path.basename(file_path)
+    for sheet_name, rows in TABLE_READERS[file_extension](file_path):
+        for text in _chunk_rows(rows, chunk_tokens, f"Sheet: {sheet_name}" if sheet_name else None):
+            yield {"raw_content": text, "url": url}
+
+
+def read_csv(file_path: str) -> Iterator[Tuple[Optional[str], Iterator[Sequence]]]:
+    with open(file_path, newline="", encoding="utf-8", errors="replace") as f:
+        sample = f.read(_SNIFF_BYTES)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+        except csv.Error:
+            dialect = csv.excel
+        yield None, csv.reader(f, dialect)
+
+
+def read_xlsx(file_path: str) -> Iterator[Tuple[Optional[str], Iterator[Sequence]]]:
+    _check_pkg("openpyxl")
+    import openpyxl
+
+    # Read-only workbooks parse each sheet lazily as its rows are iterated
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield sheet.title, sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def read_xls(file_path: str) -> Iterator[Tuple[Optional[str], Iterator[Sequence]]]:
+    _check_pkg("xlrd")
+    import xlrd
+
+    workbook = xlrd.open_workbook(file_path, on_demand=True)
+    try:
+        for sheet_index in range(workbook.nsheets):
+            sheet = workbook.sheet_by_index(sheet_index)
+            yield sheet.name, (sheet.row_values(row) for row in range(sheet.nrows))
+            workbook.unload_sheet(sheet_index)
+    finally:
+        workbook.release_resources()
+
+
+TABLE_READERS = {
+    "csv": read_csv,
+    "xls": read_xls,
+    "xlsx": read_xlsx,
+}
+
+
+def _format_row(row: Sequence) -> str:
+    cells = ["" if cell is None else str(cell).strip() for cell in row]
+    while cells and not cells[-1]:
+        cells.pop()
+    return " | ".join(cells)
+
+
+def _formatted_rows(rows: Iterable[Sequence]) -> Iterator[str]:
+    for row in rows:
+        line = _format_row(row)
+        if line.strip(" |"):
+            yield line
+
+
+def _chunk_rows(rows: Iterable[Sequence], chunk_tokens: int, title: Optional[str] = None) -> Iterator[str]:
+    lines = _formatted_rows(rows)
+    header = next(lines, None)
+    if header is None:
+        return
+    header = f"{title}\n{header}" if title else header
+    header_tokens = count_tokens([header + "\n"])[0]
+
+    chunk: List[str] = []
+    size = header_tokens
+    while True:
+        batch = list(islice(lines, ROW_BATCH_SIZE))
+        if not batch:
+            break
+        for line, tokens in zip(batch, count_tokens([line + "\n" for line in batch])):
+            if chunk and size + tokens > chunk_tokens:
+                yield "\n".join([header, *chunk])
+                chunk, size = [], header_tokens
+            chunk.append(line)
+            size += tokens
+    if chunk:
+        yield "\n".join([header, *chunk])
@@ -0,0 +1,55 @@
+"""
+Streaming reader for web archives (.warc and .warc.gz)
+"""
+from typing import Dict, Iterator
+
+from ..llm_provider.generic.base import _check_pkg
+
+WARC_EXTENSIONS = ("warc", "warc.gz")
+# Larger responses are skipped rather than read into memory
+MAX_RESPONSE_BYTES = 10 * 1024 * 1024
+_HTML_TYPES = ("text/html", "application/xhtml+xml")
+
+
+def iter_warc_pages(file_path: str, max_response_bytes: int = MAX_RESPONSE_BYTES) -> Iterator[Dict[str, str]]:
+    """
+    Yield a page ({"raw_content", "url", "title"}) for every successful HTML response in
+    the archive, one record at a time, so only one response is held in memory.
+    """
+    _check_pkg("warcio")
+    from warcio.archiveiterator import ArchiveIterator
+
+    from ..scraper.beautiful_soup.beautiful_soup import BeautifulSoupScraper
+
+    with open(file_path, "rb") as f:
+        for record in ArchiveIterator(f):
+            if record.rec_type != "response" or record.http_headers is None:
+                continue
+            if record.http_headers.get_statuscode() != "200":
+                continue
+            content_type = record.http_headers.get_header("Content-Type", "").lower()
+            if not content_type.startswith(_HTML_TYPES):
+                continue
+            length = record.http_headers.get_header("Content-Length")
+            if length and length.isdigit() and int(length) > max_response_bytes:
+                continue
+
+            url = record.rec_headers.get_header("WARC-Target-URI")
+            html = record.content_stream().read(max_response_bytes + 1)
+            if len(html) > max_response_bytes:
+                continue
+            try:
+                content, _, title = BeautifulSoupScraper.extract(html, url, _charset(content_type))
+            except Exception as e:
+                print(f"Failed to extract {url} from {file_path}: {e}")
+                continue
+            if content:
+                yield {"raw_content": content, "url": url, "title": title or ""}
+
+
+def _charset(content_type: str):
+    for parameter in content_type.split(";")[1:]:
+        key, _, value = parameter.strip().partition("=")
+        if key == "charset" and value:
+            return value.strip("\"'")
+    return None
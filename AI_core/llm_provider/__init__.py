@@ -1,5 +1,18 @@
 from .generic import GenericLLMProvider
+from .cache import ResponseCache, get_response_cache, set_response_cache
+from .governor import Priority, RateGovernor, get_rate_governor, set_rate_governor
+from .resilience import CallPolicy, get_call_policy, set_call_policy
 
 __all__ = [
     "GenericLLMProvider",
+    "ResponseCache",
+    "get_response_cache",
+    "set_response_cache",
+    "Priority",
+    "RateGovernor",
+    "get_rate_governor",
+    "set_rate_governor",
+    "CallPolicy",
+    "get_call_policy",
+    "set_call_policy",
 ]
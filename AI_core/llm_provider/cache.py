@@ -0,0 +1,168 @@
+"""
+Persistent cache of chat completions, replayed instead of calling the provider again
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# One cache per directory and settings per process
+_caches: Dict[Tuple, "ResponseCache"] = {}
+_caches_lock = threading.Lock()
+# Cache set with set_response_cache for every chat completion; False when none was set
+_response_cache: Any = False
+# Cache configured by the environment's config, for calls made without a config
+_default_cache: Any = False
+
+
+class ResponseCache:
+    """
+    Stores chat completions in SQLite under a hash of everything that determines them.
+    Entries expire ttl seconds after they were written, and the least recently used are
+    evicted once the stored responses exceed max_bytes. With max_temperature, only calls
+    sampled at or below that temperature are cached, as hotter ones are meant to vary.
+
+    Any object with accepts(temperature), get(key) and put(key, response) can be used
+    instead through set_response_cache.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        ttl: Optional[float] = 86_400,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_temperature: Optional[float] = None,
+    ):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_temperature = max_temperature
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(cache_dir, "responses.sqlite"), check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, size INTEGER, "
+            "created REAL, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_used)")
+
+    @classmethod
+    def from_config(cls, cfg) -> Optional["ResponseCache"]:
+        """The cache configured by LLM_CACHE_*, or None when LLM_CACHE_DIR is empty"""
+        if not cfg.llm_cache_dir:
+            return None
+        settings = (
+            os.path.abspath(cfg.llm_cache_dir),
+            cfg.llm_cache_ttl or None,
+            cfg.llm_cache_max_mb * 1024 * 1024,
+            cfg.llm_cache_max_temperature,
+        )
+        with _caches_lock:
+            if settings not in _caches:
+                cache_dir, ttl, max_bytes, max_temperature = settings
+                _caches[settings] = cls(cache_dir, ttl=ttl, max_bytes=max_bytes, max_temperature=max_temperature)
+            return _caches[settings]
+
+    def accepts(self, temperature: Optional[float]) -> bool:
+        """Whether calls at temperature (None for the provider's default) are cached"""
+        if self.max_temperature is None:
+            return True
+        return temperature is not None and temperature <= self.max_temperature
+
+    @staticmethod
+    def key(provider: str, model: str, temperature: Optional[float], messages: Any, **kwargs: Any) -> str:
+        """Hash of a request; messages may be dicts or LangChain messages"""
+        request = {
+            "provider": provider,
+            "model": model,
+            "temperature": temperature,
+            "messages": messages,
+            "kwargs": kwargs,
+        }
+        encoded = json.dumps(request, sort_keys=True, default=_serialise, ensure_ascii=False)
+        return hashlib.sha256(encoded.encode("utf-8", errors="ignore")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if self.ttl and created + self.ttl < now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            return response
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode("utf-8", errors="ignore"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, response, size, now, now)
+            )
+            self._evict(now)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def _evict(self, now: float) -> None:
+        if self.ttl:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total, = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+        # Drop the least recently used responses until the rest fit
+        excess = total - self.max_bytes
+        freed = 0
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            stale.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+
+def set_response_cache(cache) -> None:
+    """
+    Use cache (or no cache, with None) for every chat completion of the process; False
+    goes back to the cache configured by each call's config
+    """
+    global _response_cache
+    _response_cache = cache
+
+
+def get_response_cache(cfg=None):
+    """
+    The cache set with set_response_cache, or else the one configured by cfg (by the
+    environment's config when cfg is None)
+    """
+    global _default_cache
+    if _response_cache is not False:
+        return _response_cache
+    if cfg is not None:
+        return ResponseCache.from_config(cfg)
+    if _default_cache is False:
+        from ..config import Config
+
+        _default_cache = ResponseCache.from_config(Config())
+    return _default_cache
+
+
+def _serialise(value: Any) -> Any:
+    # LangChain messages and other pydantic models
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if hasattr(value, "dict"):
+        return value.dict()
+    return str(value)
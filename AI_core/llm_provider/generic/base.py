@@ -3,6 +3,9 @@ from typing import Any
 from colorama import Fore, Style, init
 import os
 
+from ...utils.usage import record_call_usage
+from ..resilience import report_stream_activity
+
 _SUPPORTED_PROVIDERS = {
     "openai",
     "anthropic",
@@ -31,7 +34,8 @@ class GenericLLMProvider:
             _check_pkg("langchain_openai")
             from langchain_openai import ChatOpenAI
 
-            llm = ChatOpenAI(**kwargs)
+            # Report token usage in the last streamed chunk too
+            llm = ChatOpenAI(**{"stream_usage": True, **kwargs})
         elif provider == "anthropic":
             _check_pkg("langchain_anthropic")
             from langchain_anthropic import ChatAnthropic
@@ -114,6 +118,7 @@ class GenericLLMProvider:
         if not stream:
             # Getting output from the model chain using ainvoke for asynchronous invoking
             output = await self.llm.ainvoke(messages)
+            record_call_usage(getattr(output, "usage_metadata", None))
 
             return output.content
 
@@ -126,20 +131,32 @@ class GenericLLMProvider:
 
         # Streaming the response using the chain astream method from langchain
         async for chunk in self.llm.astream(messages):
+            record_call_usage(getattr(chunk, "usage_metadata", None))
             content = chunk.content
             if content is not None:
                 response += content
                 paragraph += content
                 if "\n" in paragraph:
+                    report_stream_activity(emitted=True)
                     await self._send_output(paragraph, websocket)
                     paragraph = ""
+                    continue
+            report_stream_activity()
 
         if paragraph:
+            report_stream_activity(emitted=True)
             await self._send_output(paragraph, websocket)
 
         return response
 
-    async def _send_output(self, content, websocket=None):
+    @classmethod
+    async def replay_response(cls, response, websocket=None):
+        """Send a stored response to the websocket line by line, as stream_response would"""
+        for line in response.splitlines(keepends=True):
+            await cls._send_output(line, websocket)
+
+    @staticmethod
+    async def _send_output(content, websocket=None):
         if websocket is not None:
             await websocket.send_json({"type": "report", "output": content})
         else:
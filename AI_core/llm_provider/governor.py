@@ -0,0 +1,254 @@
+"""
+Process-wide scheduler keeping LLM calls within requests and tokens per minute budgets
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+import weakref
+from collections import deque
+from enum import IntEnum
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..utils.logger import get_formatted_logger
+from ..utils.usage import count_message_tokens
+
+logger = get_formatted_logger()
+
+WINDOW_SECONDS = 60.0
+
+
+class Priority(IntEnum):
+    """Lower values are served first"""
+    INTERACTIVE = 0  # Report writing streamed to the user
+    NORMAL = 5
+    BACKGROUND = 10  # Planning, agent selection
+
+
+class _Bucket:
+    """Sliding one minute window of the requests and tokens of one limit, with its queue"""
+
+    def __init__(self, name: str, rpm: int, tpm: int):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests: deque = deque()
+        self.token_log: deque = deque()
+        self.tokens = 0
+        self.waiters: List[Tuple[int, int, int, asyncio.Future]] = []
+        self.max_queue_depth = 0
+        # Per event loop with queued calls, so that a closed loop never strands the others
+        self.timers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.TimerHandle]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def expire(self, now: float) -> None:
+        while self.requests and self.requests[0] <= now - WINDOW_SECONDS:
+            self.requests.popleft()
+        while self.token_log and self.token_log[0][0] <= now - WINDOW_SECONDS:
+            self.tokens -= self.token_log.popleft()[1]
+
+    def fits(self, tokens: int) -> bool:
+        if self.rpm and len(self.requests) >= self.rpm:
+            return False
+        # A call larger than the whole budget still goes through once the window is empty
+        if self.tpm and self.token_log and self.tokens + tokens > self.tpm:
+            return False
+        return True
+
+    def add_tokens(self, now: float, tokens: int) -> None:
+        if tokens > 0:
+            self.token_log.append((now, tokens))
+            self.tokens += tokens
+
+    def next_expiry(self, now: float) -> float:
+        """Seconds until the oldest request or tokens leave the window"""
+        oldest = []
+        if self.requests:
+            oldest.append(self.requests[0])
+        if self.token_log:
+            oldest.append(self.token_log[0][0])
+        return max(0.0, min(oldest, default=now) + WINDOW_SECONDS - now)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for *_, future in self.waiters if not future.done())
+
+    def has_waiters(self, loop: asyncio.AbstractEventLoop) -> bool:
+        return any(not future.done() and future.get_loop() is loop for *_, future in self.waiters)
+
+
+class RateGovernor:
+    """
+    Queues LLM calls per limit ("provider:model" or "provider") and lets them through in
+    priority order, then arrival order, as long as the requests and estimated tokens of
+    the last minute stay within the limit's budgets. Calls to providers and models
+    without a limit are never queued.
+
+    Limits are read from LLM_RATE_LIMITS, e.g. "openai:gpt-4o=500/30000,anthropic=50/40000"
+    for requests/tokens per minute (0 for no limit on one of them).
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[int, int]]] = None):
+        self.limits = dict(limits or {})
+        self._buckets: Dict[str, _Bucket] = {}
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    @classmethod
+    def from_config(cls, cfg) -> "RateGovernor":
+        return cls(parse_rate_limits(cfg.llm_rate_limits))
+
+    @staticmethod
+    def estimate_tokens(messages: Any, model: str = "") -> int:
+        """Tokens of the prompt, from the content of dict or LangChain messages"""
+        return count_message_tokens(messages, model)
+
+    def limited(self, provider: str, model: str) -> bool:
+        """Whether calls to the model are subject to a limit"""
+        return f"{provider}:{model}" in self.limits or provider in self.limits
+
+    async def acquire(self, provider: str, model: str, tokens: int, priority: int = Priority.NORMAL) -> None:
+        """Wait until a call of about tokens prompt tokens fits the budgets of its limit"""
+        bucket = self._bucket(provider, model)
+        if bucket is None:
+            return
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            heapq.heappush(bucket.waiters, (int(priority), next(self._sequence), tokens, future))
+            self._dispatch(bucket)
+            queue_depth = bucket.queue_depth
+            bucket.max_queue_depth = max(bucket.max_queue_depth, queue_depth)
+        if queue_depth:
+            logger.info(f"LLM call queued for {bucket.name} ({queue_depth} waiting)")
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                self._dispatch(bucket)
+            raise
+
+    def record(self, provider: str, model: str, tokens: int) -> None:
+        """Count tokens used after the call was let through, such as those of the response"""
+        bucket = self._bucket(provider, model)
+        if bucket is not None:
+            with self._lock:
+                bucket.add_tokens(time.monotonic(), tokens)
+
+    def metrics(self) -> Dict[str, Dict[str, int]]:
+        """Queue depth and usage of the last minute of every limit used so far"""
+        with self._lock:
+            now = time.monotonic()
+            metrics = {}
+            for name, bucket in self._buckets.items():
+                bucket.expire(now)
+                metrics[name] = {
+                    "queue_depth": bucket.queue_depth,
+                    "max_queue_depth": bucket.max_queue_depth,
+                    "requests_last_minute": len(bucket.requests),
+                    "tokens_last_minute": bucket.tokens,
+                    "rpm_limit": bucket.rpm,
+                    "tpm_limit": bucket.tpm,
+                }
+            return metrics
+
+    def _bucket(self, provider: str, model: str) -> Optional[_Bucket]:
+        name = f"{provider}:{model}" if f"{provider}:{model}" in self.limits else provider
+        if name not in self.limits:
+            return None
+        with self._lock:
+            if name not in self._buckets:
+                self._buckets[name] = _Bucket(name, *self.limits[name])
+            return self._buckets[name]
+
+    def _dispatch(self, bucket: _Bucket) -> None:
+        """Let queued calls through in order while they fit; called with the lock held"""
+        now = time.monotonic()
+        bucket.expire(now)
+        while bucket.waiters:
+            _, _, tokens, future = bucket.waiters[0]
+            if future.done():
+                heapq.heappop(bucket.waiters)
+                continue
+            if not bucket.fits(tokens):
+                break
+            heapq.heappop(bucket.waiters)
+            bucket.requests.append(now)
+            bucket.add_tokens(now, tokens)
+            _resolve(future)
+
+        # Calls queue from their own loop, so every loop with queued calls wakes itself up
+        loop = asyncio.get_running_loop()
+        if loop not in bucket.timers and bucket.has_waiters(loop):
+            bucket.timers[loop] = loop.call_later(bucket.next_expiry(now), self._on_timer, bucket, loop)
+
+    def _on_timer(self, bucket: _Bucket, loop: asyncio.AbstractEventLoop) -> None:
+        with self._lock:
+            bucket.timers.pop(loop, None)
+            self._dispatch(bucket)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    loop = future.get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if loop is running:
+        future.set_result(None)
+    else:
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+
+def parse_rate_limits(spec: Optional[str]) -> Dict[str, Tuple[int, int]]:
+    """Parse "provider[:model]=rpm/tpm,..." into {"provider[:model]": (rpm, tpm)}"""
+    limits = {}
+    for entry in (spec or "").split(","):
+        if not entry.strip():
+            continue
+        try:
+            name, budgets = entry.rsplit("=", 1)
+            rpm, _, tpm = budgets.partition("/")
+            limits[name.strip()] = (int(rpm or 0), int(tpm or 0))
+        except ValueError:
+            raise ValueError(f"Invalid LLM_RATE_LIMITS entry: {entry!r}. Expected provider[:model]=rpm/tpm")
+    return limits
+
+
+# Governor set with set_rate_governor for every call of the process
+_governor: Optional[RateGovernor] = None
+# Governors by LLM_RATE_LIMITS, so that configs with the same limits share their budgets
+_governors: Dict[str, RateGovernor] = {}
+# LLM_RATE_LIMITS of the environment's config, for calls made without a config
+_default_limits: Optional[str] = None
+_governor_lock = threading.Lock()
+
+
+def get_rate_governor(cfg=None) -> RateGovernor:
+    """
+    The governor set with set_rate_governor, or else the process-wide one for the limits
+    of cfg (of the environment's config when cfg is None)
+    """
+    global _default_limits
+    with _governor_lock:
+        if _governor is not None:
+            return _governor
+        if cfg is not None:
+            spec = cfg.llm_rate_limits or ""
+        else:
+            if _default_limits is None:
+                from ..config import Config
+
+                _default_limits = Config().llm_rate_limits or ""
+            spec = _default_limits
+        if spec not in _governors:
+            _governors[spec] = RateGovernor(parse_rate_limits(spec))
+        return _governors[spec]
+
+
+def set_rate_governor(governor: Optional[RateGovernor]) -> None:
+    """Use governor for every call of the process; None goes back to the configured ones"""
+    global _governor
+    with _governor_lock:
+        _governor = governor
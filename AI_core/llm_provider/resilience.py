@@ -0,0 +1,293 @@
+"""
+Retries, deadlines and hedging for LLM calls
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from ..utils.logger import get_formatted_logger
+
+logger = get_formatted_logger()
+
+# HTTP statuses worth trying again: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+# Exception class names of provider SDKs (openai, anthropic, httpx, ...) for transient failures
+_RETRYABLE_NAMES = ("Timeout", "Connection", "RateLimit", "Overloaded", "ServiceUnavailable", "InternalServer")
+
+Target = Tuple[str, str]
+T = TypeVar("T")
+
+
+@dataclass
+class CallPolicy:
+    """
+    How create_chat_completion calls a model: each attempt gets at most timeout seconds
+    and the whole call at most deadline seconds. Retryable errors are retried up to
+    max_retries times with exponential backoff and full jitter, then the fallback model
+    (if any) is tried the same way. With hedge, a non-streaming call still running after
+    the p95 latency observed for its model is raced against a second request (to the
+    fallback model when set) and the slower one is cancelled.
+
+    Streaming calls are never hedged and are not bound by the per-attempt timeout or the
+    deadline once chunks arrive: they get timeout seconds (within the deadline) for the
+    first chunk, then stream_idle_timeout seconds between chunks. Once output has been
+    sent to the client, a failed stream is neither retried nor sent to the fallback
+    model, which would repeat the output.
+
+    Time spent waiting for admission (a rate limit slot) counts neither toward the
+    timeouts and deadline nor toward the latencies hedging is based on.
+    """
+    timeout: float = 120.0
+    deadline: float = 600.0
+    stream_idle_timeout: float = 30.0
+    max_retries: int = 3
+    backoff_base: float = 1.0
+    backoff_max: float = 30.0
+    hedge: bool = False
+    hedge_min_samples: int = 20
+    fallback: Optional[Target] = None
+
+    @classmethod
+    def from_config(cls, cfg) -> "CallPolicy":
+        from ..config import Config
+
+        fallback = Config.parse_llm(cfg.llm_fallback) if cfg.llm_fallback else None
+        return cls(
+            timeout=cfg.llm_timeout,
+            deadline=cfg.llm_deadline,
+            stream_idle_timeout=cfg.llm_stream_idle_timeout,
+            max_retries=cfg.llm_max_retries,
+            hedge=cfg.llm_hedge,
+            fallback=fallback,
+        )
+
+    def backoff(self, retry: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+
+
+class LatencyTracker:
+    """Recent latencies of successful calls per (provider, model)"""
+
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._latencies: Dict[Target, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, target: Target, seconds: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(target, deque(maxlen=self.size)).append(seconds)
+
+    def percentile(self, target: Target, percentile: float = 95, min_samples: int = 20) -> Optional[float]:
+        with self._lock:
+            latencies = sorted(self._latencies.get(target, ()))
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+
+latencies = LatencyTracker()
+
+
+@dataclass
+class StreamProgress:
+    """Activity of a streaming attempt, reported by the provider as chunks arrive"""
+    started: float = field(default_factory=time.monotonic)
+    last_chunk: Optional[float] = None
+    emitted: bool = False
+
+
+# Progress of the streaming attempt running in the current task
+_stream_progress: ContextVar[Optional[StreamProgress]] = ContextVar("stream_progress", default=None)
+
+
+def report_stream_activity(emitted: bool = False) -> None:
+    """Called by providers for every streamed chunk, with emitted when output is sent to the client"""
+    progress = _stream_progress.get()
+    if progress is not None:
+        progress.last_chunk = time.monotonic()
+        progress.emitted = progress.emitted or emitted
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    return any(name in type(error).__name__ for name in _RETRYABLE_NAMES)
+
+
+async def call_with_policy(
+    call: Callable[[str, str], Awaitable[T]],
+    target: Target,
+    policy: CallPolicy,
+    hedge: bool = True,
+    stream: bool = False,
+    admit: Optional[Callable[[str, str], Awaitable[None]]] = None,
+) -> T:
+    """
+    Run call(provider, model) for the target, then its fallback, as the policy allows.
+    Every request, hedged ones included, first waits for admit(provider, model).
+    """
+    deadline = time.monotonic() + policy.deadline
+    targets: List[Target] = [target]
+    if policy.fallback and policy.fallback != target:
+        targets.append(policy.fallback)
+    hedge_target = policy.fallback or target
+
+    last_error: Optional[BaseException] = None
+    for current in targets:
+        for retry in range(policy.max_retries + 1):
+            if deadline - time.monotonic() <= 0:
+                break
+            if admit is not None:
+                # Queued time is not the call's: the deadline moves by as much
+                queued_at = time.monotonic()
+                await admit(*current)
+                deadline += time.monotonic() - queued_at
+            remaining = deadline - time.monotonic()
+            progress = StreamProgress() if stream else None
+            try:
+                if progress is not None:
+                    return await _stream_attempt(call, current, policy, progress, remaining)
+                return await asyncio.wait_for(
+                    _attempt(call, current, hedge_target if hedge and policy.hedge else None, policy, admit),
+                    timeout=min(policy.timeout, remaining),
+                )
+            except Exception as e:
+                last_error = e
+                if progress is not None and progress.emitted:
+                    # The client already has part of this answer; another attempt would repeat it
+                    logger.warning(f"LLM stream from {current[0]}:{current[1]} failed after sending output: {e!r}")
+                    raise
+                if not is_retryable(e):
+                    logger.warning(f"LLM call to {current[0]}:{current[1]} failed: {e!r}")
+                    break
+                if retry < policy.max_retries:
+                    delay = min(policy.backoff(retry), max(0.0, deadline - time.monotonic()))
+                    logger.warning(
+                        f"LLM call to {current[0]}:{current[1]} failed ({e!r}), retrying in {delay:.1f}s"
+                    )
+                    await asyncio.sleep(delay)
+    if last_error is None:
+        last_error = TimeoutError(f"LLM call to {target[0]}:{target[1]} ran out of time")
+    raise last_error
+
+
+async def _attempt(
+    call: Callable[[str, str], Awaitable[T]],
+    target: Target,
+    hedge_target: Optional[Target],
+    policy: CallPolicy,
+    admit: Optional[Callable[[str, str], Awaitable[None]]] = None,
+) -> T:
+    """The call to target, admitted already, raced against a hedged request when slow"""
+    tasks = [asyncio.create_task(_timed(call, target))]
+    try:
+        hedge_after = None
+        if hedge_target is not None:
+            hedge_after = latencies.percentile(target, 95, policy.hedge_min_samples)
+        if hedge_after is None:
+            return await tasks[0]
+
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            logger.info(f"LLM call to {target[0]}:{target[1]} slower than {hedge_after:.1f}s, hedging")
+            # The hedged request is a request of its own, admitted separately
+            tasks.append(asyncio.create_task(_timed(call, hedge_target, admit)))
+
+        # First successful response wins; fail only once every request has failed
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        # The losing request (or every request, when cancelled by the deadline)
+        for task in tasks:
+            task.cancel()
+
+
+async def _stream_attempt(
+    call: Callable[[str, str], Awaitable[T]],
+    target: Target,
+    policy: CallPolicy,
+    progress: StreamProgress,
+    remaining: float,
+) -> T:
+    """Wait for a streaming call while it keeps producing chunks"""
+    token = _stream_progress.set(progress)
+    try:
+        # The task copies the context, so the provider reports to this attempt's progress
+        task = asyncio.create_task(call(*target))
+    finally:
+        _stream_progress.reset(token)
+    try:
+        while True:
+            # Recomputed after every wait, as chunks that arrived meanwhile move the limit
+            if progress.last_chunk is None:
+                limit = progress.started + min(policy.timeout, remaining)
+            else:
+                limit = progress.last_chunk + policy.stream_idle_timeout
+            wait = limit - time.monotonic()
+            if wait <= 0:
+                waited = "the first chunk" if progress.last_chunk is None else "the next chunk"
+                raise asyncio.TimeoutError(f"LLM stream from {target[0]}:{target[1]} timed out waiting for {waited}")
+            done, _ = await asyncio.wait({task}, timeout=wait)
+            if done:
+                return task.result()
+    finally:
+        task.cancel()
+
+
+async def _timed(
+    call: Callable[[str, str], Awaitable[T]],
+    target: Target,
+    admit: Optional[Callable[[str, str], Awaitable[None]]] = None,
+) -> T:
+    if admit is not None:
+        await admit(*target)
+    # Latency of the call alone, without the time queued for admission
+    start = time.monotonic()
+    response = await call(*target)
+    latencies.record(target, time.monotonic() - start)
+    return response
+
+
+# Policy set with set_call_policy for every call of the process
+_policy: Optional[CallPolicy] = None
+# Policy of the environment's config, for calls made without a config
+_default_policy: Optional[CallPolicy] = None
+
+
+def get_call_policy(cfg=None) -> CallPolicy:
+    """
+    The policy set with set_call_policy, or else the one configured by cfg (by the
+    environment's config when cfg is None)
+    """
+    global _default_policy
+    if _policy is not None:
+        return _policy
+    if cfg is not None:
+        return CallPolicy.from_config(cfg)
+    if _default_policy is None:
+        from ..config import Config
+
+        _default_policy = CallPolicy.from_config(Config())
+    return _default_policy
+
+
+def set_call_policy(policy: Optional[CallPolicy]) -> None:
+    """Use policy for every call of the process; None goes back to the configured ones"""
+    global _policy, _default_policy
+    _policy = policy
+    _default_policy = None
@@ -0,0 +1,261 @@
+"""
+Persistent, content-addressed cache for embedding vectors
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from ..utils.logger import get_formatted_logger
+
+logger = get_formatted_logger()
+
+# One cache per (directory, namespace) per process, shared by every researcher
+_caches: Dict[tuple, "EmbeddingCache"] = {}
+_caches_lock = threading.Lock()
+# Embedding keyword arguments that change the vectors returned for a text
+OUTPUT_KWARGS = ("dimensions", "output_dimensionality", "encode_kwargs", "model_kwargs", "task_type", "input_type")
+
+
+class EmbeddingCache:
+    """
+    Stores vectors of one (provider, model) namespace in a memory-mapped array file.
+    A SQLite index maps content hashes to slots of that file and tracks recency so the
+    least recently used vectors are evicted once max_entries is reached.
+    """
+
+    def __init__(self, cache_dir: str, namespace: str, max_entries: int = 200_000, dtype: str = "float16"):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.namespace = hashlib.sha1(namespace.encode()).hexdigest()[:16]
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.vectors_path = os.path.join(cache_dir, f"{self.namespace}.{self.dtype.name}")
+        self._vectors: Optional[np.memmap] = None
+        self._dim: Optional[int] = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(cache_dir, "index.sqlite"), check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS namespaces (namespace TEXT PRIMARY KEY, name TEXT, dim INTEGER, dtype TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (namespace TEXT, key TEXT, slot INTEGER, last_used REAL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (namespace, last_used)")
+        row = self._conn.execute(
+            "SELECT dim, dtype FROM namespaces WHERE namespace = ?", (self.namespace,)
+        ).fetchone()
+        if row and row[0] and row[1] == self.dtype.name and os.path.exists(self.vectors_path):
+            self._open(row[0])
+            self._conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND slot >= ?", (self.namespace, self.max_entries)
+            )
+        elif row:
+            # Stale index without its vector file (or stored with another dtype): start over
+            self._conn.execute("DELETE FROM entries WHERE namespace = ?", (self.namespace,))
+            self._conn.execute("DELETE FROM namespaces WHERE namespace = ?", (self.namespace,))
+            row = None
+        if not row:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO namespaces VALUES (?, ?, NULL, ?)", (self.namespace, namespace, self.dtype.name)
+            )
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Return the cached vectors found for the given keys and mark them as recently used"""
+        if self._vectors is None or not keys:
+            return {}
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, slot FROM entries WHERE namespace = ? AND key IN ({','.join('?' * len(batch))})",
+                    (self.namespace, *batch),
+                ).fetchall()
+                for key, slot in rows:
+                    found[key] = self._vectors[slot].astype(np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE namespace = ? AND key = ?",
+                    [(now, self.namespace, key) for key in found],
+                )
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        """Store vectors, evicting the least recently used entries when the cache is full"""
+        if not items:
+            return
+        with self._lock:
+            if self._vectors is None:
+                self._create_or_open(len(next(iter(items.values()))))
+            mismatched = [key for key, vector in items.items() if len(vector) != self._dim]
+            if mismatched:
+                # The namespace was filled by a model of another dimension: keep serving its vectors
+                logger.warning(
+                    f"Not caching {len(mismatched)} embeddings of dimension {len(items[mismatched[0]])}, "
+                    f"the cache holds vectors of dimension {self._dim}"
+                )
+                items = {key: vector for key, vector in items.items() if len(vector) == self._dim}
+                if not items:
+                    return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                known = set()
+                keys = list(items)
+                for start in range(0, len(keys), 500):
+                    batch = keys[start:start + 500]
+                    known.update(key for key, in self._conn.execute(
+                        f"SELECT key FROM entries WHERE namespace = ? AND key IN ({','.join('?' * len(batch))})",
+                        (self.namespace, *batch),
+                    ))
+                new_keys = [key for key in keys if key not in known][:self.max_entries]
+                slots = self._allocate_slots(len(new_keys))
+                now = time.time()
+                for key, slot in zip(new_keys, slots):
+                    self._vectors[slot] = np.asarray(items[key], dtype=self.dtype)
+                self._conn.executemany(
+                    "INSERT INTO entries VALUES (?, ?, ?, ?)",
+                    [(self.namespace, key, slot, now) for key, slot in zip(new_keys, slots)],
+                )
+                self._vectors.flush()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _allocate_slots(self, count: int) -> List[int]:
+        used = self._conn.execute(
+            "SELECT COUNT(*) FROM entries WHERE namespace = ?", (self.namespace,)
+        ).fetchone()[0]
+        free = min(count, self.max_entries - used)
+        slots = list(range(used, used + free))
+        if count > free:
+            evicted = self._conn.execute(
+                "SELECT key, slot FROM entries WHERE namespace = ? ORDER BY last_used LIMIT ?",
+                (self.namespace, count - free),
+            ).fetchall()
+            self._conn.executemany(
+                "DELETE FROM entries WHERE namespace = ? AND key = ?",
+                [(self.namespace, key) for key, _ in evicted],
+            )
+            slots.extend(slot for _, slot in evicted)
+        return slots
+
+    def _create_or_open(self, dim: int) -> None:
+        # Another process may have created the vector file since this cache was opened
+        row = self._conn.execute("SELECT dim FROM namespaces WHERE namespace = ?", (self.namespace,)).fetchone()
+        if not (row and row[0] and os.path.exists(self.vectors_path)):
+            with open(self.vectors_path, "wb") as f:
+                f.truncate(self.max_entries * dim * self.dtype.itemsize)
+            self._conn.execute("UPDATE namespaces SET dim = ? WHERE namespace = ?", (dim, self.namespace))
+        self._open(row[0] if row and row[0] else dim)
+
+    def _open(self, dim: int) -> None:
+        expected_size = self.max_entries * dim * self.dtype.itemsize
+        if os.path.getsize(self.vectors_path) < expected_size:
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(expected_size)
+        self._dim = dim
+        self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r+", shape=(self.max_entries, dim))
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends texts it has never embedded before to the provider.
+    Keys are (provider, model, output settings, hash of the text), so results survive
+    across runs and models configured to return other vectors never share them.
+    """
+
+    def __init__(self, embeddings: Embeddings, provider: str, model: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.provider = provider
+        self.model = model
+        self.cache = cache
+
+    @classmethod
+    def from_config(cls, embeddings: Embeddings, provider: str, model: str, cache_dir: str,
+                    max_entries: int = 200_000, dtype: str = "float16",
+                    embedding_kwargs: Optional[Dict[str, Any]] = None) -> "CachedEmbeddings":
+        namespace = cls.namespace(provider, model, embedding_kwargs)
+        key = (os.path.abspath(cache_dir), namespace, max_entries, dtype)
+        with _caches_lock:
+            if key not in _caches:
+                _caches[key] = EmbeddingCache(cache_dir, namespace, max_entries=max_entries, dtype=dtype)
+        return cls(embeddings, provider, model, _caches[key])
+
+    @staticmethod
+    def namespace(provider: str, model: str, embedding_kwargs: Optional[Dict[str, Any]] = None) -> str:
+        """The cache namespace of a model, with the keyword arguments among OUTPUT_KWARGS"""
+        settings = {name: value for name, value in (embedding_kwargs or {}).items() if name in OUTPUT_KWARGS}
+        if not settings:
+            return f"{provider}:{model}"
+        return f"{provider}:{model}:{json.dumps(settings, sort_keys=True, default=str)}"
+
+    def __getattr__(self, name):
+        # Expose provider specific attributes (dimensions, ...) of the wrapped embeddings
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    @staticmethod
+    def _key(text: str, kind: str = "document") -> str:
+        # Some providers embed queries differently from documents, so they never share a key
+        return hashlib.sha256(f"{kind}:{text}".encode("utf-8", errors="ignore")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        found = self.cache.get_many(keys)
+        missing = self._missing(keys, texts, found)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            self._store(missing, vectors, found)
+        return [found[key] for key in keys]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        found = await asyncio.to_thread(self.cache.get_many, keys)
+        missing = self._missing(keys, texts, found)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            await asyncio.to_thread(self._store, missing, vectors, found)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text, "query")
+        found = self.cache.get_many([key])
+        if key not in found:
+            found[key] = self.embeddings.embed_query(text)
+            self.cache.put_many(found)
+        return found[key]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text, "query")
+        found = await asyncio.to_thread(self.cache.get_many, [key])
+        if key not in found:
+            found[key] = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self.cache.put_many, found)
+        return found[key]
+
+    @staticmethod
+    def _missing(keys: List[str], texts: List[str], found: Dict[str, List[float]]) -> Dict[str, str]:
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        return missing
+
+    def _store(self, missing: Dict[str, str], vectors: List[List[float]], found: Dict[str, List[float]]) -> None:
+        new_items = dict(zip(missing, vectors))
+        found.update(new_items)
+        self.cache.put_many(new_items)
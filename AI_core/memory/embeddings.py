@@ -1,5 +1,7 @@
 import os
-from typing import Any
+from typing import Any, Optional
+
+from .executor import EmbeddingExecutor
 
 OPENAI_EMBEDDING_MODEL = os.environ.get("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
 
@@ -9,11 +11,26 @@ _SUPPORTED_PROVIDERS = {
     "ollama",
     "huggingface",
     "custom",
+    "local",
 }
 
+# Providers that embed on this machine and cost nothing per token
+_LOCAL_PROVIDERS = {"ollama", "huggingface", "local"}
+
 
 class Memory:
-    def __init__(self, embedding_provider: str, model: str, **embdding_kwargs: Any):
+    def __init__(
+        self,
+        embedding_provider: str,
+        model: str,
+        cache_dir: Optional[str] = None,
+        cache_max_entries: int = 200_000,
+        cache_dtype: str = "float16",
+        batch_tokens: int = 50_000,
+        concurrency: int = 4,
+        max_retries: int = 3,
+        **embdding_kwargs: Any,
+    ):
         _embeddings = None
         match embedding_provider:
             case "ollama":
@@ -56,10 +73,39 @@ class Memory:
                 # Specifying the Hugging Face embedding model sentence-transformers/all-MiniLM-L6-v2
                 _embeddings = HuggingFaceEmbeddings(model_name=model, **embdding_kwargs)
 
+            case "local":
+                from .local import LocalEmbeddings
+
+                # Quantised sentence-transformers model shared by the whole process
+                _embeddings = LocalEmbeddings(model=model, **embdding_kwargs)
+
             case _:
                 raise Exception("Embedding not found.")
 
+        _embeddings = EmbeddingExecutor(
+            _embeddings,
+            batch_tokens=batch_tokens,
+            concurrency=concurrency,
+            max_retries=max_retries,
+            model=model,
+        )
+
+        if cache_dir:
+            from .cache import CachedEmbeddings
+
+            _embeddings = CachedEmbeddings.from_config(
+                _embeddings,
+                embedding_provider,
+                model,
+                cache_dir,
+                max_entries=cache_max_entries,
+                dtype=cache_dtype,
+                embedding_kwargs=embdding_kwargs,
+            )
+
         self._embeddings = _embeddings
+        self.embedding_provider = embedding_provider
+        self.billable = embedding_provider not in _LOCAL_PROVIDERS
 
     def get_embeddings(self):
         return self._embeddings
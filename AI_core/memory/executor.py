@@ -0,0 +1,128 @@
+"""
+Batched, concurrency-limited async embedding of documents
+"""
+import asyncio
+import random
+from typing import List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from ..llm_provider.resilience import is_retryable
+from ..utils.logger import get_formatted_logger
+from ..utils.tokens import cached_count_tokens
+from ..utils.usage import record_embedding_usage
+
+logger = get_formatted_logger()
+
+
+class EmbeddingExecutor(Embeddings):
+    """
+    Embeddings wrapper that packs texts into token-bounded batches and sends them through
+    the provider's async API, with a bounded number of batches in flight and retries with
+    exponential backoff. One executor is shared by every sub-query of a researcher, so the
+    concurrency limit applies to the whole run.
+
+    Sitting below the embedding cache, it sees only the texts actually sent to the
+    provider, and reports their tokens under model through record_embedding_usage.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        batch_tokens: int = 50_000,
+        batch_size: int = 512,
+        concurrency: int = 4,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+        model: str = "",
+    ):
+        self.embeddings = embeddings
+        self.model = model
+        self.batch_tokens = batch_tokens
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def __getattr__(self, name):
+        if name == "embeddings":
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+    def make_batches(self, texts: List[str]) -> List[List[int]]:
+        """Group text indices into batches of at most batch_tokens tokens and batch_size texts"""
+        return self._make_batches(texts)[0]
+
+    def _make_batches(self, texts: List[str]) -> Tuple[List[List[int]], List[int]]:
+        """The batches of make_batches and the tokens of each"""
+        token_counts = cached_count_tokens(texts)
+        batches, batch, batch_tokens = [], [], 0
+        tokens = []
+        for i, count in enumerate(token_counts):
+            if batch and (batch_tokens + count > self.batch_tokens or len(batch) >= self.batch_size):
+                batches.append(batch)
+                tokens.append(batch_tokens)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += count
+        if batch:
+            batches.append(batch)
+            tokens.append(batch_tokens)
+        return batches, tokens
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = [None] * len(texts)
+        batches, tokens = self._make_batches(texts)
+        for batch, batch_tokens in zip(batches, tokens):
+            for i, vector in zip(batch, self.embeddings.embed_documents([texts[i] for i in batch])):
+                vectors[i] = vector
+            record_embedding_usage(self.model, batch_tokens)
+        return vectors
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches, tokens = await asyncio.to_thread(self._make_batches, texts)
+        results = await asyncio.gather(*[
+            self._embed_batch([texts[i] for i in batch], batch_tokens) for batch, batch_tokens in zip(batches, tokens)
+        ])
+        vectors: List[List[float]] = [None] * len(texts)
+        for batch, batch_vectors in zip(batches, results):
+            for i, vector in zip(batch, batch_vectors):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.embeddings.embed_query(text)
+        record_embedding_usage(self.model, cached_count_tokens([text])[0])
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        async with self._get_semaphore():
+            vector = await self._with_retries(self.embeddings.aembed_query, text)
+        record_embedding_usage(self.model, cached_count_tokens([text])[0])
+        return vector
+
+    async def _embed_batch(self, texts: List[str], tokens: int) -> List[List[float]]:
+        async with self._get_semaphore():
+            vectors = await self._with_retries(self.embeddings.aembed_documents, texts)
+        record_embedding_usage(self.model, tokens)
+        return vectors
+
+    async def _with_retries(self, func, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await func(*args)
+            except Exception as e:
+                # Errors such as invalid requests or authentication would only fail again
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+                logger.warning(f"Embedding request failed ({e}), retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
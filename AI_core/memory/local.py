@@ -0,0 +1,189 @@
+"""
+Local CPU embedding engine for offline research
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from ..llm_provider.generic.base import _check_pkg
+from ..utils.logger import get_formatted_logger
+
+logger = get_formatted_logger()
+
+DEFAULT_LOCAL_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_ONNX_FILE = "onnx/model_qint8_avx512.onnx"
+
+_engines: Dict[Tuple, "LocalEmbeddingEngine"] = {}
+_engines_lock = threading.Lock()
+
+
+class LocalEmbeddingEngine:
+    """
+    Owns one sentence-transformers model per process. Requests from every researcher and
+    sub-query go through a single worker thread that merges them into dynamic batches, so
+    the model runs with a fixed, pinned number of intra-op threads.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        backend: str = "onnx",
+        quantize: bool = True,
+        threads: Optional[int] = None,
+        batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+        onnx_file: str = DEFAULT_ONNX_FILE,
+    ):
+        self.model_name = model
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        # Leave half of the cores to the scraper threads by default
+        self.threads = threads or max(1, (os.cpu_count() or 2) // 2)
+        self.chunks_embedded = 0
+        self.seconds_embedding = 0.0
+        self.model = self._load(model, backend, quantize, onnx_file)
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="local-embeddings", daemon=True)
+        self._worker.start()
+
+    @property
+    def throughput(self) -> float:
+        """Chunks embedded per second of model time since the engine was loaded"""
+        return self.chunks_embedded / self.seconds_embedding if self.seconds_embedding else 0.0
+
+    def submit(self, texts: List[str]) -> Future:
+        future: Future = Future()
+        if not texts:
+            future.set_result([])
+        else:
+            self._queue.put((texts, future))
+        return future
+
+    def _load(self, model: str, backend: str, quantize: bool, onnx_file: str):
+        _check_pkg("sentence_transformers")
+        from sentence_transformers import SentenceTransformer
+
+        if backend == "onnx":
+            try:
+                model_kwargs: Dict[str, Any] = {"provider": "CPUExecutionProvider"}
+                if quantize:
+                    model_kwargs["file_name"] = onnx_file
+                import onnxruntime
+
+                session_options = onnxruntime.SessionOptions()
+                session_options.intra_op_num_threads = self.threads
+                session_options.inter_op_num_threads = 1
+                model_kwargs["session_options"] = session_options
+                return SentenceTransformer(model, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+            except Exception as e:
+                logger.warning(f"Could not load ONNX model for {model} ({e}), falling back to torch")
+
+        import torch
+
+        torch.set_num_threads(self.threads)
+        st_model = SentenceTransformer(model, device="cpu")
+        if quantize:
+            st_model = torch.quantization.quantize_dynamic(st_model, {torch.nn.Linear}, dtype=torch.qint8)
+        return st_model
+
+    def _next_batch(self) -> List[Tuple[List[str], Future]]:
+        requests: List[Tuple[List[str], Future]] = []
+        size = 0
+        deadline = None
+        while size < self.batch_size:
+            if deadline is None:
+                request = self._queue.get()
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            # Requests cancelled while queued (their caller gave up) are dropped; the
+            # others are marked running so they can no longer be cancelled under us
+            if not request[1].set_running_or_notify_cancel():
+                continue
+            requests.append(request)
+            size += len(request[0])
+            if deadline is None:
+                deadline = time.monotonic() + self.max_wait
+        return requests
+
+    def _run(self) -> None:
+        while True:
+            requests = self._next_batch()
+            try:
+                self._embed_batch(requests)
+            except Exception as e:
+                # Never let one batch end the only worker thread
+                logger.error(f"Local embedding batch failed: {e!r}")
+                for _, future in requests:
+                    _resolve(future, exception=e)
+
+    def _embed_batch(self, requests: List[Tuple[List[str], Future]]) -> None:
+        texts = [text for request_texts, _ in requests for text in request_texts]
+        start = time.perf_counter()
+        vectors = self.model.encode(
+            texts, batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True
+        ).tolist()
+        elapsed = time.perf_counter() - start
+
+        self.chunks_embedded += len(texts)
+        self.seconds_embedding += elapsed
+        logger.debug(
+            f"Embedded {len(texts)} chunks locally in {elapsed:.2f}s "
+            f"({len(texts) / elapsed if elapsed else 0:.0f} chunks/sec, {self.throughput:.0f} overall)"
+        )
+        offset = 0
+        for request_texts, future in requests:
+            _resolve(future, result=vectors[offset:offset + len(request_texts)])
+            offset += len(request_texts)
+
+
+def _resolve(future: Future, result: Any = None, exception: Optional[BaseException] = None) -> None:
+    if future.done():
+        return
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+def get_local_engine(model: str, **kwargs: Any) -> LocalEmbeddingEngine:
+    """Return the process-wide engine for a model, loading it on first use"""
+    key = (model, *sorted(kwargs.items()))
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = LocalEmbeddingEngine(model, **kwargs)
+        return _engines[key]
+
+
+class LocalEmbeddings(Embeddings):
+    """Embeddings backed by the shared local engine; never leaves the machine"""
+
+    def __init__(self, model: str = DEFAULT_LOCAL_EMBEDDING_MODEL, **engine_kwargs: Any):
+        self.model = model
+        self.engine = get_local_engine(model, **engine_kwargs)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.engine.submit(texts).result()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.wrap_future(self.engine.submit(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
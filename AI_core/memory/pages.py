@@ -0,0 +1,149 @@
+"""
+Page bodies kept under a memory budget, spilling the rest to a compressed file
+"""
+import hashlib
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class PageStore:
+    """
+    Holds the text of scraped pages. Bodies stay in memory up to memory_budget bytes;
+    beyond that the least recently used ones are compressed (zstd, or zlib when
+    zstandard is not installed) into an append-only spill file and read back through
+    a memory map when needed. Identical bodies are stored once.
+
+    Spilled bodies read back are not admitted to the resident set again, which would
+    evict (and later decompress again) other pages. The last recent_pages of them are
+    kept decompressed instead, so looking up many chunks of a spilled page reads it once.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int = 128 * 1024 * 1024,
+        spill_dir: Optional[str] = None,
+        level: int = 3,
+        recent_pages: int = 8,
+    ):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir or None
+        self.level = level
+        self.recent_pages = recent_pages
+        self._resident: "OrderedDict[int, str]" = OrderedDict()
+        self._resident_bytes = 0
+        self._recent: "OrderedDict[int, str]" = OrderedDict()
+        self._spilled: Dict[int, Tuple[int, int]] = {}
+        self._ids: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._size = 0
+        if zstandard is not None:
+            self._compress = zstandard.ZstdCompressor(level=level).compress
+            self._decompress = zstandard.ZstdDecompressor().decompress
+        else:
+            self._compress = lambda data: zlib.compress(data, level)
+            self._decompress = zlib.decompress
+
+    @classmethod
+    def from_config(cls, cfg) -> "PageStore":
+        return cls(memory_budget=cfg.page_memory_budget_mb * 1024 * 1024, spill_dir=cfg.page_spill_dir)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def resident_bytes(self) -> int:
+        return self._resident_bytes
+
+    @property
+    def spilled_bytes(self) -> int:
+        return self._size
+
+    def add(self, text: str) -> int:
+        """Store a page body and return its id"""
+        key = hashlib.sha1(text.encode("utf-8", errors="surrogatepass")).hexdigest()
+        with self._lock:
+            page_id = self._ids.get(key)
+            if page_id is None:
+                page_id = self._ids[key] = len(self._ids)
+                self._keep(page_id, text)
+            return page_id
+
+    def get(self, page_id: int) -> str:
+        with self._lock:
+            text = self._resident.get(page_id)
+            if text is not None:
+                self._resident.move_to_end(page_id)
+                return text
+            text = self._recent.get(page_id)
+            if text is not None:
+                self._recent.move_to_end(page_id)
+                return text
+            offset, length = self._spilled[page_id]
+            if self._map is None or offset + length > len(self._map):
+                self._remap()
+            text = self._decompress(self._map[offset:offset + length]).decode("utf-8", errors="surrogatepass")
+            if self.recent_pages > 0:
+                self._recent[page_id] = text
+                while len(self._recent) > self.recent_pages:
+                    self._recent.popitem(last=False)
+            return text
+
+    def close(self) -> None:
+        with self._lock:
+            self._resident.clear()
+            self._resident_bytes = 0
+            self._recent.clear()
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            if self._file is not None:
+                self._finalizer()
+                self._file = None
+
+    def _keep(self, page_id: int, text: str) -> None:
+        self._resident[page_id] = text
+        self._resident_bytes += sys.getsizeof(text)
+        while self._resident_bytes > self.memory_budget and len(self._resident) > 1:
+            evicted_id, evicted = self._resident.popitem(last=False)
+            self._resident_bytes -= sys.getsizeof(evicted)
+            if evicted_id not in self._spilled:
+                self._spill(evicted_id, evicted)
+
+    def _spill(self, page_id: int, text: str) -> None:
+        if self._file is None:
+            fd, path = tempfile.mkstemp(prefix="pages-", suffix=".spill", dir=self.spill_dir)
+            self._file = os.fdopen(fd, "w+b")
+            self._finalizer = weakref.finalize(self, _remove_spill_file, self._file, path)
+        data = self._compress(text.encode("utf-8", errors="surrogatepass"))
+        self._file.seek(self._size)
+        self._file.write(data)
+        self._spilled[page_id] = (self._size, len(data))
+        self._size += len(data)
+
+    def _remap(self) -> None:
+        self._file.flush()
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+
+
+def _remove_spill_file(file, path: str) -> None:
+    file.close()
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -71,7 +71,7 @@ def generate_report_prompt(
     """
 
     reference_prompt = ""
-    if report_source == ReportSource.Web.value:
+    if report_source in (ReportSource.Web.value, ReportSource.Warc.value):
         reference_prompt = f"""
 You MUST include all used source URLs at the end of the report as references, ensuring no duplicates, with only one reference per unique source.
 Every URL should be hyperlinked: [url website](url)
@@ -134,7 +134,7 @@ def generate_resource_report_prompt(
     """
 
     reference_prompt = ""
-    if report_source == ReportSource.Web.value:
+    if report_source in (ReportSource.Web.value, ReportSource.Warc.value):
         reference_prompt = """
             You MUST include all relevant source URLs at the end of the report as references. 
             Each URL should be hyperlinked: [url website](url)
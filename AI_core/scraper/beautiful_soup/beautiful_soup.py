@@ -22,30 +22,37 @@ class BeautifulSoupScraper:
         """
         try:
             response = self.session.get(self.link, timeout=4)
-            soup = BeautifulSoup(
-                response.content, "lxml", from_encoding=response.encoding
-            )
+            return self.extract(response.content, self.link, response.encoding)
 
-            for script_or_style in soup(["script", "style"]):
-                script_or_style.extract()
+        except Exception as e:
+            print("Error! : " + str(e))
+            return "", [], ""
+
+    @classmethod
+    def extract(cls, html, url, encoding=None):
+        """
+        Extract the cleaned text, relevant images and title of an HTML document fetched
+        from url, as returned by scrape. Also used for pages read from web archives.
+        """
+        soup = BeautifulSoup(html, "lxml", from_encoding=encoding)
 
-            raw_content = self.get_content_from_url(soup)
-            lines = (line.strip() for line in raw_content.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            content = "\n".join(chunk for chunk in chunks if chunk)
+        for script_or_style in soup(["script", "style"]):
+            script_or_style.extract()
 
-            image_urls = get_relevant_images(soup, self.link)
-            
-            # Extract the title using the utility function
-            title = extract_title(soup)
+        raw_content = cls.get_content_from_url(soup)
+        lines = (line.strip() for line in raw_content.splitlines())
+        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+        content = "\n".join(chunk for chunk in chunks if chunk)
 
-            return content, image_urls, title
+        image_urls = get_relevant_images(soup, url)
 
-        except Exception as e:
-            print("Error! : " + str(e))
-            return "", [], ""
+        # Extract the title using the utility function
+        title = extract_title(soup)
+
+        return content, image_urls, title
 
-    def get_content_from_url(self, soup: BeautifulSoup) -> str:
+    @staticmethod
+    def get_content_from_url(soup: BeautifulSoup) -> str:
         """Get the relevant text from the soup with improved filtering"""
         text_elements = []
         tags = ["h1", "h2", "h3", "h4", "h5", "p", "li", "div", "span"]
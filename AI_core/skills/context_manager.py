@@ -1,8 +1,13 @@
-import asyncio
-from typing import List, Dict, Optional, Set
+from typing import List, Dict, Optional, Set, Union
 
 from ..context.compression import ContextCompressor, WrittenContentCompressor, VectorstoreCompressor
+from ..context.index import ChunkIndex, hash_text
+from ..context.splitter import ChunkSplitter
+from ..context.threshold import SimilarityThreshold
+from ..context.sections import WrittenSectionIndex
 from ..actions.utils import stream_output
+from ..utils.tokens import get_context_window
+from ..utils.usage import TokenCount
 
 
 class ContextManager:
@@ -10,8 +15,21 @@ class ContextManager:
 
     def __init__(self, researcher):
         self.researcher = researcher
+        # Shared by every sub-query of the run so each unique chunk is embedded once
+        self.splitter = ChunkSplitter.from_config(self.researcher.cfg)
+        self.chunk_index = ChunkIndex.from_config(
+            self.researcher.memory.get_embeddings(),
+            self.researcher.cfg,
+            splitter=self.splitter,
+            pages=self.researcher.page_store,
+        )
+        self.similarity_threshold = SimilarityThreshold.from_config(self.researcher.cfg)
 
     async def get_similar_content_by_query(self, query, pages):
+        return self.render_context(await self.get_similar_chunk_ids_by_query(query, pages))
+
+    async def get_similar_chunk_ids_by_query(self, query, pages) -> List[int]:
+        """Ids of the chunks of the pages relevant to the query; render them with render_context"""
         if self.researcher.verbose:
             await stream_output(
                 "logs",
@@ -20,56 +38,131 @@ class ContextManager:
                 self.researcher.websocket,
             )
 
+        cfg = self.researcher.cfg
         context_compressor = ContextCompressor(
-            documents=pages, embeddings=self.researcher.memory.get_embeddings()
+            documents=pages,
+            embeddings=self.researcher.memory.get_embeddings(),
+            index=self.chunk_index,
+            token_budget=self.query_token_budget(),
+            max_per_source=cfg.context_max_chunks_per_source,
+            mmr_lambda=cfg.mmr_lambda,
+            similarity_threshold=self.similarity_threshold,
         )
-        return await context_compressor.async_get_context(
-            query=query, max_results=10, cost_callback=self.researcher.add_costs
+        return await context_compressor.async_get_chunk_ids(
+            query=query, max_results=None, cost_callback=self.__embedding_cost_callback()
+        )
+
+    async def get_similar_content_by_query_with_vectorstore(self, query, filter: Optional[dict] = None) -> str:
+        if self.researcher.verbose:
+            await stream_output(
+                "logs",
+                "fetching_query_content",
+                f"📚 Getting relevant content from the vector store based on query: {query}...",
+                self.researcher.websocket,
+            )
+        vectorstore_compressor = VectorstoreCompressor(self.researcher.vector_store, filter=filter)
+        return await vectorstore_compressor.async_get_context(query=query, max_results=8)
+
+    async def get_similar_content_by_queries_with_vectorstore(
+        self, queries: List[str], filter: Optional[dict] = None
+    ) -> List[str]:
+        """Context of each query from the vector store, embedding all the queries in one call"""
+        if self.researcher.verbose:
+            await stream_output(
+                "logs",
+                "fetching_query_content",
+                f"📚 Getting relevant content from the vector store based on queries: {', '.join(queries)}...",
+                self.researcher.websocket,
+            )
+        vectorstore_compressor = VectorstoreCompressor(self.researcher.vector_store, filter=filter)
+        return await vectorstore_compressor.async_get_contexts(queries=queries, max_results=8)
+
+    def render_context(self, chunk_ids: List[int]) -> str:
+        """Text of the chunks for a prompt, with overlapping chunks of a page merged"""
+        return self.chunk_index.documents.render(chunk_ids)
+
+    def dedupe_chunk_ids(self, contexts: List[List[int]]) -> List[List[int]]:
+        """
+        Drop chunks already used by an earlier sub-query, including chunks with the
+        same text from another page
+        """
+        seen_ids, seen_texts = set(), set()
+        deduped = []
+        for chunk_ids in contexts:
+            kept = []
+            for chunk_id in chunk_ids:
+                text_hash = hash_text(self.chunk_index.documents.text(chunk_id))
+                if chunk_id in seen_ids or text_hash in seen_texts:
+                    continue
+                seen_ids.add(chunk_id)
+                seen_texts.add(text_hash)
+                kept.append(chunk_id)
+            deduped.append(kept)
+        return deduped
+
+    def query_token_budget(self) -> int:
+        """
+        Tokens of context to gather per sub-query, so that the contexts of every
+        sub-query plus the original query fit in a share of the report model's window
+        """
+        cfg = self.researcher.cfg
+        window_budget = get_context_window(cfg.smart_llm_model) * cfg.context_window_share
+        return int(min(cfg.context_tokens_per_query, window_budget / ((cfg.max_iterations or 1) + 1)))
+
+    def create_written_section_index(self) -> WrittenSectionIndex:
+        """Index for the sections of a report, to be filled as they are written"""
+        return WrittenSectionIndex(
+            self.researcher.memory.get_embeddings(),
+            splitter=self.splitter,
+            cost_callback=self.__embedding_cost_callback(),
         )
 
     async def get_similar_written_contents_by_draft_section_titles(
         self,
         current_subtopic: str,
         draft_section_titles: List[str],
-        written_contents: List[Dict],
-        max_results: int = 10
+        written_contents: Union[List[Dict], WrittenSectionIndex],
+        max_results: int = 10,
+        similarity_threshold: float = 0.5,
     ) -> List[str]:
         all_queries = [current_subtopic] + draft_section_titles
 
-        async def process_query(query: str) -> Set[str]:
-            return set(await self.__get_similar_written_contents_by_query(query, written_contents))
-
-        results = await asyncio.gather(*[process_query(query) for query in all_queries])
-        relevant_contents = set().union(*results)
-        relevant_contents = list(relevant_contents)[:max_results]
-
-        if relevant_contents and self.researcher.verbose:
-            prettier_contents = "\n".join(relevant_contents)
-            await stream_output(
-                "logs", "relevant_contents_context", f"📃 {prettier_contents}", self.researcher.websocket
-            )
-
-        return relevant_contents
-
-    async def __get_similar_written_contents_by_query(self,
-                                                      query: str,
-                                                      written_contents: List[Dict],
-                                                      similarity_threshold: float = 0.5,
-                                                      max_results: int = 10
-                                                      ) -> List[str]:
         if self.researcher.verbose:
             await stream_output(
                 "logs",
                 "fetching_relevant_written_content",
-                f"🔎 Getting relevant written content based on query: {query}...",
+                f"🔎 Getting relevant written content based on queries: {', '.join(all_queries)}...",
                 self.researcher.websocket,
             )
 
+        index = written_contents if isinstance(written_contents, WrittenSectionIndex) else None
         written_content_compressor = WrittenContentCompressor(
-            documents=written_contents,
+            documents=written_contents if index is None else [],
             embeddings=self.researcher.memory.get_embeddings(),
-            similarity_threshold=similarity_threshold
+            similarity_threshold=similarity_threshold,
+            splitter=self.splitter,
+            index=index,
         )
-        return await written_content_compressor.async_get_context(
-            query=query, max_results=max_results, cost_callback=self.researcher.add_costs
+        relevant_contents = await written_content_compressor.async_get_context(
+            query=all_queries, max_results=max_results, cost_callback=self.__embedding_cost_callback()
         )
+
+        if relevant_contents and self.researcher.verbose:
+            prettier_contents = "\n".join(relevant_contents)
+            await stream_output(
+                "logs", "relevant_contents_context", f"📃 {prettier_contents}", self.researcher.websocket
+            )
+
+        return relevant_contents
+
+    def __embedding_cost_callback(self):
+        # Local embedding providers are free, so there is nothing to account for
+        if not self.researcher.memory.billable:
+            return None
+
+        def add_costs(cost: float, usage: Optional[TokenCount] = None) -> None:
+            if usage is not None:
+                usage.stage = "compression"
+            self.researcher.add_costs(cost, usage)
+
+        return add_costs
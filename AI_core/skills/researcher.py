@@ -1,12 +1,14 @@
 import asyncio
+import os
 import random
 import json
 from typing import Dict, Optional
 
 from ..actions.utils import stream_output
 from ..actions.query_processing import plan_research_outline, get_search_results
-from ..document import DocumentLoader, LangChainDocumentLoader
+from ..document import LangChainDocumentLoader, LocalDocumentIndex
 from ..utils.enum import ReportSource, ReportType, Tone
+from ..utils.usage import usage_stage
 
 
 class ResearchConductor:
@@ -42,19 +44,28 @@ class ResearchConductor:
             self.researcher.context = await self.__get_context_by_urls(self.researcher.source_urls)
 
         elif self.researcher.report_source == ReportSource.Local.value:
-            document_data = await DocumentLoader(self.researcher.cfg.doc_path).load()
-            if self.researcher.vector_store:
-                self.researcher.vector_store.load(document_data)
+            local_index = await self.__open_local_index()
+            self.researcher.context = await self.__get_context_by_search(
+                self.researcher.query, local_index=local_index
+            )
 
-            self.researcher.context = await self.__get_context_by_search(self.researcher.query, document_data)
+        # Offline research over archived crawls (WARC files in WARC_PATH)
+        elif self.researcher.report_source == ReportSource.Warc.value:
+            warc_index = await self.__open_warc_index()
+            self.researcher.context = await self.__get_context_by_search(
+                self.researcher.query, local_index=warc_index
+            )
 
         # Hybrid search including both local documents and web sources
         elif self.researcher.report_source == ReportSource.Hybrid.value:
-            document_data = await DocumentLoader(self.researcher.cfg.doc_path).load()
-            if self.researcher.vector_store:
-                self.researcher.vector_store.load(document_data)
-            docs_context = await self.__get_context_by_search(self.researcher.query, document_data)
-            web_context = await self.__get_context_by_search(self.researcher.query)
+            local_index, sub_queries = await asyncio.gather(
+                self.__open_local_index(), self.__plan_sub_queries(self.researcher.query)
+            )
+            # Both branches work on the same sub-queries at the same time
+            docs_context, web_context = await asyncio.gather(
+                self.__get_context_by_sub_queries(sub_queries, local_index=local_index),
+                self.__get_context_by_sub_queries(sub_queries),
+            )
             self.researcher.context = f"Context from local documents: {docs_context}\n\nContext from web sources: {web_context}"
 
         elif self.researcher.report_source == ReportSource.LangChainDocuments.value:
@@ -62,7 +73,7 @@ class ResearchConductor:
                 self.researcher.documents
             ).load()
             if self.researcher.vector_store:
-                self.researcher.vector_store.load(langchain_documents_data)
+                await self.researcher.vector_store.aload(langchain_documents_data)
             self.researcher.context = await self.__get_context_by_search(
                 self.researcher.query, langchain_documents_data
             )
@@ -99,7 +110,7 @@ class ResearchConductor:
         scraped_content = await self.researcher.scraper_manager.browse_urls(new_search_urls)
 
         if self.researcher.vector_store:
-            self.researcher.vector_store.load(scraped_content)
+            await self.researcher.vector_store.aload(scraped_content)
 
         return await self.researcher.context_manager.get_similar_content_by_query(self.researcher.query, scraped_content)
 
@@ -126,22 +137,45 @@ class ResearchConductor:
                 sub_queries,
             )
 
-        # Using asyncio.gather to process the sub_queries asynchronously
-        context = await asyncio.gather(
-            *[
-                self.__process_sub_query_with_vectorstore(sub_query, filter)
-                for sub_query in sub_queries
-            ]
+        # One batched embedding call and search for all the sub_queries
+        contents = await self.researcher.context_manager.get_similar_content_by_queries_with_vectorstore(
+            sub_queries, filter
         )
-        return context
+        for sub_query, content in zip(sub_queries, contents):
+            await self.__log_sub_query_context(sub_query, content)
+        return contents
 
-    async def __get_context_by_search(self, query, scraped_data: list = []):
+    async def __open_local_index(self):
+        """The index of the documents in DOC_PATH, brought up to date"""
+        local_index = LocalDocumentIndex.from_config(self.researcher.cfg)
+        if self.researcher.vector_store:
+            await self.researcher.vector_store.aload(await local_index.load())
+        else:
+            await local_index.refresh()
+        return local_index
+
+    async def __open_warc_index(self):
+        """The index of the web archives in WARC_PATH, brought up to date"""
+        warc_path = self.researcher.cfg.warc_path
+        # An empty WARC_PATH would otherwise fall back to DOC_PATH
+        if not warc_path or not os.path.isdir(warc_path):
+            raise ValueError(f"🤷 WARC_PATH is not a folder of web archives: {warc_path!r}")
+        warc_index = LocalDocumentIndex.from_config(self.researcher.cfg, doc_path=warc_path)
+        await warc_index.refresh()
+        return warc_index
+
+    async def __get_context_by_search(self, query, scraped_data: list = [], local_index=None):
         """
-        Generates the context for the research task by searching the query and scraping the results
+        Generates the context for the research task by searching the query and scraping the results.
+        With a local_index, each sub-query is compressed from its candidate chunks in the index instead.
         Returns:
             context: List of context
         """
-        context = []
+        sub_queries = await self.__plan_sub_queries(query)
+        return await self.__get_context_by_sub_queries(sub_queries, scraped_data, local_index)
+
+    async def __plan_sub_queries(self, query):
+        """Sub-queries to research for the query, logged when verbose"""
         # Generate Sub-Queries including original query
         sub_queries = await self.plan_research(query)
         # If this is not part of a sub researcher, add original query to research for better results
@@ -157,57 +191,70 @@ class ResearchConductor:
                 True,
                 sub_queries,
             )
+        return sub_queries
 
-        # Using asyncio.gather to process the sub_queries asynchronously
-        context = await asyncio.gather(
-            *[
-                self.__process_sub_query(sub_query, scraped_data)
-                for sub_query in sub_queries
-            ]
-        )
-        return context
-
-    async def __process_sub_query_with_vectorstore(self, sub_query: str, filter: Optional[dict] = None):
-        """Takes in a sub query and gathers context from the user provided vector store
-
-        Args:
-            sub_query (str): The sub-query generated from the original query
-
-        Returns:
-            str: The context gathered from search
-        """
-        if self.researcher.verbose:
-            await stream_output(
-                "logs",
-                "running_subquery_with_vectorstore_research",
-                f"\n🔍 Running research for '{sub_query}'...",
-                self.researcher.websocket,
+    async def __get_context_by_sub_queries(self, sub_queries, scraped_data: list = [], local_index=None):
+        """Context gathered for each sub-query, from the scraped data, the local index or the web"""
+        if local_index is not None:
+            cfg = self.researcher.cfg
+            candidates = await local_index.search(
+                sub_queries,
+                k=cfg.local_index_candidates,
+                embeddings=self.researcher.memory.get_embeddings(),
+                embedding_name=f"{cfg.embedding_provider}:{cfg.embedding_model}",
             )
-
-        content = await self.researcher.context_manager.get_similar_content_by_query_with_vectorstore(sub_query, filter)
-
-        if content and self.researcher.verbose:
+            # Using asyncio.gather to process the sub_queries asynchronously
+            chunk_ids = await asyncio.gather(
+                *[
+                    self.__process_sub_query(sub_query, sub_query_candidates, search_web=False)
+                    for sub_query, sub_query_candidates in zip(sub_queries, candidates)
+                ]
+            )
+        else:
+            # Using asyncio.gather to process the sub_queries asynchronously
+            chunk_ids = await asyncio.gather(
+                *[
+                    self.__process_sub_query(sub_query, scraped_data)
+                    for sub_query in sub_queries
+                ]
+            )
+        # Sub-queries often select the same chunks; render each chunk only once
+        context_manager = self.researcher.context_manager
+        context = [context_manager.render_context(ids) for ids in context_manager.dedupe_chunk_ids(chunk_ids)]
+        return [content for content in context if content]
+
+    async def __log_sub_query_context(self, sub_query: str, content: str):
+        """Stream the context gathered for a sub query from the user provided vector store"""
+        if not self.researcher.verbose:
+            return
+        await stream_output(
+            "logs",
+            "running_subquery_with_vectorstore_research",
+            f"\n🔍 Running research for '{sub_query}'...",
+            self.researcher.websocket,
+        )
+        if content:
             await stream_output(
                 "logs", "subquery_context_window", f"📃 {content}", self.researcher.websocket
             )
-        elif self.researcher.verbose:
+        else:
             await stream_output(
                 "logs",
                 "subquery_context_not_found",
                 f"🤷 No content found for '{sub_query}'...",
                 self.researcher.websocket,
             )
-        return content
 
-    async def __process_sub_query(self, sub_query: str, scraped_data: list = []):
+    async def __process_sub_query(self, sub_query: str, scraped_data: list = [], search_web: bool = True):
         """Takes in a sub query and scrapes urls based on it and gathers context.
 
         Args:
             sub_query (str): The sub-query generated from the original query
             scraped_data (list): Scraped data passed in
+            search_web (bool): Whether to search and scrape the web when no data is passed in
 
         Returns:
-            str: The context gathered from search
+            list[int]: The ids of the chunks gathered from search
         """
         if self.researcher.verbose:
             await stream_output(
@@ -217,14 +264,19 @@ class ResearchConductor:
                 self.researcher.websocket,
             )
 
-        if not scraped_data:
+        if not scraped_data and search_web:
             scraped_data = await self.__scrape_data_by_query(sub_query)
 
-        content = await self.researcher.context_manager.get_similar_content_by_query(sub_query, scraped_data)
+        content = []
+        if scraped_data:
+            content = await self.researcher.context_manager.get_similar_chunk_ids_by_query(sub_query, scraped_data)
 
         if content and self.researcher.verbose:
             await stream_output(
-                "logs", "subquery_context_window", f"📃 {content}", self.researcher.websocket
+                "logs",
+                "subquery_context_window",
+                f"📃 {self.researcher.context_manager.render_context(content)}",
+                self.researcher.websocket,
             )
         elif self.researcher.verbose:
             await stream_output(
@@ -301,7 +353,7 @@ class ResearchConductor:
         scraped_content = await self.researcher.scraper_manager.browse_urls(new_search_urls)
 
         if self.researcher.vector_store:
-            self.researcher.vector_store.load(scraped_content)
+            await self.researcher.vector_store.aload(scraped_content)
 
         return scraped_content
 
@@ -322,12 +374,13 @@ class ResearchConductor:
             self.researcher.websocket,
         )
 
-        return await plan_research_outline(
-            query=query,
-            search_results=search_results,
-            agent_role_prompt=self.researcher.role,
-            cfg=self.researcher.cfg,
-            parent_query=self.researcher.parent_query,
-            report_type=self.researcher.report_type,
-            cost_callback=self.researcher.add_costs,
-        )
+        with usage_stage("planning"):
+            return await plan_research_outline(
+                query=query,
+                search_results=search_results,
+                agent_role_prompt=self.researcher.role,
+                cfg=self.researcher.cfg,
+                parent_query=self.researcher.parent_query,
+                report_type=self.researcher.report_type,
+                cost_callback=self.researcher.add_costs,
+            )
@@ -1,4 +1,4 @@
-import tiktoken
+from .tokens import cached_count_tokens, encoding_name_for_model
 
 # Per OpenAI Pricing Page: https://openai.com/api/pricing/
 ENCODING_MODEL = "o200k_base"
@@ -8,18 +8,16 @@ IMAGE_INFERENCE_COST = 0.003825
 EMBEDDING_COST = 0.02 / 1000000 # Assumes new ada-3-small
 
 
-# Cost estimation is via OpenAI libraries and models. May vary for other models
+# Cost estimation is via OpenAI libraries and models. May vary for other models,
+# see utils.usage for the counts reported by providers
 def estimate_llm_cost(input_content: str, output_content: str) -> float:
-    encoding = tiktoken.get_encoding(ENCODING_MODEL)
-    input_tokens = encoding.encode(input_content)
-    output_tokens = encoding.encode(output_content)
-    input_costs = len(input_tokens) * INPUT_COST_PER_TOKEN
-    output_costs = len(output_tokens) * OUTPUT_COST_PER_TOKEN
+    input_tokens, output_tokens = cached_count_tokens([input_content, output_content], ENCODING_MODEL)
+    input_costs = input_tokens * INPUT_COST_PER_TOKEN
+    output_costs = output_tokens * OUTPUT_COST_PER_TOKEN
     return input_costs + output_costs
 
 
 def estimate_embedding_cost(model, docs):
-    encoding = tiktoken.encoding_for_model(model)
-    total_tokens = sum(len(encoding.encode(str(doc))) for doc in docs)
+    total_tokens = sum(cached_count_tokens([str(doc) for doc in docs], encoding_name_for_model(model)))
     return total_tokens * EMBEDDING_COST
 
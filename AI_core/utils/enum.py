@@ -20,6 +20,7 @@ class ReportSource(Enum):
     LangChainVectorStore = "langchain_vectorstore"
     Static = "static"
     Hybrid = "hybrid"
+    Warc = "warc"
 
 
 class Tone(Enum):
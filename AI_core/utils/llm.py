@@ -1,22 +1,44 @@
 # libraries
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
+import threading
+import weakref
 from typing import Optional, Any, Dict
 
 from colorama import Fore, Style
 from langchain.output_parsers import PydanticOutputParser
 from langchain.prompts import PromptTemplate
 
+from ..llm_provider.governor import Priority
 from ..prompts import generate_subtopics_prompt
-from .costs import estimate_llm_cost
+from .usage import capture_call_usage, llm_usage, report_cost
 from .validators import Subtopics
 
 
+# Providers by (provider, settings), shared by every call so that their HTTP clients and
+# connection pools are reused. Async clients are bound to the event loop that first used
+# them, so each loop has its own providers.
+_providers: Dict[str, Any] = {}
+_loop_providers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = weakref.WeakKeyDictionary()
+_providers_lock = threading.Lock()
+
+
 def get_llm(llm_provider, **kwargs):
     from AI_core.llm_provider import GenericLLMProvider
-    return GenericLLMProvider.from_provider(llm_provider, **kwargs)
+
+    key = json.dumps([llm_provider, kwargs], sort_keys=True, default=str)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    with _providers_lock:
+        providers = _providers if loop is None else _loop_providers.setdefault(loop, {})
+        if key not in providers:
+            providers[key] = GenericLLMProvider.from_provider(llm_provider, **kwargs)
+        return providers[key]
 
 
 async def create_chat_completion(
@@ -28,7 +50,10 @@ async def create_chat_completion(
         stream: Optional[bool] = False,
         websocket: Any | None = None,
         llm_kwargs: Dict[str, Any] | None = None,
-        cost_callback: callable = None
+        cost_callback: callable = None,
+        use_cache: bool = True,
+        priority: int = Priority.NORMAL,
+        cfg=None,
 ) -> str:
     """Create a chat completion using the OpenAI API
     Args:
@@ -39,7 +64,11 @@ async def create_chat_completion(
         stream (bool, optional): Whether to stream the response. Defaults to False.
         llm_provider (str, optional): The LLM Provider to use.
         webocket (WebSocket): The websocket used in the currect request,
-        cost_callback: Callback function for updating cost
+        cost_callback: Callback function for updating cost; also given the call's TokenCount if it takes a usage argument
+        use_cache (bool, optional): Whether to answer from (and store in) the response cache, which by default
+            only keeps calls at temperature 0 (LLM_CACHE_MAX_TEMPERATURE). Defaults to True.
+        priority (int, optional): Queueing priority under rate limits, lower first. Defaults to Priority.NORMAL.
+        cfg (Config, optional): Config of the response cache, rate limits and call policy. Defaults to the environment's.
     Returns:
         str: The response from the chat completion
     """
@@ -50,25 +79,59 @@ async def create_chat_completion(
         raise ValueError(
             f"Max tokens cannot be more than 16,000, but got {max_tokens}")
 
-    # Get the provider from supported providers
-    provider = get_llm(llm_provider, model=model, temperature=temperature,
-                       max_tokens=max_tokens, **(llm_kwargs or {}))
+    from AI_core.llm_provider import GenericLLMProvider, ResponseCache, get_rate_governor, get_response_cache
+    from AI_core.llm_provider.resilience import call_with_policy, get_call_policy
 
-    response = ""
-    # create response
-    for _ in range(10):  # maximum of 10 attempts
-        response = await provider.get_chat_response(
-            messages, stream, websocket
+    # Identical requests are answered from the response cache, replayed when streaming
+    cache = get_response_cache(cfg) if use_cache else None
+    if cache is not None and not cache.accepts(temperature):
+        cache = None
+    if cache is not None:
+        cache_key = ResponseCache.key(
+            llm_provider, model, temperature, messages, max_tokens=max_tokens, **(llm_kwargs or {})
         )
+        response = await asyncio.to_thread(cache.get, cache_key)
+        if response is not None:
+            if stream:
+                await GenericLLMProvider.replay_response(response, websocket)
+            return response
+
+    governor = get_rate_governor(cfg)
+
+    async def admit(call_provider: str, call_model: str) -> None:
+        # Wait for room in the requests and tokens per minute budgets of the model
+        if governor.limited(call_provider, call_model):
+            await governor.acquire(
+                call_provider, call_model, governor.estimate_tokens(messages, call_model), priority
+            )
+
+    async def call(call_provider: str, call_model: str) -> str:
+        # Get the provider from supported providers
+        provider = get_llm(call_provider, model=call_model, temperature=temperature,
+                           max_tokens=max_tokens, **(llm_kwargs or {}))
+        with capture_call_usage() as reported:
+            response = await provider.get_chat_response(messages, stream, websocket)
+        usage = llm_usage(call_model, messages, response, reported)
+        if governor.limited(call_provider, call_model):
+            governor.record(call_provider, call_model, usage.output_tokens)
+        return response, usage
+
+    # Retried with backoff, bounded by deadlines and hedged when slow; streams are never
+    # retried once output reached the client. Time queued under rate limits is not timed.
+    try:
+        response, usage = await call_with_policy(
+            call, (llm_provider, model), get_call_policy(cfg), stream=stream, admit=admit
+        )
+    except Exception as e:
+        logging.error(f"Failed to get response from {llm_provider} API: {e!r}")
+        raise RuntimeError(f"Failed to get response from {llm_provider} API") from e
 
-        if cost_callback:
-            llm_costs = estimate_llm_cost(str(messages), response)
-            cost_callback(llm_costs)
+    report_cost(cost_callback, usage)
 
-        return response
+    if cache is not None and response:
+        await asyncio.to_thread(cache.put, cache_key, response)
 
-    logging.error(f"Failed to get response from {llm_provider} API")
-    raise RuntimeError(f"Failed to get response from {llm_provider} API")
+    return response
 
 
 async def construct_subtopics(task: str, data: str, config, subtopics: list = []) -> list:
@@ -0,0 +1,105 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List
+
+import tiktoken
+
+from .logger import get_formatted_logger
+
+logger = get_formatted_logger()
+
+DEFAULT_ENCODING = "cl100k_base"
+CHARS_PER_TOKEN = 4
+# Token counts remembered by cached_count_tokens, least recently used dropped first
+COUNT_CACHE_SIZE = 100_000
+
+_counts: "OrderedDict[tuple, int]" = OrderedDict()
+_counts_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str = DEFAULT_ENCODING):
+    """
+    Return a cached tiktoken encoding, or None when it cannot be loaded
+    (tiktoken downloads encodings on first use, which fails on offline nodes).
+    """
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(f"Could not load the {name} encoding ({e}), estimating tokens from characters")
+        return None
+
+
+def count_tokens(texts: List[str], encoding_name: str = DEFAULT_ENCODING) -> List[int]:
+    """Count the tokens of each text"""
+    encoding = get_encoding(encoding_name)
+    if encoding is None:
+        return [-(-len(text) // CHARS_PER_TOKEN) for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+
+def cached_count_tokens(texts: List[str], encoding_name: str = DEFAULT_ENCODING) -> List[int]:
+    """
+    Count the tokens of each text, remembering counts by a hash of the text. Use for
+    texts counted again and again, such as chunks, prompts and messages.
+    """
+    keys = [(encoding_name, hashlib.blake2b(text.encode("utf-8", errors="ignore"), digest_size=16).digest())
+            for text in texts]
+    counts: List[int] = [0] * len(texts)
+    missing = []
+    with _counts_lock:
+        for i, key in enumerate(keys):
+            if key in _counts:
+                _counts.move_to_end(key)
+                counts[i] = _counts[key]
+            else:
+                missing.append(i)
+    if not missing:
+        return counts
+
+    new_counts = count_tokens([texts[i] for i in missing], encoding_name)
+    with _counts_lock:
+        for i, count in zip(missing, new_counts):
+            counts[i] = _counts[keys[i]] = count
+        while len(_counts) > COUNT_CACHE_SIZE:
+            _counts.popitem(last=False)
+    return counts
+
+
+@lru_cache(maxsize=None)
+def encoding_name_for_model(model: str) -> str:
+    """The encoding of an OpenAI model, or the default encoding as an estimate for other models"""
+    try:
+        return tiktoken.encoding_name_for_model((model or "").split("/")[-1])
+    except KeyError:
+        return DEFAULT_ENCODING
+
+
+# Context windows of common chat models, matched by prefix (longest prefix wins)
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128_000,
+    "gpt-4-turbo": 128_000,
+    "gpt-4-32k": 32_768,
+    "gpt-4": 8_192,
+    "gpt-3.5-turbo": 16_385,
+    "o1": 128_000,
+    "claude": 200_000,
+    "gemini-1.5": 1_000_000,
+    "gemini": 32_768,
+    "command-r": 128_000,
+    "mistral-large": 128_000,
+    "llama3": 8_192,
+    "llama-3.1": 128_000,
+}
+DEFAULT_CONTEXT_WINDOW = 16_000
+
+
+def get_context_window(model: str) -> int:
+    """Return the context window of a model, in tokens"""
+    model = (model or "").lower().split("/")[-1]
+    matches = [prefix for prefix in MODEL_CONTEXT_WINDOWS if model.startswith(prefix)]
+    if not matches:
+        return DEFAULT_CONTEXT_WINDOW
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)]
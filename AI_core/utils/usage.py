@@ -0,0 +1,171 @@
+"""
+Token accounting: counts reported by providers, or from cached encoders, totalled per stage and model
+"""
+import inspect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, Mapping, Optional
+
+from .costs import EMBEDDING_COST, INPUT_COST_PER_TOKEN, OUTPUT_COST_PER_TOKEN
+from .tokens import cached_count_tokens, encoding_name_for_model
+
+DEFAULT_STAGE = "other"
+
+# Research stage the tokens used by the current task are attributed to
+_stage: ContextVar[str] = ContextVar("usage_stage", default=DEFAULT_STAGE)
+# Usage metadata reported by the provider for the LLM call of the current task
+_call_usage: ContextVar[Optional[Dict[str, int]]] = ContextVar("call_usage", default=None)
+# Who pays for the embedding requests of the current task
+_embedding_cost_callback: ContextVar[Optional[Callable]] = ContextVar("embedding_cost_callback", default=None)
+
+
+@contextmanager
+def usage_stage(stage: str) -> Iterator[None]:
+    """Attribute the tokens used inside the block, and in tasks started from it, to stage"""
+    token = _stage.set(stage)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+
+
+def current_stage() -> str:
+    return _stage.get()
+
+
+@dataclass
+class TokenCount:
+    """Tokens and cost of one LLM or embedding call"""
+    model: str
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost: float = 0.0
+    stage: str = field(default_factory=current_stage)
+    # "provider" when the counts come from the provider's usage metadata, "estimate" otherwise
+    source: str = "estimate"
+
+
+class TokenUsage:
+    """Running token and cost totals of a research task, by stage and by model"""
+
+    def __init__(self):
+        self.by_stage: Dict[str, Dict[str, float]] = {}
+        self.by_model: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, count: TokenCount) -> None:
+        with self._lock:
+            for totals, name in ((self.by_stage, count.stage), (self.by_model, count.model)):
+                entry = totals.setdefault(
+                    name, {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+                )
+                entry["calls"] += 1
+                entry["input_tokens"] += count.input_tokens
+                entry["output_tokens"] += count.output_tokens
+                entry["cost"] += count.cost
+
+    def totals(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        with self._lock:
+            return {
+                "by_stage": {name: dict(entry) for name, entry in self.by_stage.items()},
+                "by_model": {name: dict(entry) for name, entry in self.by_model.items()},
+            }
+
+
+@contextmanager
+def capture_call_usage() -> Iterator[Dict[str, int]]:
+    """
+    Collect the usage metadata providers report through record_call_usage while the block
+    runs. The returned dict stays empty when the provider reports none.
+    """
+    usage: Dict[str, int] = {}
+    token = _call_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _call_usage.reset(token)
+
+
+def record_call_usage(metadata: Optional[Mapping[str, Any]]) -> None:
+    """Called by providers with the usage metadata of a response (or of each streamed chunk)"""
+    usage = _call_usage.get()
+    if usage is None or not metadata:
+        return
+    for key in ("input_tokens", "output_tokens"):
+        usage[key] = usage.get(key, 0) + int(metadata.get(key) or 0)
+
+
+def count_message_tokens(messages: Any, model: str = "") -> int:
+    """Estimated prompt tokens, from the content of dict or LangChain messages"""
+    if isinstance(messages, str):
+        contents = [messages]
+    else:
+        contents = [
+            str(message.get("content", "")) if isinstance(message, dict) else str(getattr(message, "content", message))
+            for message in messages
+        ]
+    return sum(cached_count_tokens(contents, encoding_name_for_model(model))) if contents else 0
+
+
+def llm_usage(model: str, messages: Any, response: str, reported: Optional[Mapping[str, int]] = None) -> TokenCount:
+    """Tokens and cost of a chat completion, as reported by the provider or else estimated"""
+    if reported and reported.get("input_tokens"):
+        input_tokens, output_tokens = reported["input_tokens"], reported.get("output_tokens", 0)
+        source = "provider"
+    else:
+        input_tokens = count_message_tokens(messages, model)
+        output_tokens = cached_count_tokens([response or ""], encoding_name_for_model(model))[0]
+        source = "estimate"
+    return TokenCount(
+        model=model,
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        cost=input_tokens * INPUT_COST_PER_TOKEN + output_tokens * OUTPUT_COST_PER_TOKEN,
+        source=source,
+    )
+
+
+def report_cost(cost_callback: Optional[Callable], usage: TokenCount) -> None:
+    """
+    Call cost_callback with the cost, and with the usage when it takes a usage argument
+    (like RepintelAI.add_costs), so callbacks taking only the cost keep working.
+    """
+    if cost_callback is None:
+        return
+    if _accepts_usage(cost_callback):
+        cost_callback(usage.cost, usage=usage)
+    else:
+        cost_callback(usage.cost)
+
+
+def _accepts_usage(callback: Callable) -> bool:
+    try:
+        parameters = inspect.signature(callback).parameters
+    except (TypeError, ValueError):
+        return False
+    return "usage" in parameters or any(
+        parameter.kind == inspect.Parameter.VAR_KEYWORD for parameter in parameters.values()
+    )
+
+
+@contextmanager
+def embedding_costs_to(cost_callback: Optional[Callable]) -> Iterator[None]:
+    """
+    Charge the embedding requests made inside the block, and in tasks started from it, to
+    cost_callback. Requests are reported where they reach the provider, so texts answered
+    from the embedding cache cost nothing.
+    """
+    token = _embedding_cost_callback.set(cost_callback)
+    try:
+        yield
+    finally:
+        _embedding_cost_callback.reset(token)
+
+
+def record_embedding_usage(model: str, tokens: int) -> None:
+    """Called by the embedding executor for every request sent to the provider"""
+    cost_callback = _embedding_cost_callback.get()
+    if cost_callback is not None:
+        report_cost(cost_callback, TokenCount(model=model, input_tokens=tokens, cost=tokens * EMBEDDING_COST))
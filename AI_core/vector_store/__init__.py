@@ -1,3 +1,4 @@
 from .vector_store import VectorStoreWrapper
+from .local import LocalVectorStore
 
-__all__ = ['VectorStoreWrapper']
\ No newline at end of file
+__all__ = ['VectorStoreWrapper', 'LocalVectorStore']
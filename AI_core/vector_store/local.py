@@ -0,0 +1,508 @@
+"""
+First-party vector store for large local corpora, with no external service
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from ..context.index import normalise_rows
+from ..llm_provider.generic.base import _check_pkg
+
+INDEX_TYPES = ("ivf", "hnsw")
+_BLOCK_ROWS = 65_536
+_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+class _MappedArray:
+    """Append-only 2-D array in a memory-mapped file that grows by doubling"""
+
+    def __init__(self, path: str, dtype: str, width: int, count: int):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.width = width
+        self.count = count
+        self._map: Optional[np.memmap] = None
+        if os.path.exists(path) and os.path.getsize(path):
+            self._open(os.path.getsize(path) // (self.dtype.itemsize * width))
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._map is None:
+            return np.empty((0, self.width), dtype=self.dtype)
+        return self._map[:self.count]
+
+    def append(self, rows: np.ndarray) -> None:
+        capacity = 0 if self._map is None else len(self._map)
+        if self.count + len(rows) > capacity:
+            self._open(max(1024, 2 * capacity, self.count + len(rows)))
+        self._map[self.count:self.count + len(rows)] = rows
+        self._map.flush()
+        self.count += len(rows)
+
+    def _open(self, capacity: int) -> None:
+        if self._map is not None:
+            self._map.flush()
+            del self._map
+        with open(self.path, "ab") as f:
+            f.truncate(max(os.path.getsize(self.path), capacity * self.width * self.dtype.itemsize))
+        self._map = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(capacity, self.width))
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Vector store kept in a directory: float16 (or float32) normalised vectors in a
+    memory-mapped file and texts and metadata in SQLite, so opening it costs a few
+    milliseconds whatever its size.
+
+    Without an index, search is a blocked brute-force scan. With index_type "ivf" the
+    vectors are clustered with k-means once the store holds min_index_size vectors and
+    only the nprobe closest clusters are scanned; "hnsw" uses hnswlib when installed.
+    Filters are dicts on metadata ({"source": url}, {"year": {"$gte": 2020}},
+    {"$or": [...]}) evaluated in SQLite, as accepted for vector_store_filter.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        path: str,
+        dtype: str = "float16",
+        index_type: Optional[str] = None,
+        min_index_size: int = 10_000,
+        nprobe: int = 8,
+        hnsw_m: int = 16,
+        hnsw_ef: int = 64,
+    ):
+        if index_type is not None and index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}. Expected one of {INDEX_TYPES}")
+        self.embedding = embedding
+        self.path = path
+        self.index_type = index_type
+        self.min_index_size = min_index_size
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef = hnsw_ef
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(path, "metadata.sqlite"), check_same_thread=False)
+        self._db.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                deleted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS chunks_id ON chunks (id) WHERE deleted = 0;
+            """
+        )
+        settings = dict(self._db.execute("SELECT key, value FROM settings"))
+        self.dtype = settings.get("dtype", dtype)
+        self.dimension = int(settings.get("dimension", 0))
+        self._count = int(settings.get("count", 0))
+        self._vectors: Optional[_MappedArray] = None
+        if self.dimension:
+            self._vectors = _MappedArray(self._file("vectors"), self.dtype, self.dimension, self._count)
+        self._deleted = np.zeros(self._count, dtype=bool)
+        deleted_rows = [row for row, in self._db.execute("SELECT row FROM chunks WHERE deleted = 1")]
+        self._deleted[deleted_rows] = True
+
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: Optional[_MappedArray] = None
+        # Rows of each IVF list, in blocks merged when the list is probed
+        self._list_rows: List[List[np.ndarray]] = []
+        self._hnsw = None
+        self._load_index()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return int(self._count - self._deleted.sum())
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        path: str = "./.cache/vector_store",
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        store = cls(embedding, path, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """Embed and add texts; texts with the id of a stored text replace it"""
+        texts = list(texts)
+        if not texts:
+            return []
+        return self._add(texts, self.embedding.embed_documents(texts), metadatas, ids)
+
+    async def aadd_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = await self.embedding.aembed_documents(texts)
+        return await asyncio.to_thread(self._add, texts, vectors, metadatas, ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """Delete texts by id, or every text matching filter=..."""
+        with self._lock:
+            if ids is not None:
+                rows = self._rows_for_ids(ids)
+            elif kwargs.get("filter"):
+                rows = self._filtered_rows(kwargs["filter"]).tolist()
+            else:
+                raise ValueError("Either ids or filter must be given")
+            self._delete_rows(rows)
+            self._db.commit()
+            return True
+
+    def get_by_ids(self, ids: Sequence[str], /) -> List[Document]:
+        with self._lock:
+            rows = self._rows_for_ids(ids)
+            return self._documents(rows)
+
+    def similarity_search(
+        self, query: str, k: int = 4, filter: Optional[Dict] = None, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter, **kwargs)]
+
+    async def asimilarity_search(
+        self, query: str, k: int = 4, filter: Optional[Dict] = None, **kwargs: Any
+    ) -> List[Document]:
+        vector = await self.embedding.aembed_query(query)
+        return await asyncio.to_thread(self.similarity_search_by_vector, vector, k, filter, **kwargs)
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[Dict] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k, filter)
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[Dict] = None, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, filter: Optional[Dict] = None
+    ) -> List[Tuple[Document, float]]:
+        """Return the k most similar texts with their cosine similarity"""
+        with self._lock:
+            if not self._count:
+                return []
+            query = normalise_rows(np.asarray([embedding], dtype=np.float32))[0]
+            if filter:
+                rows = self._filtered_rows(filter)
+                scores = self._scores(query, rows)
+            elif self._hnsw is not None:
+                rows, scores = self._search_hnsw(query, k)
+            elif self._centroids is not None:
+                rows = self._probe_rows(query)
+                scores = self._scores(query, rows)
+            else:
+                rows = np.flatnonzero(~self._deleted)
+                scores = self._scores(query, rows)
+
+            if k < len(scores):
+                top = np.argpartition(-scores, k)[:k]
+            else:
+                top = np.arange(len(scores))
+            top = top[np.argsort(-scores[top], kind="stable")]
+            documents = self._documents(rows[top].tolist())
+            return list(zip(documents, scores[top].tolist()))
+
+    def similarity_search_by_vectors_with_score(
+        self, embeddings: List[List[float]], k: int = 4, filter: Optional[Dict] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Search for several query vectors at once. Brute-force and filtered searches score
+        every query in a single pass over the vectors.
+        """
+        with self._lock:
+            if not self._count or not embeddings:
+                return [[] for _ in embeddings]
+            if not filter and (self._hnsw is not None or self._centroids is not None):
+                return [self.similarity_search_by_vector_with_score(vector, k) for vector in embeddings]
+
+            queries = normalise_rows(np.asarray(embeddings, dtype=np.float32))
+            rows = self._filtered_rows(filter) if filter else np.flatnonzero(~self._deleted)
+            vectors = self._vectors.array
+            scores = np.empty((len(rows), len(queries)), dtype=np.float32)
+            for start in range(0, len(rows), _BLOCK_ROWS):
+                block_rows = rows[start:start + _BLOCK_ROWS]
+                scores[start:start + len(block_rows)] = vectors[block_rows].astype(np.float32) @ queries.T
+
+            results = []
+            for query_scores in scores.T:
+                if k < len(query_scores):
+                    top = np.argpartition(-query_scores, k)[:k]
+                else:
+                    top = np.arange(len(query_scores))
+                top = top[np.argsort(-query_scores[top], kind="stable")]
+                results.append(list(zip(self._documents(rows[top].tolist()), query_scores[top].tolist())))
+            return results
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities
+        return lambda score: score
+
+    def build_index(self) -> None:
+        """(Re)build the IVF or HNSW index over every stored vector"""
+        with self._lock:
+            if self.index_type == "ivf":
+                self._build_ivf()
+            elif self.index_type == "hnsw":
+                self._build_hnsw()
+
+    def _add(
+        self,
+        texts: List[str],
+        vectors: List[List[float]],
+        metadatas: Optional[List[dict]],
+        ids: Optional[List[Optional[str]]],
+    ) -> List[str]:
+        metadatas = metadatas or [{} for _ in texts]
+        ids = [id_ or str(uuid.uuid4()) for id_ in (ids or [None] * len(texts))]
+        if not len(texts) == len(metadatas) == len(ids):
+            raise ValueError("texts, metadatas and ids must have the same length")
+        block = normalise_rows(np.asarray(vectors, dtype=np.float32))
+
+        with self._lock:
+            if self._vectors is None:
+                self.dimension = block.shape[1]
+                self._vectors = _MappedArray(self._file("vectors"), self.dtype, self.dimension, 0)
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO settings VALUES (?, ?)",
+                    [("dimension", str(self.dimension)), ("dtype", self.dtype)],
+                )
+            elif block.shape[1] != self.dimension:
+                raise ValueError(f"Expected {self.dimension}-dimensional vectors, got {block.shape[1]}")
+
+            self._delete_rows(self._rows_for_ids(ids))
+            first = self._count
+            self._vectors.append(block.astype(self.dtype))
+            if self._lists is not None:
+                assignment = self._nearest_centroid(block)
+                self._lists.append(assignment[:, None])
+                self._add_to_lists(first, assignment)
+            if self._hnsw is not None:
+                self._hnsw.resize_index(max(self._hnsw.get_max_elements(), first + len(block)))
+                self._hnsw.add_items(block, np.arange(first, first + len(block)))
+                self._hnsw.save_index(self._file("hnsw"))
+
+            self._db.executemany(
+                "INSERT INTO chunks (row, id, content, metadata) VALUES (?, ?, ?, ?)",
+                [
+                    (first + i, id_, text, json.dumps(metadata, default=str))
+                    for i, (id_, text, metadata) in enumerate(zip(ids, texts, metadatas))
+                ],
+            )
+            self._count += len(block)
+            self._deleted = np.concatenate([self._deleted, np.zeros(len(block), dtype=bool)])
+            self._db.execute("INSERT OR REPLACE INTO settings VALUES ('count', ?)", (str(self._count),))
+            self._db.commit()
+
+            if self.index_type and self._centroids is None and self._hnsw is None \
+                    and len(self) >= self.min_index_size:
+                self.build_index()
+        return ids
+
+    def _rows_for_ids(self, ids: Sequence[str]) -> List[int]:
+        rows = []
+        for start in range(0, len(ids), 500):
+            batch = list(ids[start:start + 500])
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(
+                row for row, in self._db.execute(
+                    f"SELECT row FROM chunks WHERE deleted = 0 AND id IN ({placeholders})", batch
+                )
+            )
+        return rows
+
+    def _delete_rows(self, rows: List[int]) -> None:
+        if not rows:
+            return
+        self._db.executemany("UPDATE chunks SET deleted = 1 WHERE row = ?", [(row,) for row in rows])
+        self._deleted[rows] = True
+        if self._hnsw is not None:
+            for row in rows:
+                self._hnsw.mark_deleted(row)
+
+    def _documents(self, rows: List[int]) -> List[Document]:
+        if not rows:
+            return []
+        placeholders = ",".join("?" * len(rows))
+        found = {
+            row: Document(id=id_, page_content=content, metadata=json.loads(metadata))
+            for row, id_, content, metadata in self._db.execute(
+                f"SELECT row, id, content, metadata FROM chunks WHERE row IN ({placeholders})", rows
+            )
+        }
+        return [found[row] for row in rows]
+
+    def _scores(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        vectors = self._vectors.array
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), _BLOCK_ROWS):
+            block_rows = rows[start:start + _BLOCK_ROWS]
+            scores[start:start + len(block_rows)] = vectors[block_rows].astype(np.float32) @ query
+        return scores
+
+    def _filtered_rows(self, filter: Dict) -> np.ndarray:
+        where, params = _filter_sql(filter)
+        rows = [row for row, in self._db.execute(f"SELECT row FROM chunks WHERE deleted = 0 AND ({where})", params)]
+        return np.asarray(rows, dtype=np.int64)
+
+    def _build_ivf(self) -> None:
+        rows = np.flatnonzero(~self._deleted)
+        if not len(rows):
+            return
+        lists = max(1, int(np.sqrt(len(rows))))
+        rng = np.random.default_rng(0)
+        sample = rows if len(rows) <= 50 * lists else rng.choice(rows, 50 * lists, replace=False)
+        sample_vectors = self._vectors.array[np.sort(sample)].astype(np.float32)
+        centroids = sample_vectors[rng.choice(len(sample_vectors), lists, replace=False)]
+        for _ in range(10):
+            assignment = np.argmax(sample_vectors @ centroids.T, axis=1)
+            for i in range(lists):
+                members = sample_vectors[assignment == i]
+                if len(members):
+                    centroids[i] = members.mean(axis=0)
+            centroids = normalise_rows(centroids)
+
+        self._centroids = centroids
+        np.save(self._file("centroids"), centroids)
+        if os.path.exists(self._file("lists")):
+            os.remove(self._file("lists"))
+        self._lists = _MappedArray(self._file("lists"), "int32", 1, 0)
+        self._list_rows = [[] for _ in range(len(centroids))]
+        for start in range(0, self._count, _BLOCK_ROWS):
+            block = self._vectors.array[start:start + _BLOCK_ROWS].astype(np.float32)
+            assignment = self._nearest_centroid(block)
+            self._lists.append(assignment[:, None])
+            self._add_to_lists(start, assignment)
+
+    def _nearest_centroid(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+    def _add_to_lists(self, first_row: int, assignment: np.ndarray) -> None:
+        """Record the rows from first_row on in the lists they were assigned to"""
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(len(self._centroids) + 1))
+        for i in np.flatnonzero(np.diff(bounds)):
+            self._list_rows[i].append(first_row + order[bounds[i]:bounds[i + 1]].astype(np.int64))
+
+    def _probe_rows(self, query: np.ndarray) -> np.ndarray:
+        probes = np.argsort(-(self._centroids @ query))[:self.nprobe]
+        probed = []
+        for i in probes:
+            blocks = self._list_rows[i]
+            if len(blocks) > 1:
+                blocks[:] = [np.concatenate(blocks)]
+            probed.extend(blocks)
+        if not probed:
+            return np.empty(0, dtype=np.int64)
+        # Sorted so that the probed vectors are read in file order
+        rows = np.sort(np.concatenate(probed))
+        return rows[~self._deleted[rows]]
+
+    def _build_hnsw(self) -> None:
+        _check_pkg("hnswlib")
+        import hnswlib
+
+        index = hnswlib.Index(space="ip", dim=self.dimension)
+        index.init_index(max_elements=max(self._count, 1024), ef_construction=200, M=self.hnsw_m)
+        for start in range(0, self._count, _BLOCK_ROWS):
+            block = self._vectors.array[start:start + _BLOCK_ROWS].astype(np.float32)
+            index.add_items(block, np.arange(start, start + len(block)))
+        for row in np.flatnonzero(self._deleted):
+            index.mark_deleted(int(row))
+        index.set_ef(self.hnsw_ef)
+        index.save_index(self._file("hnsw"))
+        self._hnsw = index
+
+    def _search_hnsw(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(self))
+        if not k:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        labels, distances = self._hnsw.knn_query(query, k=k)
+        # The inner-product space reports 1 - similarity as the distance
+        return labels[0].astype(np.int64), (1 - distances[0]).astype(np.float32)
+
+    def _load_index(self) -> None:
+        if self.index_type == "ivf" and os.path.exists(self._file("centroids") + ".npy"):
+            self._centroids = np.load(self._file("centroids") + ".npy")
+            self._lists = _MappedArray(self._file("lists"), "int32", 1, self._count)
+            self._list_rows = [[] for _ in range(len(self._centroids))]
+            for start in range(0, self._count, _BLOCK_ROWS):
+                self._add_to_lists(start, self._lists.array[start:start + _BLOCK_ROWS, 0])
+        elif self.index_type == "hnsw" and os.path.exists(self._file("hnsw")):
+            _check_pkg("hnswlib")
+            import hnswlib
+
+            self._hnsw = hnswlib.Index(space="ip", dim=self.dimension)
+            self._hnsw.load_index(self._file("hnsw"), max_elements=max(self._count, 1024))
+            self._hnsw.set_ef(self.hnsw_ef)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+
+def _filter_sql(filter: Dict) -> Tuple[str, List[Any]]:
+    """Translate a metadata filter dict into a SQL condition over the metadata JSON"""
+    clauses, params = [], []
+    for key, value in filter.items():
+        if key in ("$and", "$or"):
+            parts = [_filter_sql(part) for part in value]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(f"({sql})" for sql, _ in parts) + ")" if parts else "1")
+            params.extend(param for _, part_params in parts for param in part_params)
+            continue
+        field = f"json_extract(metadata, ?)"
+        path = f'$."{key}"'
+        conditions = value if isinstance(value, dict) else {"$eq": value}
+        for operator, operand in conditions.items():
+            if operator in ("$in", "$nin"):
+                operand = list(operand)
+                placeholders = ",".join("?" * len(operand)) or "NULL"
+                negate = "NOT " if operator == "$nin" else ""
+                clauses.append(f"{field} {negate}IN ({placeholders})")
+                params.extend([path, *operand])
+            elif operator in _OPERATORS:
+                clauses.append(f"{field} {_OPERATORS[operator]} ?")
+                params.extend([path, operand])
+            else:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+    return " AND ".join(clauses) or "1", params
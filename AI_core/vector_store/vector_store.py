@@ -1,18 +1,29 @@
 """
 Wrapper for langchain vector store
 """
-from typing import List, Dict
+import asyncio
+import hashlib
+from typing import Dict, List, Set
 
 from langchain.docstore.document import Document
 from langchain.vectorstores import VectorStore
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 class VectorStoreWrapper:
     """
     A Wrapper for LangchainVectorStore to handle repintelai Document Type
+
+    Chunks are stored under ids derived from their source and content, so loading a
+    page again (from another sub-query or run) only adds the chunks that changed.
     """
-    def __init__(self, vector_store : VectorStore):
+    def __init__(self, vector_store : VectorStore, splitter=None, batch_size: int = 256, concurrency: int = 4):
+        from ..context.splitter import ChunkSplitter
+
         self.vector_store = vector_store
+        self.splitter = splitter or ChunkSplitter()
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        # Chunk ids added through this wrapper, by source url
+        self._source_ids: Dict[str, Set[str]] = {}
 
     def load(self, documents):
         """
@@ -21,23 +32,161 @@ class VectorStoreWrapper:
         """
         langchain_documents = self._create_langchain_documents(documents)
         splitted_documents = self._split_documents(langchain_documents)
-        self.vector_store.add_documents(splitted_documents)
-    
+        existing_ids = self._get_existing_ids(self._untracked_ids(splitted_documents))
+        new_documents = self._new_documents(splitted_documents, existing_ids)
+        if new_documents:
+            self.vector_store.add_documents(new_documents, ids=[doc.id for doc in new_documents])
+            self._track(new_documents)
+
+    async def aload(self, documents, upsert: bool = False) -> List[str]:
+        """
+        Load the documents into vector_store without blocking the event loop.
+        Chunks already stored for the same source are skipped and the rest are added in
+        batches of batch_size, at most concurrency batches at a time. With upsert, chunks
+        of the loaded sources that are no longer in the documents are deleted.
+        Returns the ids of the added chunks.
+        """
+        langchain_documents = self._create_langchain_documents(documents)
+        splitted_documents = await asyncio.to_thread(self._split_documents, langchain_documents)
+        if upsert:
+            current_ids = {doc.id for doc in splitted_documents}
+            stale_ids = [
+                chunk_id
+                for source in {doc.metadata["source"] for doc in splitted_documents}
+                for chunk_id in self._source_ids.get(source, ())
+                if chunk_id not in current_ids
+            ]
+            await self._adelete_ids(stale_ids)
+
+        existing_ids = await asyncio.to_thread(self._get_existing_ids, self._untracked_ids(splitted_documents))
+        new_documents = self._new_documents(splitted_documents, existing_ids)
+        if not new_documents:
+            return []
+
+        # Claim the chunks now so that concurrent loads of the same pages skip them
+        self._track(new_documents)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def add_batch(batch: List[Document]) -> List[str]:
+            async with semaphore:
+                try:
+                    return await self.vector_store.aadd_documents(batch, ids=[doc.id for doc in batch])
+                except BaseException:
+                    self._untrack(batch)
+                    raise
+
+        batches = [
+            new_documents[start:start + self.batch_size]
+            for start in range(0, len(new_documents), self.batch_size)
+        ]
+        results = await asyncio.gather(*[add_batch(batch) for batch in batches])
+        return [chunk_id for ids in results for chunk_id in ids]
+
+    async def adelete_source(self, source: str) -> None:
+        """Delete every chunk of a source url"""
+        from .local import LocalVectorStore
+
+        if isinstance(self.vector_store, LocalVectorStore):
+            # Also drops chunks of the source loaded by earlier runs
+            await asyncio.to_thread(self.vector_store.delete, filter={"source": source})
+            self._source_ids.pop(source, None)
+            return
+        await self._adelete_ids(list(self._source_ids.pop(source, ())))
+
     def _create_langchain_documents(self, data: List[Dict[str, str]]) -> List[Document]:
         """Convert RepIntel AI Document to Langchain Document"""
         return [Document(page_content=item["raw_content"], metadata={"source": item["url"]}) for item in data]
 
-    def _split_documents(self, documents: List[Document], chunk_size: int = 1000, chunk_overlap: int = 200) -> List[Document]:
+    def _split_documents(self, documents: List[Document]) -> List[Document]:
         """
-        Split documents into smaller chunks
+        Split documents into smaller chunks, with ids hashed from their source and content
         """
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-        )
-        return text_splitter.split_documents(documents)
+        chunks = self.splitter.split_documents(documents)
+        for chunk in chunks:
+            chunk.id = self.chunk_id(chunk.metadata.get("source", ""), chunk.page_content)
+        return chunks
+
+    @staticmethod
+    def chunk_id(source: str, content: str) -> str:
+        return hashlib.sha256(f"{source}\n{content}".encode("utf-8", errors="ignore")).hexdigest()
+
+    def _is_tracked(self, doc: Document) -> bool:
+        return doc.id in self._source_ids.get(doc.metadata.get("source", ""), ())
+
+    def _untracked_ids(self, documents: List[Document]) -> List[str]:
+        return list(dict.fromkeys(doc.id for doc in documents if not self._is_tracked(doc)))
+
+    def _new_documents(self, documents: List[Document], existing_ids: Set[str]) -> List[Document]:
+        """Drop chunks that are already stored, or repeated within the documents"""
+        seen = set(existing_ids)
+        new_documents = []
+        for doc in documents:
+            if doc.id not in seen and not self._is_tracked(doc):
+                seen.add(doc.id)
+                new_documents.append(doc)
+        return new_documents
+
+    def _get_existing_ids(self, ids: List[str]) -> Set[str]:
+        """Ids already in the vector store, for stores that support lookups by id"""
+        if not ids:
+            return set()
+        try:
+            return {doc.id for doc in self.vector_store.get_by_ids(ids)}
+        except NotImplementedError:
+            return set()
+
+    async def _adelete_ids(self, ids: List[str]) -> None:
+        if not ids:
+            return
+        await self.vector_store.adelete(ids)
+        for source_ids in self._source_ids.values():
+            source_ids.difference_update(ids)
+
+    def _track(self, documents: List[Document]) -> None:
+        for doc in documents:
+            self._source_ids.setdefault(doc.metadata.get("source", ""), set()).add(doc.id)
+
+    def _untrack(self, documents: List[Document]) -> None:
+        for doc in documents:
+            self._source_ids.get(doc.metadata.get("source", ""), set()).discard(doc.id)
 
     async def asimilarity_search(self, query, k, filter):
         """Return query by vector store"""
         results = await self.vector_store.asimilarity_search(query=query, k=k, filter=filter)
         return results
+
+    async def amulti_similarity_search(self, queries: List[str], k: int, filter=None) -> List[List[Document]]:
+        """
+        Search for several queries with one batched embedding call, then run the searches
+        concurrently (or as one scan with LocalVectorStore). Returns one list per query;
+        a chunk found by several queries is only kept for the first of them.
+        """
+        from .local import LocalVectorStore
+
+        embeddings = self.vector_store.embeddings
+        if embeddings is None or not queries:
+            results = await asyncio.gather(*[self.asimilarity_search(query, k, filter) for query in queries])
+        else:
+            vectors = await embeddings.aembed_documents(queries)
+            if isinstance(self.vector_store, LocalVectorStore):
+                scored = await asyncio.to_thread(
+                    self.vector_store.similarity_search_by_vectors_with_score, vectors, k, filter
+                )
+                results = [[doc for doc, _ in query_results] for query_results in scored]
+            else:
+                results = await asyncio.gather(*[
+                    self.vector_store.asimilarity_search_by_vector(vector, k=k, filter=filter)
+                    for vector in vectors
+                ])
+
+        seen = set()
+        deduped = []
+        for docs in results:
+            kept = []
+            for doc in docs:
+                key = doc.id or (doc.metadata.get("source"), doc.page_content)
+                if key not in seen:
+                    seen.add(key)
+                    kept.append(doc)
+            deduped.append(kept)
+        return deduped
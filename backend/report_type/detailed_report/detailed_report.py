@@ -40,7 +40,9 @@ class DetailedReport:
         )
         self.existing_headers: List[Dict] = []
         self.global_context: List[str] = []
-        self.global_written_sections: List[str] = []
+        self.global_written_sections: List[Dict] = []
+        # Embeds each written section once for the draft-title lookups of later subtopics
+        self.written_section_index = self.AI_core.create_written_section_index()
         self.global_urls: Set[str] = set(
             self.source_urls) if self.source_urls else set()
 
@@ -111,12 +113,14 @@ class DetailedReport:
             "text", "") for header in parse_draft_section_titles]
 
         relevant_contents = await subtopic_assistant.get_similar_written_contents_by_draft_section_titles(
-            current_subtopic_task, parse_draft_section_titles_text, self.global_written_sections
+            current_subtopic_task, parse_draft_section_titles_text, self.written_section_index
         )
 
         subtopic_report = await subtopic_assistant.write_report(self.existing_headers, relevant_contents)
 
-        self.global_written_sections.extend(self.AI_core.extract_sections(subtopic_report))
+        written_sections = self.AI_core.extract_sections(subtopic_report)
+        self.global_written_sections.extend(written_sections)
+        await self.written_section_index.add_sections(written_sections)
         self.global_context = list(set(subtopic_assistant.context))
         self.global_urls.update(subtopic_assistant.visited_urls)
 
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import re
@@ -5,7 +6,8 @@ import time
 import shutil
 from typing import Dict, List, Any
 from fastapi.responses import JSONResponse
-from AI_core.document.document import DocumentLoader
+from AI_core.config import Config
+from AI_core.document import LocalDocumentIndex
 # Add this import
 from backend.utils import write_md_to_pdf, write_md_to_word, write_text_to_md
 
@@ -78,14 +80,35 @@ def update_environment_variables(config: Dict[str, str]):
         os.environ[key] = value
 
 
+# Keeps background indexing tasks referenced until they finish
+_indexing_tasks = set()
+
+
+def schedule_document_indexing(DOC_PATH: str) -> None:
+    """Bring the local document index up to date in the background"""
+    # Built like the researcher's index, so both chunk files the same way
+    index = LocalDocumentIndex.from_config(Config(), doc_path=DOC_PATH)
+    task = asyncio.create_task(index.refresh())
+    _indexing_tasks.add(task)
+    task.add_done_callback(_on_indexing_done)
+
+
+def _on_indexing_done(task: asyncio.Task) -> None:
+    _indexing_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Failed to index documents: {task.exception()}")
+    elif not task.cancelled():
+        update = task.result()
+        print(f"Indexed documents: {len(update.added)} added, {len(update.changed)} changed, {len(update.removed)} removed")
+
+
 async def handle_file_upload(file, DOC_PATH: str) -> Dict[str, str]:
     file_path = os.path.join(DOC_PATH, os.path.basename(file.filename))
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
     print(f"File uploaded to {file_path}")
 
-    document_loader = DocumentLoader(DOC_PATH)
-    await document_loader.load()
+    schedule_document_indexing(DOC_PATH)
 
     return {"filename": file.filename, "path": file_path}
 
@@ -95,6 +118,7 @@ async def handle_file_deletion(filename: str, DOC_PATH: str) -> JSONResponse:
     if os.path.exists(file_path):
         os.remove(file_path)
         print(f"File deleted: {file_path}")
+        schedule_document_indexing(DOC_PATH)
         return JSONResponse(content={"message": "File deleted successfully"})
     else:
         print(f"File not found: {file_path}")
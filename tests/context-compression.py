@@ -0,0 +1,337 @@
+import asyncio
+import hashlib
+import threading
+from typing import List
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from AI_core.context.compression import ContextCompressor
+from AI_core.context.index import ChunkIndex
+from AI_core.memory.cache import CachedEmbeddings, EmbeddingCache
+from AI_core.memory.executor import EmbeddingExecutor
+from AI_core.memory.pages import PageStore
+from AI_core.context.splitter import ChunkSplitter
+from AI_core.context.sections import WrittenSectionIndex
+from AI_core.context.store import ChunkStore
+from AI_core.context.threshold import SimilarityThreshold
+from AI_core.utils.tokens import count_tokens
+
+
+class CountingEmbeddings(Embeddings):
+    """Bag-of-words embeddings that record how many texts were embedded."""
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self.embedded_documents = 0
+        self.embedded_queries = 0
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.size
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.size] += 1.0
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded_documents += len(texts)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.embedded_queries += 1
+        return self._embed(text)
+
+
+pages = [
+    {"url": "cats.txt", "title": "Cats", "raw_content": "cats purr and sleep all day long " * 40},
+    {"url": "dogs.txt", "title": "Dogs", "raw_content": "dogs bark and fetch the ball outside " * 40},
+]
+
+
+@pytest.mark.asyncio
+async def test_shared_index_embeds_corpus_once():
+    embeddings = CountingEmbeddings()
+    index = ChunkIndex(embeddings)
+    queries = ["why do cats purr", "do dogs fetch", "sleep all day"]
+
+    contexts = await asyncio.gather(*[
+        ContextCompressor(documents=pages, embeddings=embeddings, index=index).async_get_context(query)
+        for query in queries
+    ])
+
+    assert embeddings.embedded_documents <= len({d.page_content for d in index.documents})
+    assert embeddings.embedded_queries == len(queries)
+    assert "Source: cats.txt" in contexts[0]
+    assert "Source: dogs.txt" in contexts[1]
+
+
+@pytest.mark.asyncio
+async def test_search_is_restricted_to_given_pages():
+    embeddings = CountingEmbeddings()
+    index = ChunkIndex(embeddings)
+    await index.add_pages(pages)
+    rows = await index.add_pages(pages[1:])
+
+    docs = await index.search("cats purr", rows=rows)
+
+    assert docs
+    assert all(d.metadata["source"] == "dogs.txt" for d in docs)
+
+
+@pytest.mark.asyncio
+async def test_lexical_prefilter_limits_embedded_chunks():
+    embeddings = CountingEmbeddings()
+    index = ChunkIndex(embeddings, splitter=ChunkSplitter(chunk_size=20, chunk_overlap=0), recall_margin=1)
+    corpus = [
+        {"url": f"page{i}.txt", "title": "", "raw_content": f"topic{i} is discussed here at length. " * 20}
+        for i in range(50)
+    ]
+    rows = await index.add_pages(corpus)
+
+    docs = await index.search("topic7", rows=rows, k=5)
+
+    assert docs and all(d.metadata["source"] == "page7.txt" for d in docs)
+    assert embeddings.embedded_documents < len(index.documents) // 10
+
+
+@pytest.mark.asyncio
+async def test_selection_caps_sources_and_tokens():
+    embeddings = CountingEmbeddings()
+    index = ChunkIndex(embeddings, splitter=ChunkSplitter(chunk_size=20, chunk_overlap=0))
+    corpus = [
+        {"url": "cats.txt", "title": "", "raw_content": "Cats purr when they are content. " * 30},
+        {"url": "more-cats.txt", "title": "", "raw_content": "Cats purr and also sleep a lot. " * 30},
+    ]
+    rows = await index.add_pages(corpus)
+
+    docs = await index.search(
+        "cats purr", rows=rows, k=40, token_budget=60, max_per_source=2, mmr_lambda=0.5
+    )
+
+    assert sum(count_tokens([d.page_content for d in docs])) <= 60
+    assert {d.metadata["source"] for d in docs} == {"cats.txt", "more-cats.txt"}
+    assert all(sum(d.metadata["source"] == s for d in docs) <= 2 for s in ("cats.txt", "more-cats.txt"))
+
+
+def test_chunk_store_merges_overlapping_chunks():
+    store = ChunkStore()
+    text = "Cats purr. Cats sleep. Cats hunt at night."
+    ids = store.add_page("cats.txt", "Cats", text, [(0, 22), (11, 31), (32, 43)])
+
+    assert store[ids[1]].page_content == text[11:31]
+    assert store.spans([ids[2], ids[1], ids[0]]) == [(0, 0, 31), (0, 32, 43)]
+    assert store.render([ids[0], ids[1]]) == f"Source: cats.txt\nTitle: Cats\nContent: {text[:31]}\n"
+
+
+def test_page_store_spills_beyond_budget(tmp_path):
+    store = PageStore(memory_budget=20_000, spill_dir=str(tmp_path))
+    texts = [f"page {i} " * 1000 for i in range(10)]
+    ids = [store.add(text) for text in texts]
+
+    assert store.add(texts[3]) == ids[3]
+    assert store.resident_bytes <= 20_000
+    assert 0 < store.spilled_bytes < sum(len(text) for text in texts)
+    assert [store.get(page_id) for page_id in ids] == texts
+    store.close()
+    assert not list(tmp_path.iterdir())
+
+
+def test_chunks_of_spilled_pages_are_read_without_thrashing(tmp_path):
+    pages = PageStore(memory_budget=20_000, spill_dir=str(tmp_path), recent_pages=4)
+    store = ChunkStore(pages)
+    texts = [f"page {i} " * 1000 for i in range(10)]
+    chunk_ids = [list(store.add_page(f"{i}.txt", "", text, [(0, 7), (7, 14), (14, 21)])) for i, text in enumerate(texts)]
+    resident = pages.resident_bytes
+
+    decompressed = []
+    decompress = pages._decompress
+    pages._decompress = lambda data: decompressed.append(data) or decompress(data)
+    spilled = [ids for ids in chunk_ids[:4]]
+    # Alternate between the chunks of spilled pages, as reranking and rendering do
+    for _ in range(3):
+        for ids in zip(*spilled):
+            assert [store.text(chunk_id) for chunk_id in ids] == [f"page {i} " for i in range(4)]
+    assert len(decompressed) == 4
+    assert pages.resident_bytes == resident
+
+
+@pytest.mark.asyncio
+async def test_written_sections_are_embedded_once():
+    embeddings = CountingEmbeddings()
+    index = WrittenSectionIndex(embeddings)
+    await index.add_sections([{"section_title": "Cats", "written_content": "Cats purr when they are content."}])
+    await index.add_sections([
+        {"section_title": "Cats", "written_content": "Cats purr when they are content."},
+        {"section_title": "Dogs", "written_content": "Dogs bark at the postman."},
+    ])
+    embedded = embeddings.embedded_documents
+
+    docs = await index.search(["why cats purr", "dogs bark", "whales sing"], similarity_threshold=0.3)
+
+    assert embedded == 2
+    assert embeddings.embedded_documents == embedded + 3
+    assert {d.metadata["section_title"] for d in docs} == {"Cats", "Dogs"}
+
+
+def test_adaptive_threshold_is_clamped():
+    similarities = np.concatenate([np.linspace(0.9, 0.7, 5), np.full(95, 0.1)])
+
+    percentile = SimilarityThreshold("percentile", percentile=90, floor=0.05, ceiling=0.8)
+    knee = SimilarityThreshold("knee", floor=0.05, ceiling=0.8)
+
+    assert (similarities > percentile(similarities)).sum() == 5
+    assert (similarities > knee(similarities)).sum() == 5
+    assert SimilarityThreshold("percentile", floor=0.3)(np.full(10, 0.1)) == 0.3
+    assert SimilarityThreshold("percentile", ceiling=0.5)(np.full(10, 0.9)) == 0.5
+
+
+def test_embedding_cache_persists_across_instances(tmp_path):
+    embeddings = CountingEmbeddings()
+    texts = ["cats purr", "dogs bark", "cats purr"]
+
+    first = CachedEmbeddings(embeddings, "fake", "bow", EmbeddingCache(str(tmp_path), "fake:bow"))
+    vectors = first.embed_documents(texts)
+    second = CachedEmbeddings(embeddings, "fake", "bow", EmbeddingCache(str(tmp_path), "fake:bow"))
+
+    assert second.embed_documents(texts) == vectors
+    assert embeddings.embedded_documents == 2
+
+
+def test_embedding_cache_evicts_least_recently_used(tmp_path):
+    embeddings = CountingEmbeddings()
+    cached = CachedEmbeddings(embeddings, "fake", "bow", EmbeddingCache(str(tmp_path), "fake:bow", max_entries=2))
+
+    cached.embed_documents(["a a", "b b"])
+    cached.embed_documents(["a a"])
+    cached.embed_documents(["c c"])
+    cached.embed_documents(["a a", "b b"])
+
+    assert embeddings.embedded_documents == 4
+
+
+def test_embedding_cache_keeps_models_of_other_dimensions_apart(tmp_path):
+    large, small = CountingEmbeddings(64), CountingEmbeddings(32)
+    texts = ["cats purr", "dogs bark"]
+
+    first = CachedEmbeddings.from_config(large, "fake", "bow", str(tmp_path), embedding_kwargs={"dimensions": 64})
+    second = CachedEmbeddings.from_config(small, "fake", "bow", str(tmp_path), embedding_kwargs={"dimensions": 32})
+    assert [len(vector) for vector in first.embed_documents(texts)] == [64, 64]
+    assert [len(vector) for vector in second.embed_documents(texts)] == [32, 32]
+    assert small.embedded_documents == 2
+
+    # Vectors of another dimension in the same namespace are not cached, rather than failing
+    shared = CachedEmbeddings(small, "fake", "bow", first.cache)
+    assert [len(vector) for vector in shared.embed_documents(["birds sing"])] == [32]
+    assert first.embed_documents(texts) and large.embedded_documents == 2
+
+
+@pytest.mark.asyncio
+async def test_executor_batches_and_retries():
+    class RateLimitError(Exception):
+        pass
+
+    class FlakyEmbeddings(CountingEmbeddings):
+        def __init__(self, error):
+            super().__init__()
+            self.error = error
+            self.calls = 0
+
+        async def aembed_documents(self, texts):
+            self.calls += 1
+            if self.calls == 1:
+                raise self.error
+            return self.embed_documents(texts)
+
+    embeddings = FlakyEmbeddings(RateLimitError("rate limited"))
+    executor = EmbeddingExecutor(embeddings, batch_tokens=8, concurrency=2, backoff=0)
+    texts = [f"word{i} word{i}" for i in range(10)]
+
+    vectors = await executor.aembed_documents(texts)
+
+    assert vectors == embeddings.embed_documents(texts)
+    assert len(executor.make_batches(texts)) > 1
+
+    # Errors that would fail again are raised without retrying
+    embeddings = FlakyEmbeddings(ValueError("invalid input"))
+    with pytest.raises(ValueError):
+        await EmbeddingExecutor(embeddings, concurrency=1, backoff=0).aembed_documents(["word"])
+    assert embeddings.calls == 1
+
+
+def test_splitter_respects_token_budget_and_headings():
+    text = "# Intro\n" + "Cats purr when they are happy. " * 60 + "\n## Dogs\n" + "Dogs bark at strangers. " * 60
+    splitter = ChunkSplitter(chunk_size=100, chunk_overlap=10)
+
+    offsets = splitter.split_offsets(text)
+
+    assert max(count_tokens([text[start:end] for start, end in offsets])) <= 100
+    assert any(text[start:end].startswith("## Dogs") for start, end in offsets)
+    assert all(text[start:end].strip() == text[start:end] for start, end in offsets)
+
+
+class BlockingModel:
+    """Sentence-transformers stand-in that records batches and can be held mid-batch."""
+
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+
+    def encode(self, texts, batch_size, convert_to_numpy, normalize_embeddings):
+        self.started.set()
+        self.release.wait(5)
+        if "boom" in texts:
+            raise RuntimeError("model failed")
+        self.batches.append(list(texts))
+        return np.array([[float(len(text)), float(i)] for i, text in enumerate(texts)])
+
+
+@pytest.fixture
+def local_engine(monkeypatch):
+    from AI_core.memory.local import LocalEmbeddingEngine
+
+    model = BlockingModel()
+    monkeypatch.setattr(LocalEmbeddingEngine, "_load", lambda self, *args: model)
+    return LocalEmbeddingEngine("fake", batch_size=8, max_wait_ms=50), model
+
+
+@pytest.mark.asyncio
+async def test_local_engine_batches_requests_and_survives_cancellation(local_engine):
+    from AI_core.memory.local import LocalEmbeddings
+
+    engine, model = local_engine
+    embeddings = LocalEmbeddings.__new__(LocalEmbeddings)
+    embeddings.model, embeddings.engine = "fake", engine
+
+    # Requests arriving together are merged into one batch and answered in order
+    results = await asyncio.gather(*(embeddings.aembed_documents(["a" * n, "b"]) for n in range(1, 4)))
+    assert model.batches == [["a", "b", "aa", "b", "aaa", "b"]]
+    assert [[vector[0] for vector in result] for result in results] == [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0]]
+
+    # Hold the worker in a batch, queue requests behind it and cancel one of them
+    model.release.clear()
+    model.started.clear()
+    running = asyncio.ensure_future(embeddings.aembed_documents(["running"]))
+    await asyncio.to_thread(model.started.wait, 5)
+    cancelled = asyncio.ensure_future(embeddings.aembed_documents(["cancelled"]))
+    kept = asyncio.ensure_future(embeddings.aembed_documents(["kept"]))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    model.release.set()
+    assert (await asyncio.wait_for(running, 5))[0][0] == 7.0
+    assert (await asyncio.wait_for(kept, 5))[0][0] == 4.0
+    assert all("cancelled" not in batch for batch in model.batches)
+
+    # Cancelling while the batch runs, or a failing batch, does not stop the worker
+    model.release.clear()
+    model.started.clear()
+    in_flight = asyncio.ensure_future(embeddings.aembed_documents(["in flight"]))
+    await asyncio.to_thread(model.started.wait, 5)
+    in_flight.cancel()
+    model.release.set()
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(embeddings.aembed_documents(["boom"]), 5)
+    assert (await asyncio.wait_for(embeddings.aembed_documents(["still works"]), 5))[0][0] == 11.0
@@ -0,0 +1,197 @@
+import pytest
+
+import os
+
+from AI_core.document import DocumentLoader, LocalDocumentIndex
+
+
+@pytest.fixture
+def doc_path(tmp_path):
+    for i in range(6):
+        (tmp_path / f"note{i}.txt").write_text(f"Note number {i} about loading documents.")
+    (tmp_path / "image.png").write_bytes(b"not a document")
+    return tmp_path
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("max_workers", [1, 2])
+async def test_loader_parses_supported_files(doc_path, max_workers):
+    pages = await DocumentLoader(str(doc_path), max_workers=max_workers).load()
+
+    assert sorted(page["url"] for page in pages) == [f"note{i}.txt" for i in range(6)]
+    assert all(page["raw_content"].startswith("Note number") for page in pages)
+
+
+@pytest.mark.asyncio
+async def test_index_only_parses_changed_files(doc_path, tmp_path_factory, monkeypatch):
+    import AI_core.document.index as index_module
+
+    parsed = []
+
+    def counting_load_file(file_path, *args):
+        parsed.append(os.path.basename(file_path))
+        return load_file(file_path, *args)
+
+    load_file = index_module.load_file
+    monkeypatch.setattr(index_module, "load_file", counting_load_file)
+    cache_dir = str(tmp_path_factory.mktemp("index"))
+
+    pages = await LocalDocumentIndex(str(doc_path), cache_dir=cache_dir, max_workers=1).load()
+    assert len(pages) == 6 and len(parsed) == 6
+
+    # A new index over the same cache only parses what changed since
+    parsed.clear()
+    (doc_path / "note0.txt").write_text("Note number 0, rewritten.")
+    (doc_path / "note1.txt").unlink()
+    os.utime(doc_path / "note2.txt")
+    index = LocalDocumentIndex(str(doc_path), cache_dir=cache_dir, max_workers=1)
+    update = await index.refresh()
+
+    assert parsed == ["note0.txt"]
+    assert update.changed == [str(doc_path / "note0.txt")]
+    assert update.removed == [str(doc_path / "note1.txt")]
+    pages = await index.load()
+    assert sorted(page["url"] for page in pages) == ["note0.txt"] + [f"note{i}.txt" for i in range(2, 6)]
+    assert "Note number 0, rewritten." in [page["raw_content"] for page in pages]
+    assert not await index.refresh()
+
+
+def test_csv_rows_are_chunked_with_their_header(tmp_path):
+    from AI_core.document.tabular import load_table
+    from AI_core.utils.tokens import count_tokens
+
+    rows = ["region;product;revenue"] + [f"north;widget {i};{i * 100}" for i in range(500)] + [";;", ""]
+    (tmp_path / "sales.csv").write_text("\n".join(rows))
+
+    pages = list(load_table(str(tmp_path / "sales.csv"), "csv", chunk_tokens=100))
+
+    assert len(pages) > 1
+    assert all(page["url"] == "sales.csv" for page in pages)
+    assert all(page["raw_content"].startswith("region | product | revenue\n") for page in pages)
+    assert max(count_tokens([page["raw_content"] for page in pages])) <= 100
+    body = [line for page in pages for line in page["raw_content"].splitlines()[1:]]
+    assert body == [f"north | widget {i} | {i * 100}" for i in range(500)]
+
+
+@pytest.mark.asyncio
+async def test_spreadsheets_are_indexed_as_they_are_read(tmp_path, tmp_path_factory, monkeypatch):
+    import AI_core.document.index as index_module
+
+    rows = ["region,product,revenue"] + [f"north,widget {i},{i * 100}" for i in range(200)]
+    (tmp_path / "sales.csv").write_text("\n".join(rows))
+    monkeypatch.setattr(index_module, "_STREAM_BATCH_SIZE", 2)
+    # Streamed batch by batch rather than parsed whole in a worker
+    monkeypatch.setattr(index_module, "load_file", None)
+    index = LocalDocumentIndex(str(tmp_path), cache_dir=str(tmp_path_factory.mktemp("index")), max_workers=1)
+
+    assert (await index.refresh()).added == [str(tmp_path / "sales.csv")]
+    chunks, = await index.search(["widget 142"], k=1)
+    assert "north | widget 142 | 14200" in chunks[0]["raw_content"]
+
+
+@pytest.mark.asyncio
+async def test_index_search_returns_candidate_chunks(tmp_path, tmp_path_factory):
+    from langchain_core.embeddings import FakeEmbeddings
+
+    (tmp_path / "solar.txt").write_text("Solar panels convert sunlight into electricity.")
+    (tmp_path / "wind.txt").write_text("Wind turbines spin in strong coastal winds.")
+    (tmp_path / "tides.txt").write_text("Tidal power follows the pull of the moon.")
+    index = LocalDocumentIndex(str(tmp_path), cache_dir=str(tmp_path_factory.mktemp("index")), max_workers=1)
+    await index.refresh()
+
+    lexical, = await index.search(["how do turbines work?"], k=2)
+    assert [chunk["url"] for chunk in lexical] == ["wind.txt"]
+
+    embeddings = FakeEmbeddings(size=8)
+    with_vectors, = await index.search(["how do turbines work?"], k=2, embeddings=embeddings)
+    assert with_vectors[0]["url"] == "wind.txt" and len(with_vectors) <= 3
+
+    (tmp_path / "wind.txt").unlink()
+    await index.refresh()
+    after_delete, = await index.search(["how do turbines work?"], k=3, embeddings=embeddings)
+    assert "wind.txt" not in [chunk["url"] for chunk in after_delete]
+    assert len(index._vector_store) == 2
+
+
+@pytest.mark.asyncio
+async def test_index_streams_html_pages_from_web_archives(tmp_path, tmp_path_factory):
+    warcio = pytest.importorskip("warcio")
+    from io import BytesIO
+
+    from warcio.statusandheaders import StatusAndHeaders
+
+    def response(writer, url, content_type, body):
+        http_headers = StatusAndHeaders("200 OK", [("Content-Type", content_type)], protocol="HTTP/1.1")
+        writer.write_record(writer.create_warc_record(url, "response", payload=BytesIO(body), http_headers=http_headers))
+
+    with open(tmp_path / "crawl.warc.gz", "wb") as f:
+        writer = warcio.WARCWriter(f, gzip=True)
+        response(
+            writer,
+            "https://example.com/reviews",
+            "text/html; charset=utf-8",
+            b"<html><head><title>Reviews</title></head><body><p>Customers praise the fast delivery service.</p>"
+            b"<script>var tracking = 1;</script></body></html>",
+        )
+        response(writer, "https://example.com/logo.png", "image/png", b"\x89PNG")
+
+    index = LocalDocumentIndex(str(tmp_path), cache_dir=str(tmp_path_factory.mktemp("index")), max_workers=1)
+    update = await index.refresh()
+
+    assert update.added == [str(tmp_path / "crawl.warc.gz")]
+    chunks, = await index.search(["delivery"], k=5)
+    assert chunks == [{
+        "raw_content": "Customers praise the fast delivery service.",
+        "url": "https://example.com/reviews",
+        "title": "Reviews",
+    }]
+
+
+@pytest.mark.asyncio
+async def test_streamed_files_that_fail_are_read_again(tmp_path, tmp_path_factory, monkeypatch):
+    import AI_core.document.index as index_module
+
+    (tmp_path / "crawl.warc").write_bytes(b"")
+    failing = [True]
+
+    def read_pages(path, chunk_tokens=250):
+        yield {"raw_content": "Customers praise the fast delivery service.", "url": "https://example.com", "title": ""}
+        if failing[0]:
+            raise OSError("truncated archive")
+
+    monkeypatch.setattr(index_module, "_STREAM_BATCH_SIZE", 1)
+    monkeypatch.setitem(index_module.STREAM_READERS, "warc", read_pages)
+    index = LocalDocumentIndex(str(tmp_path), cache_dir=str(tmp_path_factory.mktemp("index")), max_workers=1)
+
+    assert (await index.refresh()).added == [str(tmp_path / "crawl.warc")]
+    assert await index.search(["delivery"], k=5) == [[]]
+
+    failing[0] = False
+    assert (await index.refresh()).added == [str(tmp_path / "crawl.warc")]
+    chunks, = await index.search(["delivery"], k=5)
+    assert [chunk["url"] for chunk in chunks] == ["https://example.com"]
+
+
+@pytest.mark.asyncio
+async def test_files_are_stored_one_by_one_and_failures_read_again(tmp_path, tmp_path_factory, monkeypatch):
+    import AI_core.document.index as index_module
+
+    (tmp_path / "solar.txt").write_text("Solar panels convert sunlight into electricity.")
+    (tmp_path / "wind.txt").write_text("Wind turbines turn moving air into power.")
+    failing = [True]
+    load_file = index_module.load_file
+
+    def flaky_load_file(file_path, *args):
+        if failing[0] and file_path.endswith("wind.txt"):
+            raise OSError("file is locked")
+        return load_file(file_path, *args)
+
+    monkeypatch.setattr(index_module, "load_file", flaky_load_file)
+    index = LocalDocumentIndex(str(tmp_path), cache_dir=str(tmp_path_factory.mktemp("index")), max_workers=1)
+
+    assert sorted((await index.refresh()).added) == [str(tmp_path / "solar.txt"), str(tmp_path / "wind.txt")]
+    assert [len(chunks) for chunks in await index.search(["sunlight", "turbines"], k=5)] == [1, 0]
+
+    failing[0] = False
+    assert (await index.refresh()).added == [str(tmp_path / "wind.txt")]
+    assert [len(chunks) for chunks in await index.search(["sunlight", "turbines"], k=5)] == [1, 1]
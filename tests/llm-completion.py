@@ -0,0 +1,456 @@
+import pytest
+
+import AI_core.utils.llm as llm
+from AI_core.llm_provider import ResponseCache, set_response_cache
+
+
+class FakeProvider:
+    def __init__(self, response="First line\nSecond line\n"):
+        self.response = response
+        self.calls = 0
+
+    async def get_chat_response(self, messages, stream, websocket=None):
+        self.calls += 1
+        return self.response
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    provider = FakeProvider()
+    monkeypatch.setattr(llm, "get_llm", lambda *args, **kwargs: provider)
+    return provider
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    import AI_core.llm_provider.cache as cache_module
+
+    # Restored after the test
+    monkeypatch.setattr(cache_module, "_response_cache", None)
+    cache = ResponseCache(str(tmp_path), ttl=60, max_bytes=1024)
+    set_response_cache(cache)
+    return cache
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_are_answered_from_the_cache(provider, cache):
+    messages = [{"role": "user", "content": "Plan the research"}]
+
+    first = await llm.create_chat_completion(messages, model="gpt-4o-mini", llm_provider="openai")
+    second = await llm.create_chat_completion(messages, model="gpt-4o-mini", llm_provider="openai")
+    assert first == second == provider.response
+    assert provider.calls == 1
+
+    await llm.create_chat_completion(messages, model="gpt-4o-mini", llm_provider="openai", temperature=0.0)
+    await llm.create_chat_completion(messages, model="gpt-4o-mini", llm_provider="openai", use_cache=False)
+    assert provider.calls == 3
+
+    websocket = FakeWebSocket()
+    replayed = await llm.create_chat_completion(
+        messages, model="gpt-4o-mini", llm_provider="openai", stream=True, websocket=websocket
+    )
+    assert replayed == provider.response and provider.calls == 3
+    assert [data["output"] for data in websocket.sent] == ["First line\n", "Second line\n"]
+
+    # Limited to deterministic calls, as by default, sampled ones are always sent
+    cache.max_temperature = 0.0
+    for _ in range(2):
+        await llm.create_chat_completion(messages, model="gpt-4o-mini", llm_provider="openai")
+    await llm.create_chat_completion(messages, model="gpt-4o-mini", llm_provider="openai", temperature=0.0)
+    assert provider.calls == 5
+
+
+def test_cache_expires_and_evicts_least_recently_used(cache, monkeypatch):
+    import AI_core.llm_provider.cache as cache_module
+
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    cache.put("a", "x" * 400)
+    now[0] += 1
+    cache.put("b", "y" * 400)
+    now[0] += 1
+    assert cache.get("a") == "x" * 400
+
+    # "b" is now the least recently used and makes room for "c"
+    now[0] += 1
+    cache.put("c", "z" * 400)
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+
+    now[0] += 61
+    assert cache.get("c") is None
+
+
+@pytest.mark.asyncio
+async def test_providers_are_reused_for_the_same_settings(monkeypatch):
+    from AI_core.llm_provider import GenericLLMProvider
+
+    built = []
+    monkeypatch.setattr(llm, "_loop_providers", type(llm._loop_providers)())
+    monkeypatch.setattr(
+        GenericLLMProvider, "from_provider", classmethod(lambda cls, provider, **kwargs: built.append(kwargs) or cls(None))
+    )
+
+    first = llm.get_llm("openai", model="gpt-4o-mini", temperature=0.4, model_kwargs={"seed": 1})
+    assert llm.get_llm("openai", temperature=0.4, model_kwargs={"seed": 1}, model="gpt-4o-mini") is first
+    assert llm.get_llm("openai", model="gpt-4o-mini", temperature=0.0, model_kwargs={"seed": 1}) is not first
+    assert len(built) == 2
+
+
+@pytest.mark.asyncio
+async def test_governor_queues_calls_beyond_the_budget_by_priority(monkeypatch):
+    import asyncio
+
+    import AI_core.llm_provider.governor as governor_module
+    from AI_core.llm_provider import Priority, RateGovernor
+
+    monkeypatch.setattr(governor_module, "WINDOW_SECONDS", 0.2)
+    governor = RateGovernor(governor_module.parse_rate_limits("openai:gpt-4o-mini=2/0, anthropic=0/100"))
+    order = []
+
+    async def call(name, priority, provider="openai", tokens=10):
+        await governor.acquire(provider, "gpt-4o-mini", tokens, priority)
+        order.append(name)
+
+    await call("first", Priority.NORMAL)
+    await call("second", Priority.NORMAL)
+    queued = [
+        asyncio.create_task(call("planning", Priority.BACKGROUND)),
+        asyncio.create_task(call("report", Priority.INTERACTIVE)),
+    ]
+    await asyncio.sleep(0)
+    assert governor.metrics()["openai:gpt-4o-mini"]["queue_depth"] == 2
+
+    await asyncio.gather(*queued)
+    assert order == ["first", "second", "report", "planning"]
+    assert governor.metrics()["openai:gpt-4o-mini"]["max_queue_depth"] == 2
+
+    # Tokens per minute: the second call waits for the first one's tokens to expire
+    assert not governor.limited("openai", "gpt-4o")
+    await call("large", Priority.NORMAL, provider="anthropic", tokens=80)
+    await asyncio.wait_for(call("small", Priority.NORMAL, provider="anthropic", tokens=30), timeout=1)
+    assert order[-2:] == ["large", "small"]
+
+
+def test_governor_wakes_queued_calls_of_every_event_loop(monkeypatch):
+    import asyncio
+
+    import AI_core.llm_provider.governor as governor_module
+    from AI_core.llm_provider import RateGovernor
+
+    monkeypatch.setattr(governor_module, "WINDOW_SECONDS", 0.2)
+    governor = RateGovernor({"openai": (1, 0)})
+
+    async def queue_and_leave():
+        await governor.acquire("openai", "gpt-4o", 0)
+        asyncio.create_task(governor.acquire("openai", "gpt-4o", 0))
+        await asyncio.sleep(0)
+
+    # The loop that queued first closes with its call still waiting
+    asyncio.run(queue_and_leave())
+    asyncio.run(asyncio.wait_for(governor.acquire("openai", "gpt-4o", 0), timeout=1))
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+@pytest.fixture
+def policy(monkeypatch):
+    import AI_core.llm_provider.resilience as resilience
+    from AI_core.llm_provider import CallPolicy
+
+    policy = CallPolicy(timeout=1.0, deadline=5.0, max_retries=2, backoff_base=0.01, hedge_min_samples=3)
+    monkeypatch.setattr(resilience, "_policy", policy)
+    monkeypatch.setattr(resilience, "latencies", resilience.LatencyTracker())
+    return policy
+
+
+@pytest.mark.asyncio
+async def test_retryable_errors_are_retried_then_fall_back(monkeypatch, policy):
+    calls = []
+
+    class FlakyProvider(FakeProvider):
+        def __init__(self, model, failures):
+            super().__init__(response=f"answer from {model}")
+            self.failures = failures
+
+        async def get_chat_response(self, messages, stream, websocket=None):
+            calls.append(self.response)
+            if self.failures:
+                raise self.failures.pop()
+            return self.response
+
+    providers = {"gpt-4o": FlakyProvider("gpt-4o", [RateLimitError("slow down")] * 2), "gpt-4o-mini": FlakyProvider("gpt-4o-mini", [])}
+    monkeypatch.setattr(llm, "get_llm", lambda provider, model, **kwargs: providers[model])
+    messages = [{"role": "user", "content": "Write"}]
+
+    response = await llm.create_chat_completion(messages, model="gpt-4o", llm_provider="openai", use_cache=False)
+    assert response == "answer from gpt-4o" and len(calls) == 3
+
+    providers["gpt-4o"].failures = [RateLimitError("slow down")] * 3
+    policy.fallback = ("openai", "gpt-4o-mini")
+    calls.clear()
+    response = await llm.create_chat_completion(messages, model="gpt-4o", llm_provider="openai", use_cache=False)
+    assert response == "answer from gpt-4o-mini" and len(calls) == 4
+
+    # Errors that would fail again are not retried
+    providers["gpt-4o"].failures = [ValueError("bad request"), RateLimitError("slow down")]
+    policy.fallback = None
+    calls.clear()
+    with pytest.raises(RuntimeError):
+        await llm.create_chat_completion(messages, model="gpt-4o", llm_provider="openai", use_cache=False)
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_slow_calls_are_hedged_and_the_loser_cancelled(monkeypatch, policy):
+    import asyncio
+
+    import AI_core.llm_provider.resilience as resilience
+
+    cancelled = []
+    delays = [0.5, 0.01]
+
+    class SlowProvider(FakeProvider):
+        async def get_chat_response(self, messages, stream, websocket=None):
+            delay = delays.pop(0)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(delay)
+                raise
+            return f"answered after {delay}"
+
+    monkeypatch.setattr(llm, "get_llm", lambda *args, **kwargs: SlowProvider())
+    for _ in range(3):
+        resilience.latencies.record(("openai", "gpt-4o"), 0.05)
+    policy.hedge = True
+
+    response = await llm.create_chat_completion(
+        [{"role": "user", "content": "Write"}], model="gpt-4o", llm_provider="openai", use_cache=False
+    )
+    assert response == "answered after 0.01"
+    assert cancelled == [0.5]
+
+
+@pytest.mark.asyncio
+async def test_time_queued_under_rate_limits_is_not_timed(monkeypatch, policy):
+    import asyncio
+
+    import AI_core.llm_provider.governor as governor_module
+    import AI_core.llm_provider.resilience as resilience
+    from AI_core.llm_provider import RateGovernor
+
+    class QuickProvider(FakeProvider):
+        async def get_chat_response(self, messages, stream, websocket=None):
+            await asyncio.sleep(0.02)
+            return self.response
+
+    monkeypatch.setattr(governor_module, "WINDOW_SECONDS", 0.3)
+    monkeypatch.setattr(governor_module, "_governor", RateGovernor({"openai:gpt-4o": (1, 0)}))
+    monkeypatch.setattr(llm, "get_llm", lambda *args, **kwargs: QuickProvider())
+    policy.timeout, policy.max_retries = 0.2, 0
+
+    # The second call waits longer than the timeout for its slot, then answers in time
+    responses = await asyncio.gather(*[
+        llm.create_chat_completion(
+            [{"role": "user", "content": "Write"}], model="gpt-4o", llm_provider="openai", use_cache=False
+        )
+        for _ in range(2)
+    ])
+    assert responses == [QuickProvider().response] * 2
+    assert resilience.latencies.percentile(("openai", "gpt-4o"), 100, min_samples=2) < 0.2
+
+
+@pytest.mark.asyncio
+async def test_usage_is_taken_from_the_provider_or_counted_once_per_text(monkeypatch, cache):
+    import AI_core.utils.tokens as tokens
+    from AI_core.utils.usage import TokenUsage, record_call_usage, usage_stage
+
+    class ReportingProvider(FakeProvider):
+        async def get_chat_response(self, messages, stream, websocket=None):
+            record_call_usage({"input_tokens": 120, "output_tokens": 30, "total_tokens": 150})
+            return self.response
+
+    set_response_cache(None)
+    ledger = TokenUsage()
+    messages = [{"role": "system", "content": "You are a researcher"}, {"role": "user", "content": "Plan"}]
+
+    monkeypatch.setattr(llm, "get_llm", lambda *args, **kwargs: ReportingProvider())
+    with usage_stage("planning"):
+        await llm.create_chat_completion(
+            messages, model="gpt-4o", llm_provider="openai", cost_callback=lambda cost, usage=None: ledger.add(usage)
+        )
+
+    # Providers without usage metadata are counted with the model's encoder, each text once
+    counted = []
+    count_tokens = tokens.count_tokens
+    monkeypatch.setattr(tokens, "count_tokens", lambda texts, *args: counted.extend(texts) or count_tokens(texts, *args))
+    monkeypatch.setattr(llm, "get_llm", lambda *args, **kwargs: FakeProvider())
+    for _ in range(2):
+        with usage_stage("report"):
+            await llm.create_chat_completion(
+                messages, model="claude-3-5-sonnet", llm_provider="anthropic",
+                cost_callback=lambda cost, usage=None: ledger.add(usage),
+            )
+    assert counted.count("You are a researcher") <= 1 and counted.count("First line\nSecond line\n") <= 1
+
+    # Callbacks taking only the cost keep working
+    costs = []
+    await llm.create_chat_completion(messages, model="claude-3-5-sonnet", llm_provider="anthropic", cost_callback=costs.append)
+    assert len(costs) == 1 and costs[0] > 0
+
+    totals = ledger.totals()
+    assert totals["by_stage"]["planning"]["input_tokens"] == 120
+    assert totals["by_stage"]["planning"]["output_tokens"] == 30
+    assert totals["by_model"]["claude-3-5-sonnet"]["calls"] == 2
+    report = totals["by_stage"]["report"]
+    assert report["input_tokens"] == 2 * sum(tokens.count_tokens(["You are a researcher", "Plan"]))
+    assert report["output_tokens"] == 2 * tokens.count_tokens(["First line\nSecond line\n"])[0]
+    assert report["cost"] > 0
+
+
+class StreamingLLM:
+    """Chat model stand-in streaming scripted chunks: strings, pauses (floats) or errors."""
+
+    def __init__(self, script):
+        self.script = script
+        self.calls = 0
+
+    async def astream(self, messages):
+        import asyncio
+        from types import SimpleNamespace
+
+        self.calls += 1
+        for step in self.script[min(self.calls, len(self.script)) - 1]:
+            if isinstance(step, float):
+                await asyncio.sleep(step)
+            elif isinstance(step, BaseException):
+                raise step
+            else:
+                yield SimpleNamespace(content=step)
+
+
+async def stream(monkeypatch, script):
+    from AI_core.llm_provider import GenericLLMProvider
+
+    model = StreamingLLM(script)
+    monkeypatch.setattr(llm, "get_llm", lambda *args, **kwargs: GenericLLMProvider(model))
+    websocket = FakeWebSocket()
+    try:
+        return await llm.create_chat_completion(
+            [{"role": "user", "content": "Write"}], model="gpt-4o", llm_provider="openai",
+            stream=True, websocket=websocket, use_cache=False,
+        ), model.calls, websocket.sent
+    except RuntimeError:
+        return None, model.calls, websocket.sent
+
+
+@pytest.mark.asyncio
+async def test_streams_are_not_retried_once_output_was_sent(monkeypatch, policy):
+    # Failing before any output: retried
+    response, calls, sent = await stream(monkeypatch, [[RateLimitError("slow down")], ["Intro\n", "Body\n"]])
+    assert response == "Intro\nBody\n" and calls == 2
+    assert [data["output"] for data in sent] == ["Intro\n", "Body\n"]
+
+    # Failing after output: neither retried nor sent to the fallback model
+    policy.fallback = ("openai", "gpt-4o-mini")
+    response, calls, sent = await stream(monkeypatch, [["Intro\n", RateLimitError("slow down")], ["Intro\n", "Body\n"]])
+    assert response is None and calls == 1
+    assert [data["output"] for data in sent] == ["Intro\n"]
+
+
+@pytest.mark.asyncio
+async def test_streams_time_out_when_idle_not_when_long(monkeypatch, policy):
+    policy.timeout, policy.stream_idle_timeout, policy.max_retries = 0.2, 0.2, 0
+
+    # Longer than the per-attempt timeout, but never idle for long
+    response, _, _ = await stream(monkeypatch, [["Intro "] + [0.05, "more "] * 8 + ["\n"]])
+    assert response == "Intro " + "more " * 8 + "\n"
+
+    # No first chunk within the timeout, or a stall after some chunks
+    response, _, _ = await stream(monkeypatch, [[0.5, "late\n"]])
+    assert response is None
+    response, _, sent = await stream(monkeypatch, [["Intro ", 0.5, "stalled\n"]])
+    assert response is None and sent == []
+
+
+@pytest.mark.asyncio
+async def test_only_embeddings_sent_to_the_provider_are_billed(tmp_path):
+    from langchain_core.embeddings import Embeddings
+
+    from AI_core.memory.cache import CachedEmbeddings
+    from AI_core.memory.executor import EmbeddingExecutor
+    from AI_core.utils.tokens import count_tokens
+    from AI_core.utils.usage import embedding_costs_to
+
+    class LengthEmbeddings(Embeddings):
+        def embed_documents(self, texts):
+            return [[float(len(text)), 1.0] for text in texts]
+
+        def embed_query(self, text):
+            return [float(len(text)), 1.0]
+
+    embeddings = CachedEmbeddings.from_config(
+        EmbeddingExecutor(LengthEmbeddings(), model="text-embedding-3-large"), "azure_openai",
+        "text-embedding-3-large", str(tmp_path),
+    )
+    charged = []
+    with embedding_costs_to(lambda cost, usage=None: charged.append(usage)):
+        await embeddings.aembed_documents(["Cats purr.", "Dogs bark."])
+        await embeddings.aembed_documents(["Cats purr.", "Dogs bark.", "Whales sing."])
+    await embeddings.aembed_documents(["Nobody pays for this."])
+
+    assert [usage.model for usage in charged] == ["text-embedding-3-large"] * 2
+    assert [usage.input_tokens for usage in charged] == [
+        sum(count_tokens(["Cats purr.", "Dogs bark."])), count_tokens(["Whales sing."])[0]
+    ]
+
+
+    # Query embeddings of searches are billed like the documents they are compared with
+    from AI_core.context.sections import WrittenSectionIndex
+
+    charged.clear()
+    sections = WrittenSectionIndex(embeddings, cost_callback=lambda cost, usage=None: charged.append(usage))
+    await sections.add_sections([{"section_title": "Pets", "written_content": "Parrots talk."}])
+    await sections.search(["Which birds talk?"])
+    assert [usage.input_tokens for usage in charged] == [
+        count_tokens(["Parrots talk."])[0], count_tokens(["Which birds talk?"])[0]
+    ]
+
+
+def test_cache_limits_and_policy_follow_the_researchers_config(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+
+    import AI_core.llm_provider.cache as cache_module
+    import AI_core.llm_provider.governor as governor_module
+    from AI_core.llm_provider import get_call_policy, get_rate_governor, get_response_cache
+
+    monkeypatch.setattr(cache_module, "_response_cache", False)
+    monkeypatch.setattr(governor_module, "_governor", None)
+    monkeypatch.setattr(governor_module, "_governors", {})
+
+    def config(**overrides):
+        settings = dict(
+            llm_cache_dir=str(tmp_path / "llm"), llm_cache_ttl=60, llm_cache_max_mb=1, llm_cache_max_temperature=0.0,
+            llm_rate_limits="openai=10/0", llm_timeout=5.0, llm_deadline=20.0, llm_stream_idle_timeout=2.0,
+            llm_max_retries=1, llm_hedge=False, llm_fallback="",
+        )
+        return SimpleNamespace(**{**settings, **overrides})
+
+    first, second = config(), config(llm_cache_dir="", llm_rate_limits="openai=1/0", llm_timeout=1.0)
+    assert get_response_cache(first).ttl == 60 and get_response_cache(second) is None
+    assert get_response_cache(first) is get_response_cache(config())
+    # Researchers with the same limits share their budgets
+    assert get_rate_governor(first) is get_rate_governor(config())
+    assert get_rate_governor(second).limits == {"openai": (1, 0)}
+    assert get_call_policy(first).timeout == 5.0 and get_call_policy(second).timeout == 1.0
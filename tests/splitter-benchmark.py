@@ -0,0 +1,65 @@
+"""
+Compares the token-aware ChunkSplitter with the RecursiveCharacterTextSplitter it replaced.
+RecursiveCharacterTextSplitter only measures characters, while ChunkSplitter also counts the
+tokens of every sentence, so expect it to be somewhat slower in exchange for chunks that
+respect the token limit and sentence boundaries.
+
+    python tests/splitter-benchmark.py
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# Run from anywhere without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from AI_core.context.splitter import ChunkSplitter
+from AI_core.utils.tokens import count_tokens
+
+
+def make_corpus(pages: int = 200, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    words = "the of reputation brand customer review market analysis sentiment growth risk data report".split()
+    corpus = []
+    for _ in range(pages):
+        paragraphs = []
+        for _ in range(rng.randint(5, 40)):
+            if rng.random() < 0.2:
+                paragraphs.append(" ".join(rng.choices(words, k=rng.randint(2, 6))).title())
+            sentences = [
+                " ".join(rng.choices(words, k=rng.randint(5, 30))).capitalize() + "."
+                for _ in range(rng.randint(1, 8))
+            ]
+            paragraphs.append(" ".join(sentences))
+        corpus.append("\n".join(paragraphs))
+    return corpus
+
+
+def run(name: str, split, corpus: list) -> None:
+    start = time.perf_counter()
+    chunks = [split(text) for text in corpus]
+    elapsed = time.perf_counter() - start
+
+    texts = [
+        text[chunk[0]:chunk[1]] if isinstance(chunk, tuple) else chunk
+        for text, page_chunks in zip(corpus, chunks) for chunk in page_chunks
+    ]
+    tokens = count_tokens(texts)
+    stored = sum(sys.getsizeof(chunk) for page_chunks in chunks for chunk in page_chunks)
+    print(
+        f"{name:>32}: {elapsed * 1000:8.1f} ms  {len(texts):6d} chunks  "
+        f"tokens/chunk {statistics.mean(tokens):6.1f} ± {statistics.pstdev(tokens):5.1f} (max {max(tokens)})  "
+        f"stored {stored / 1024:8.1f} KiB"
+    )
+
+
+if __name__ == "__main__":
+    corpus = make_corpus()
+    print(f"{len(corpus)} pages, {sum(map(len, corpus)) / 1024:.0f} KiB of text")
+    run("RecursiveCharacterTextSplitter", RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100).split_text, corpus)
+    run("ChunkSplitter.split_text", ChunkSplitter().split_text, corpus)
+    run("ChunkSplitter.split_offsets", ChunkSplitter().split_offsets, corpus)
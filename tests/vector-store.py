@@ -1,12 +1,15 @@
 import asyncio
+import hashlib
 import pytest
 from typing import List
 from AI_core import RepintelAI
+from AI_core.vector_store import LocalVectorStore, VectorStoreWrapper
 
 from langchain.text_splitter import CharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS, InMemoryVectorStore
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 
 
 # taken from https://paulgraham.com/persistence.html
@@ -234,3 +237,93 @@ async def test_store_in_vector_store_hybrids():
     related_contexts = await vector_store.asimilarity_search("GPT-4", k=2)
     
     assert len(related_contexts) == 2
+
+
+class HashEmbeddings(Embeddings):
+    """Deterministic bag-of-words embeddings, so the local store can be tested offline."""
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * 32
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 32] += 1.0
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def test_local_vector_store_filters_and_persists(tmp_path):
+    docs = load_document()
+    for i, doc in enumerate(docs):
+        doc.metadata = {"source": f"essay-{i % 3}", "part": i}
+    store = LocalVectorStore(HashEmbeddings(), str(tmp_path), index_type="ivf", min_index_size=10, nprobe=100)
+    ids = store.add_documents(docs)
+
+    reopened = LocalVectorStore(HashEmbeddings(), str(tmp_path), index_type="ivf", nprobe=100)
+    results = reopened.similarity_search(docs[5].page_content, k=3)
+    filtered = reopened.similarity_search(docs[5].page_content, k=3, filter={"source": "essay-1"})
+    reopened.delete(filter={"part": {"$lt": 3}})
+
+    assert len(reopened) == len(docs) - 3
+    assert results[0].id == ids[5]
+    assert filtered and all(doc.metadata["source"] == "essay-1" for doc in filtered)
+    assert not reopened.get_by_ids(ids[:3])
+
+
+def test_ivf_search_reads_only_the_probed_lists(tmp_path):
+    import numpy as np
+
+    texts = [f"note {i} about topic {i % 40}" for i in range(400)]
+    store = LocalVectorStore(HashEmbeddings(), str(tmp_path), index_type="ivf", min_index_size=100, nprobe=2)
+    ids = store.add_texts(texts)
+    later = store.add_texts(["a note added after the index was built"])
+
+    reopened = LocalVectorStore(HashEmbeddings(), str(tmp_path), index_type="ivf", nprobe=2)
+    for searched in (store, reopened):
+        query = np.asarray(HashEmbeddings().embed_query(texts[7]), dtype=np.float32)
+        rows = searched._probe_rows(query / np.linalg.norm(query))
+        assert 0 < len(rows) < 401 and np.all(np.diff(rows) > 0)
+        assert searched.similarity_search(texts[7], k=1)[0].id == ids[7]
+        assert searched.similarity_search("a note added after the index was built", k=1)[0].id == later[0]
+
+
+@pytest.mark.asyncio
+async def test_aload_skips_stored_chunks_and_upserts(tmp_path):
+    store = LocalVectorStore(HashEmbeddings(), str(tmp_path))
+    wrapper = VectorStoreWrapper(store, batch_size=2)
+    page = {"url": "essay.html", "raw_content": essay}
+
+    added = await asyncio.gather(wrapper.aload([page]), wrapper.aload([page]))
+    reloaded = await VectorStoreWrapper(store).aload([page])
+    size = len(store)
+    await wrapper.aload([{"url": "essay.html", "raw_content": essay[:2000]}], upsert=True)
+
+    assert sorted(map(len, added))[0] == 0 and size == sum(map(len, added))
+    assert reloaded == []
+    assert 0 < len(store) < size
+
+
+@pytest.mark.asyncio
+async def test_multi_query_search_embeds_once_and_dedupes(tmp_path):
+    class CountingHashEmbeddings(HashEmbeddings):
+        calls = 0
+
+        def embed_documents(self, texts):
+            self.calls += 1
+            return super().embed_documents(texts)
+
+    embeddings = CountingHashEmbeddings()
+    store = LocalVectorStore(embeddings, str(tmp_path))
+    wrapper = VectorStoreWrapper(store)
+    await wrapper.aload([{"url": "essay.html", "raw_content": essay}])
+    calls = embeddings.calls
+
+    results = await wrapper.amulti_similarity_search(["persistent people", "obstinate people", "persistent"], k=4)
+
+    assert embeddings.calls == calls + 1
+    assert len(results) == 3 and results[0]
+    ids = [doc.id for docs in results for doc in docs]
+    assert len(ids) == len(set(ids))